@@ -0,0 +1,194 @@
+"""
+Latency breakdown shown under a page's result: where the backend spent its time
+(IAM token, queueing, watsonx.ai, PDF extraction, parsing), the network and
+client overhead of the round trip, and the time this page took to render it.
+
+The backend reports its stages in the `Server-Timing` header and, when asked
+with `X-Timings: 1`, as a complete `timings` object in JSON bodies and in the
+`done` event of streamed replies.
+
+With TRACING_ENABLED=true every request also starts a W3C trace that the
+backend continues. If the OpenTelemetry SDK and OTLP exporter are installed,
+the client and render spans are exported to TRACING_OTLP_ENDPOINT (e.g.
+tools/trace_collector.py); otherwise only the `traceparent` header is sent.
+"""
+import os
+import random
+import time
+from contextlib import contextmanager, nullcontext
+from urllib.parse import urlparse
+
+import requests
+import streamlit as st
+
+TIMINGS_HEADERS = {"X-Timings": "1"}
+
+TRACING_ENABLED = os.getenv("TRACING_ENABLED", "false").lower() in ("1", "true", "yes")
+# Share of page requests traced; the backend follows the decision carried in `traceparent`
+TRACING_SAMPLE_RATIO = float(os.getenv("TRACING_SAMPLE_RATIO", "1.0"))
+TRACING_OTLP_ENDPOINT = os.getenv("TRACING_OTLP_ENDPOINT", "http://127.0.0.1:4318/v1/traces")
+
+STAGE_LABELS = {
+    "token_fetch": "IAM token",
+    "queue_wait": "Queue wait",
+    "upstream": "watsonx.ai",
+    "pdf_extraction": "PDF extraction (PyMuPDF)",
+    "response_parsing": "Response parsing",
+    "serialization": "Serialization",
+}
+
+
+@st.cache_resource
+def _tracer():
+    """OpenTelemetry tracer of the frontend, or None without tracing or the SDK"""
+    if not TRACING_ENABLED:
+        return None
+    try:
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+        from opentelemetry.sdk.resources import Resource
+        from opentelemetry.sdk.trace import TracerProvider
+        from opentelemetry.sdk.trace.export import BatchSpanProcessor
+        from opentelemetry.sdk.trace.sampling import TraceIdRatioBased
+    except ImportError:
+        return None
+    provider = TracerProvider(
+        resource=Resource.create({"service.name": "smartsdlc-frontend"}),
+        sampler=TraceIdRatioBased(TRACING_SAMPLE_RATIO),
+    )
+    provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter(endpoint=TRACING_OTLP_ENDPOINT)))
+    return provider.get_tracer("smartsdlc.frontend")
+
+
+def _traceparent() -> tuple:
+    """(header value, trace id) of a new root span, for when the SDK is not available"""
+    trace_id = f"{random.getrandbits(128):032x}"
+    flags = "01" if random.random() < TRACING_SAMPLE_RATIO else "00"
+    return f"00-{trace_id}-{random.getrandbits(64):016x}-{flags}", trace_id if flags == "01" else None
+
+
+def latency_toggle() -> bool:
+    """Checkbox turning the breakdown on for this session"""
+    return st.checkbox("⏱️ Show latency breakdown", key="show_latency_breakdown")
+
+
+def parse_server_timing(value: str) -> dict:
+    """{"upstream": 812.4, ...} from a `Server-Timing` header value"""
+    timings = {}
+    for metric in value.split(","):
+        name, _, params = metric.strip().partition(";")
+        for param in params.split(";"):
+            key, _, duration = param.strip().partition("=")
+            if name and key == "dur":
+                try:
+                    timings[name] = float(duration)
+                except ValueError:
+                    pass
+    return timings
+
+
+class LatencyTrace:
+    """Timings of one request, from the click to the rendered result"""
+
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self.server = {}
+        self.round_trip_ms = None
+        self.render_ms = None
+        # Rendering done while a reply was still streaming in
+        self.render_in_flight_ms = 0.0
+        self._sent = None
+        # Id of the sampled trace this request belongs to, and its client span
+        self.trace_id = None
+        self._span_context = None
+
+    def start(self):
+        self._sent = time.perf_counter()
+
+    def finish(self, timings: dict = None, headers=None):
+        """Note the end of the round trip, with the backend's timings or its response headers"""
+        if self._sent is not None:
+            self.round_trip_ms = (time.perf_counter() - self._sent) * 1000
+        if timings:
+            self.server = timings
+        elif headers is not None:
+            self.server = parse_server_timing(headers.get("Server-Timing", ""))
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        """requests.post that times the round trip, asks for the backend's timings and starts a trace"""
+        headers = dict(kwargs.get("headers") or {})
+        if self.enabled:
+            headers.update(TIMINGS_HEADERS)
+        kwargs["headers"] = headers
+        tracer = _tracer()
+        if tracer is not None:
+            from opentelemetry.propagate import inject
+            from opentelemetry.trace import SpanKind
+
+            with tracer.start_as_current_span(
+                f"POST {urlparse(url).path}", kind=SpanKind.CLIENT, attributes={"url.full": url}
+            ) as span:
+                inject(headers)
+                self.start()
+                response = requests.post(url, **kwargs)
+                span.set_attribute("http.response.status_code", response.status_code)
+            context = span.get_span_context()
+            if context.trace_flags.sampled:
+                self.trace_id = format(context.trace_id, "032x")
+                self._span_context = context
+        else:
+            if TRACING_ENABLED:
+                headers["traceparent"], self.trace_id = _traceparent()
+            self.start()
+            response = requests.post(url, **kwargs)
+        timings = None
+        if self.enabled and response.headers.get("Content-Type", "").startswith("application/json"):
+            try:
+                body = response.json()
+                timings = body.get("timings") if isinstance(body, dict) else None
+            except ValueError:
+                pass
+        self.finish(timings, response.headers)
+        return response
+
+    @contextmanager
+    def rendering(self):
+        """Time spent rendering the result; repeated blocks (e.g. streamed tokens) add up"""
+        started = time.perf_counter()
+        try:
+            with self._render_span():
+                yield
+        finally:
+            elapsed = (time.perf_counter() - started) * 1000
+            self.render_ms = (self.render_ms or 0.0) + elapsed
+            if self._sent is not None and self.round_trip_ms is None:
+                self.render_in_flight_ms += elapsed
+
+    def _render_span(self):
+        # A child of the request's client span, started after that one ended
+        tracer = _tracer()
+        if tracer is None or self._span_context is None:
+            return nullcontext()
+        from opentelemetry import trace
+
+        parent = trace.set_span_in_context(trace.NonRecordingSpan(self._span_context))
+        return tracer.start_as_current_span("render", context=parent)
+
+    def show(self):
+        if not self.enabled or self.round_trip_ms is None:
+            return
+        rows = [
+            {"Stage": STAGE_LABELS.get(name, name), "ms": round(ms, 1)}
+            for name, ms in self.server.items() if name != "total"
+        ]
+        server_total = self.server.get("total")
+        if server_total is not None:
+            rows.append({"Stage": "Backend total", "ms": round(server_total, 1)})
+            overhead = self.round_trip_ms - server_total - self.render_in_flight_ms
+            rows.append({"Stage": "Network & client", "ms": round(max(overhead, 0.0), 1)})
+        rows.append({"Stage": "Round trip", "ms": round(self.round_trip_ms, 1)})
+        if self.render_ms is not None:
+            rows.append({"Stage": "Render", "ms": round(self.render_ms, 1)})
+        with st.expander("⏱️ Latency breakdown", expanded=True):
+            st.table(rows)
+            if self.trace_id:
+                st.caption(f"Trace id: {self.trace_id}")
@@ -3,6 +3,8 @@ import requests
 import time
 import json
 
+from latency import LatencyTrace, latency_toggle
+
 st.set_page_config(page_title="SmartSDLC - Bug Fixer", layout="wide")
 
 # --- Enhanced Global CSS ---
@@ -28,7 +30,8 @@ class BugFixerBackend:
     def __init__(self):
         self.backend_url = "http://127.0.0.1:8000/fix-bug/"
 
-    def send_to_backend(self, code: str, programming_language: str = "python") -> dict:
+    def send_to_backend(self, code: str, programming_language: str = "python", trace: LatencyTrace = None) -> dict:
+        trace = trace or LatencyTrace(enabled=False)
         try:
             headers = {
                 'Content-Type': 'application/json',
@@ -39,7 +42,7 @@ class BugFixerBackend:
                 'programming_language': programming_language,
                 'analysis_type': 'comprehensive'
             }
-            response = requests.post(
+            response = trace.post(
                 self.backend_url,
                 json=payload,
                 headers=headers,
@@ -134,6 +137,8 @@ if uploaded_file is not None:
     except Exception as e:
         st.error(f"❌ Error reading file: {str(e)}")
 
+show_latency = latency_toggle()
+
 # --- Fix Button with Backend Integration ---
 col1, col2, col3 = st.columns([1, 2, 1])
 with col2:
@@ -149,7 +154,8 @@ with col2:
                 </div>
             """, unsafe_allow_html=True)
             
-            result = bug_fixer.send_to_backend(code)
+            trace = LatencyTrace(enabled=show_latency)
+            result = bug_fixer.send_to_backend(code, trace=trace)
             
             result_placeholder.empty()  # Clear the loading animation
             
@@ -166,15 +172,17 @@ with col2:
                 
                 
                 # Display fixed code
-                if fixed_code and fixed_code != code:
-                    st.markdown("""
-                        <h3 style="color: #00c3ff; font-family: 'Orbitron', sans-serif; font-size: 1.5rem;">
-                            🛠️ Fixed Code
-                        </h3>
-                    """, unsafe_allow_html=True)
-                    st.code(fixed_code, language="python")
-                else:
-                    st.success("🎉 No bugs found or no changes made to your code!")
+                with trace.rendering():
+                    if fixed_code and fixed_code != code:
+                        st.markdown("""
+                            <h3 style="color: #00c3ff; font-family: 'Orbitron', sans-serif; font-size: 1.5rem;">
+                                🛠️ Fixed Code
+                            </h3>
+                        """, unsafe_allow_html=True)
+                        st.code(fixed_code, language="python")
+                    else:
+                        st.success("🎉 No bugs found or no changes made to your code!")
+                trace.show()
                 
                 # Display response metadata
                 
@@ -1,6 +1,17 @@
 import streamlit as st
 import requests
 import json
+import uuid
+from contextlib import nullcontext
+
+from latency import LatencyTrace, latency_toggle
+
+try:
+    from websockets.sync.client import connect as ws_connect
+    from websockets.exceptions import ConnectionClosed
+except ImportError:
+    # Without the `websockets` package replies come back in one piece over HTTP
+    ws_connect = None
 
 
 st.set_page_config(page_title="SmartSDLC - Chatbot", layout="wide")
@@ -11,6 +22,8 @@ st.markdown("""
 
 API_BASE_URL = "http://127.0.0.1:8000/"  
 CHAT_ENDPOINT = f"{API_BASE_URL}/chat/"
+WS_CHAT_ENDPOINT = "ws://127.0.0.1:8000/ws/chat"
+WS_REPLY_TIMEOUT = 120  # seconds without any frame before giving up on a reply
 def load_css(file_name: str):
     with open(file_name) as f:
         st.markdown(f"<style>{f.read()}</style>", unsafe_allow_html=True)
@@ -25,13 +38,16 @@ if 'is_loading' not in st.session_state:
     st.session_state.is_loading = False
 if 'message_count' not in st.session_state:
     st.session_state.message_count = 0
+if 'chat_session_id' not in st.session_state:
+    # The backend keeps the conversation history under this id
+    st.session_state.chat_session_id = str(uuid.uuid4())
 
 # Function to call the chat API
-def call_chat_api(message: str):
+def call_chat_api(message: str, trace: LatencyTrace):
     """Call the FastAPI chat endpoint"""
     try:
-        payload = {"message": message}
-        response = requests.post(
+        payload = {"message": message, "session_id": st.session_state.chat_session_id}
+        response = trace.post(
             CHAT_ENDPOINT,
             json=payload,
             headers={"Content-Type": "application/json"},
@@ -61,6 +77,84 @@ def call_chat_api(message: str):
             "message": f"An unexpected error occurred: {str(e)}"
         }
 
+def render_ai_message(placeholder, content: str):
+    clean_content = content.replace('\n', '<br>')
+    placeholder.markdown(f'''
+    <div class="chat-message ai-message">
+        <strong>🤖 AI Assistant:</strong><br>
+        {clean_content}
+    </div>
+    ''', unsafe_allow_html=True)
+
+def get_chat_socket():
+    """One WebSocket per browser session, kept across reruns"""
+    if st.session_state.get('chat_socket') is None:
+        st.session_state.chat_socket = ws_connect(WS_CHAT_ENDPOINT, open_timeout=5)
+    return st.session_state.chat_socket
+
+def reset_chat_socket():
+    socket = st.session_state.pop('chat_socket', None)
+    if socket is not None:
+        try:
+            socket.close()
+        except Exception:
+            pass
+
+# Function to stream a reply over the chat WebSocket
+def stream_chat_reply(message: str, placeholder, trace: LatencyTrace):
+    """Stream the reply from /ws/chat into `placeholder`; returns None if the WebSocket is unavailable"""
+    if ws_connect is None:
+        return None
+
+    conversation_id = str(uuid.uuid4())
+    frame = json.dumps({
+        "type": "chat",
+        "conversation_id": conversation_id,
+        "session_id": st.session_state.chat_session_id,
+        "message": message,
+    })
+
+    # The socket from an earlier run may have been closed by the server: reconnect once
+    for attempt in range(2):
+        try:
+            socket = get_chat_socket()
+            trace.start()
+            socket.send(frame)
+            break
+        except (ConnectionClosed, OSError):
+            reset_chat_socket()
+    else:
+        return None
+
+    reply = ""
+    try:
+        while True:
+            event = json.loads(socket.recv(timeout=WS_REPLY_TIMEOUT))
+            if event.get('type') == 'ping':
+                socket.send(json.dumps({"type": "pong"}))
+                continue
+            if event.get('conversation_id') != conversation_id:
+                continue
+
+            if event['type'] == 'token':
+                reply += event['content']
+                with trace.rendering():
+                    render_ai_message(placeholder, reply)
+            elif event['type'] == 'done':
+                trace.finish(event.get('timings'))
+                return {"content": reply}
+            elif event['type'] == 'error':
+                prefix = f"API Error {event['status']}" if event.get('status') else "API Error"
+                return {"error": True, "message": f"{prefix}: {event.get('detail')}"}
+            elif event['type'] == 'cancelled':
+                return {"error": True, "message": "The reply was cancelled."}
+    except TimeoutError:
+        reset_chat_socket()
+        return {"error": True, "message": "Request timed out. Please try again."}
+    except (ConnectionClosed, OSError) as e:
+        reset_chat_socket()
+        return {"error": True, "message": f"Lost the connection to the chat server: {str(e)}"}
+
 
 
 # --- Header ---
@@ -99,8 +193,13 @@ st.markdown("""
 """, unsafe_allow_html=True)
 
 
+show_latency = latency_toggle()
+# Timings of the last reply; replies over HTTP are rendered on the rerun after they arrive
+last_trace = st.session_state.get('last_latency')
+measure_render = last_trace is not None and last_trace.render_ms is None
+
 chat_container = st.container()
-with chat_container:
+with chat_container, (last_trace.rendering() if measure_render else nullcontext()):
     if st.session_state.chat_history:
         # Use st.markdown for the container
         
@@ -141,6 +240,9 @@ with chat_container:
                 <p style="color: #b3b3b8; font-size: 1rem; text-align: center;font-family: 'Orbitron', sans-serif;">
                     Your conversation with the AI will appear here...</p>""", unsafe_allow_html=True)
 
+if show_latency and last_trace is not None:
+    last_trace.show()
+
 # --- Chat Input Section ---
 st.markdown("""
     <div style="margin: 2rem 0;">
@@ -164,6 +266,8 @@ with col1:
 with col2:
     if st.button("🗑️ Clear Chat", key="clear_chat"):
         st.session_state.chat_history = []
+        # Start a fresh conversation on the backend as well
+        st.session_state.chat_session_id = str(uuid.uuid4())
         st.rerun()
 
 # --- Send Message Button ---
@@ -178,32 +282,50 @@ if st.button("🚀 Send Message", disabled=st.session_state.is_loading or not ch
             'content': chat_input.strip()
         })
         
-        # Show loading animation
-        with st.spinner("🤖 AI is processing your message..."):
-            # Call the API
-            response = call_chat_api(chat_input.strip())
-            
-            if response.get('error'):
-                # Add error message to chat history
+        # Stream the reply token by token over the WebSocket
+        reply_placeholder = st.empty()
+        trace = LatencyTrace(enabled=show_latency)
+        st.session_state.last_latency = trace
+        streamed = stream_chat_reply(chat_input.strip(), reply_placeholder, trace)
+
+        if streamed is not None:
+            if streamed.get('error'):
                 st.session_state.chat_history.append({
                     'role': 'error',
-                    'content': response['message']
+                    'content': streamed['message']
                 })
             else:
-                # Add AI response to chat history
-                # IBM Watson ML uses OpenAI-compatible response format
-                try:
-                    ai_response = response['choices'][0]['message']['content']
-                    if not ai_response or ai_response.strip() == "":
-                        ai_response = "Empty response received from AI"
-                except (KeyError, IndexError, TypeError) as e:
-                    ai_response = f"Error parsing response: {str(e)}. Full response: {json.dumps(response, indent=2)}"
-                ai_response = ai_response.strip()
-
                 st.session_state.chat_history.append({
                     'role': 'assistant',
-                    'content': ai_response
+                    'content': streamed['content'].strip() or "Empty response received from AI"
                 })
+        else:
+            # Show loading animation
+            with st.spinner("🤖 AI is processing your message..."):
+                # Call the API
+                response = call_chat_api(chat_input.strip(), trace)
+            
+                if response.get('error'):
+                    # Add error message to chat history
+                    st.session_state.chat_history.append({
+                        'role': 'error',
+                        'content': response['message']
+                    })
+                else:
+                    # Add AI response to chat history
+                    # IBM Watson ML uses OpenAI-compatible response format
+                    try:
+                        ai_response = response['choices'][0]['message']['content']
+                        if not ai_response or ai_response.strip() == "":
+                            ai_response = "Empty response received from AI"
+                    except (KeyError, IndexError, TypeError) as e:
+                        ai_response = f"Error parsing response: {str(e)}. Full response: {json.dumps(response, indent=2)}"
+                    ai_response = ai_response.strip()
+
+                    st.session_state.chat_history.append({
+                        'role': 'assistant',
+                        'content': ai_response
+                    })
         
         # Reset loading state and increment message count to clear input
         st.session_state.is_loading = False
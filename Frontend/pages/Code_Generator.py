@@ -2,6 +2,8 @@ import streamlit as st
 import requests
 import json
 
+from latency import LatencyTrace, latency_toggle
+
 st.set_page_config(page_title="SmartSDLC - Code Generator", layout="wide")
 def load_css(file_name: str):
     with open(file_name) as f:
@@ -65,6 +67,8 @@ code_requirements = st.text_area(
     key="code_requirements_input"
 )
 
+show_latency = latency_toggle()
+
 # --- Generate Button ---
 if st.button("🚀 Generate Code"):
     if code_requirements.strip():
@@ -75,7 +79,8 @@ if st.button("🚀 Generate Code"):
                 payload = {
                     "prompt": code_requirements,
                 }
-                response = requests.post(API_URL, json=payload)
+                trace = LatencyTrace(enabled=show_latency)
+                response = trace.post(API_URL, json=payload)
                 response.raise_for_status()
                 data = response.json()
 
@@ -89,14 +94,16 @@ if st.button("🚀 Generate Code"):
                 else:
                     # Display generated code
                     code = data.get("generated_code", "")
-                    st.markdown(f"""
-                        
-                            <h3 style="color: #00c3ff; font-family: 'Orbitron', sans-serif; font-size: 1.5rem; margin-bottom: 1rem;">
-                                Generated Code
-                            </h3>
-                        
-                    """, unsafe_allow_html=True)
-                    st.code(code)
+                    with trace.rendering():
+                        st.markdown(f"""
+                            
+                                <h3 style="color: #00c3ff; font-family: 'Orbitron', sans-serif; font-size: 1.5rem; margin-bottom: 1rem;">
+                                    Generated Code
+                                </h3>
+                            
+                        """, unsafe_allow_html=True)
+                        st.code(code)
+                    trace.show()
             except requests.RequestException as e:
                 st.markdown(f"""
                     <div class="stError">
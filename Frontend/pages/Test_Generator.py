@@ -2,6 +2,8 @@ import streamlit as st
 import requests
 import time
 
+from latency import LatencyTrace, latency_toggle
+
 st.set_page_config(page_title="SmartSDLC - Test Generator", layout="wide")
 
 # --- Enhanced Global CSS ---
@@ -325,10 +327,11 @@ class TestGeneratorBackend:
     def __init__(self):
         self.backend_url = "http://127.0.0.1:8000/generate-test-cases/"
 
-    def generate_test_cases(self, code: str, programming_language: str = "python", test_framework: str = None) -> dict:
+    def generate_test_cases(self, code: str, programming_language: str = "python", test_framework: str = None, trace: LatencyTrace = None) -> dict:
         """
         Submit code to backend to generate test cases
         """
+        trace = trace or LatencyTrace(enabled=False)
         try:
             headers = {
                 'Content-Type': 'application/json',
@@ -341,7 +344,7 @@ class TestGeneratorBackend:
                 "test_framework": test_framework
             }
             
-            response = requests.post(
+            response = trace.post(
                 self.backend_url,
                 json=data,
                 headers=headers,
@@ -439,6 +442,8 @@ if uploaded_file is not None:
     except Exception as e:
         st.error(f"❌ Error reading file: {str(e)}")
 
+show_latency = latency_toggle()
+
 # --- Generate Tests Button ---
 col1, col2, col3 = st.columns([1, 2, 1])
 with col2:
@@ -461,32 +466,36 @@ with col2:
             """, unsafe_allow_html=True)
             
             # Submit to backend
+            trace = LatencyTrace(enabled=show_latency)
             result = backend.generate_test_cases(
                 code=code_input,
                 programming_language="python",  # Default to Python, can be extended for other languages
-                test_framework="pytest"  # Default to pytest
+                test_framework="pytest",  # Default to pytest
+                trace=trace
             )
             
             if result.get('success'):
-                # Display results
-                result_placeholder.markdown("""
-                    <div class="result-container">
-                        <h3 style="color: #69f0ae; font-family: 'Orbitron', sans-serif; font-size: 1.5rem; margin-bottom: 1rem;">
-                            ✅ Generated Test Cases
-                        </h3>
-                    </div>
-                """, unsafe_allow_html=True)
-                
-                # Display original code
-                st.markdown("**Original Code**")
-                st.code(result['data']['original_code'], language="python")
-                
-                # Display generated tests
-                st.markdown("**Generated Test Cases**")
-                st.code(result['data']['generated_tests'], language="python")
-                
-                # Display message
-                st.success(result['data']['message'])
+                with trace.rendering():
+                    # Display results
+                    result_placeholder.markdown("""
+                        <div class="result-container">
+                            <h3 style="color: #69f0ae; font-family: 'Orbitron', sans-serif; font-size: 1.5rem; margin-bottom: 1rem;">
+                                ✅ Generated Test Cases
+                            </h3>
+                        </div>
+                    """, unsafe_allow_html=True)
+                    
+                    # Display original code
+                    st.markdown("**Original Code**")
+                    st.code(result['data']['original_code'], language="python")
+                    
+                    # Display generated tests
+                    st.markdown("**Generated Test Cases**")
+                    st.code(result['data']['generated_tests'], language="python")
+                    
+                    # Display message
+                    st.success(result['data']['message'])
+                trace.show()
                 
                 # Reset form
                 
@@ -1,7 +1,12 @@
 import streamlit as st
 import requests
+import hashlib
 import json
+import os
 import re
+import time
+
+from latency import LatencyTrace, latency_toggle
 
 st.set_page_config(page_title="SmartSDLC - Upload and Classify", layout="wide")
 
@@ -292,13 +297,96 @@ st.markdown("""
 
 # Configuration
 API_BASE_URL = "http://localhost:8000"
+# Files larger than this go through the resumable chunked upload API
+CHUNKED_UPLOAD_THRESHOLD = int(float(os.getenv("CHUNKED_UPLOAD_THRESHOLD_MB", "2")) * 2 ** 20)
+CHUNK_ATTEMPTS = 4
+
+# Function to send one chunk, retrying network errors and damaged chunks
+def put_chunk(upload_id: str, offset: int, chunk: bytes):
+    checksum = hashlib.sha256(chunk).hexdigest()
+    for attempt in range(CHUNK_ATTEMPTS):
+        try:
+            response = requests.put(
+                f"{API_BASE_URL}/uploads/{upload_id}",
+                params={"offset": offset},
+                data=chunk,
+                headers={"X-Chunk-SHA256": checksum, "Content-Type": "application/octet-stream"},
+                timeout=60,
+            )
+            # 400 is a checksum mismatch (the chunk was damaged on the way): send it again
+            if response.status_code == 200:
+                return
+            if response.status_code not in (400, 429) and response.status_code < 500:
+                response.raise_for_status()
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+            if attempt == CHUNK_ATTEMPTS - 1:
+                raise
+        time.sleep(2 ** attempt)
+    raise requests.exceptions.RetryError(f"Chunk at byte {offset} failed {CHUNK_ATTEMPTS} times")
+
+# Function to upload a large file in chunks, resuming the session of an earlier attempt
+def upload_in_chunks(uploaded_file) -> str:
+    digest = hashlib.sha256()
+    uploaded_file.seek(0)
+    for block in iter(lambda: uploaded_file.read(2 ** 20), b""):
+        digest.update(block)
+    key = f"{uploaded_file.name}:{uploaded_file.size}:{digest.hexdigest()}"
+    sessions = st.session_state.setdefault("chunked_uploads", {})
+
+    info = None
+    if key in sessions:
+        response = requests.get(f"{API_BASE_URL}/uploads/{sessions[key]}", timeout=30)
+        if response.status_code == 200:
+            info = response.json()
+            if info["completed"]:
+                return info["upload_id"]
+    if info is None:
+        response = requests.post(
+            f"{API_BASE_URL}/uploads",
+            json={"filename": uploaded_file.name, "size": uploaded_file.size, "sha256": digest.hexdigest()},
+            timeout=30,
+        )
+        response.raise_for_status()
+        info = response.json()
+        sessions[key] = info["upload_id"]
+
+    upload_id, chunk_size, total = info["upload_id"], info["chunk_size"], uploaded_file.size
+    sent = info["received_bytes"]
+    progress = st.progress(sent / total, text="📤 Resuming upload..." if sent else "📤 Uploading...")
+    for start, end in info["missing"]:
+        for offset in range(start, end, chunk_size):
+            uploaded_file.seek(offset)
+            chunk = uploaded_file.read(min(chunk_size, end - offset))
+            put_chunk(upload_id, offset, chunk)
+            sent += len(chunk)
+            progress.progress(sent / total, text=f"📤 Uploaded {sent / 2 ** 20:.1f} of {total / 2 ** 20:.1f} MB")
+
+    response = requests.post(f"{API_BASE_URL}/uploads/{upload_id}/complete", timeout=120)
+    if response.status_code == 422:
+        # The assembled file did not match: start over next time
+        sessions.pop(key, None)
+    response.raise_for_status()
+    progress.empty()
+    return upload_id
 
 # Function to make API request
-def classify_pdf(uploaded_file):
+def classify_pdf(uploaded_file, trace: LatencyTrace):
+    chunked = uploaded_file.size > CHUNKED_UPLOAD_THRESHOLD
     try:
-        files = {"file": (uploaded_file.name, uploaded_file.getvalue(), "application/pdf")}
-        with st.spinner("🤖 AI is analyzing your PDF..."):
-            response = requests.post(f"{API_BASE_URL}/classify-pdf-sdlc/", files=files, timeout=120)
+        if chunked:
+            upload_id = upload_in_chunks(uploaded_file)
+            with st.spinner("🤖 AI is analyzing your PDF..."):
+                response = trace.post(f"{API_BASE_URL}/classify-pdf-sdlc/", params={"upload_id": upload_id}, timeout=120)
+            if response.status_code == 200:
+                # Classified: the server copy is no longer needed
+                requests.delete(f"{API_BASE_URL}/uploads/{upload_id}", timeout=30)
+                st.session_state.chunked_uploads = {
+                    key: value for key, value in st.session_state.chunked_uploads.items() if value != upload_id
+                }
+        else:
+            files = {"file": (uploaded_file.name, uploaded_file.getvalue(), "application/pdf")}
+            with st.spinner("🤖 AI is analyzing your PDF..."):
+                response = trace.post(f"{API_BASE_URL}/classify-pdf-sdlc/", files=files, timeout=120)
         if response.status_code == 200:
             return response.json()
         else:
@@ -306,9 +394,13 @@ def classify_pdf(uploaded_file):
             return None
     except requests.exceptions.ConnectionError:
         st.error("❌ Could not connect to the API server. Please ensure the FastAPI server is running.")
+        if chunked:
+            st.info("🔁 The chunks already sent are kept: click Classify again to resume the upload.")
         return None
     except requests.exceptions.Timeout:
         st.error("⏱️ Request timed out. The file might be too large or the server is busy.")
+        if chunked:
+            st.info("🔁 The chunks already sent are kept: click Classify again to resume the upload.")
         return None
     except Exception as e:
         st.error(f"❌ An unexpected error occurred: {str(e)}")
@@ -399,6 +491,8 @@ uploaded_file = st.file_uploader(
 # --- Debug Toggle ---
 # debug_mode = st.checkbox("Show raw backend response for debugging", value=False)
 
+show_latency = latency_toggle()
+
 # --- Classify Button ---
 col1, col2, col3 = st.columns([1, 2, 1])
 with col2:
@@ -417,86 +511,89 @@ with col2:
             """, unsafe_allow_html=True)
             
             # Make API call
-            result = classify_pdf(uploaded_file)
+            trace = LatencyTrace(enabled=show_latency)
+            result = classify_pdf(uploaded_file, trace)
             
             # Clear loading animation
             result_placeholder.empty()
             
-            if result and "classified_sentences" in result:
-                # Display raw response if debug mode is enabled
-                # if debug_mode:
-                #     st.subheader("Raw Backend Response")
-                #     st.code(json.dumps(result, indent=2))
+            with trace.rendering():
+                if result and "classified_sentences" in result:
+                    # Display raw response if debug mode is enabled
+                    # if debug_mode:
+                    #     st.subheader("Raw Backend Response")
+                    #     st.code(json.dumps(result, indent=2))
                 
-                # Parse the classified_sentences string
-                classified_sentences = parse_classified_sentences(result["classified_sentences"])
+                    # Parse the classified_sentences string
+                    classified_sentences = parse_classified_sentences(result["classified_sentences"])
                 
-                if not any(classified_sentences.values()):
-                    st.error("❌ No valid classifications found. Raw backend response:")
-                    st.code(json.dumps(result, indent=2))
-                else:
-                    # Start result container
-                    st.markdown("""
-                        <div class="result-container">
-                            <h2 style="color: #00c851; font-family: 'Orbitron', sans-serif; text-align: center; margin-bottom: 2rem;">
-                                ✅ Classification Results
-                            </h2>
-                    """, unsafe_allow_html=True)
+                    if not any(classified_sentences.values()):
+                        st.error("❌ No valid classifications found. Raw backend response:")
+                        st.code(json.dumps(result, indent=2))
+                    else:
+                        # Start result container
+                        st.markdown("""
+                            <div class="result-container">
+                                <h2 style="color: #00c851; font-family: 'Orbitron', sans-serif; text-align: center; margin-bottom: 2rem;">
+                                    ✅ Classification Results
+                                </h2>
+                        """, unsafe_allow_html=True)
                     
-                    # Define SDLC phases and their display colors
-                    phases = [
-                        ("Requirements", "#ff6b35"),
-                        ("Design", "#00c3ff"),
-                        ("Development", "#69f0ae"),
-                        ("Testing", "#ffca28"),
-                        ("Deployment", "#ab47bc"),
-                        ("General", "#b0bec5"),
-                        ("Other", "#78909c")
-                    ]
+                        # Define SDLC phases and their display colors
+                        phases = [
+                            ("Requirements", "#ff6b35"),
+                            ("Design", "#00c3ff"),
+                            ("Development", "#69f0ae"),
+                            ("Testing", "#ffca28"),
+                            ("Deployment", "#ab47bc"),
+                            ("General", "#b0bec5"),
+                            ("Other", "#78909c")
+                        ]
                     
-                    # Display each phase with its sentences
-                    for phase, color in phases:
-                        sentences = classified_sentences.get(phase.lower(), [])
-                        if sentences:
-                            st.markdown(f"""
-                                <div class="phase-card">
-                                    <div class="phase-header">
-                                        <span style="font-size: 1.5rem;">📋</span>
-                                        <span style="color: {color}; font-family: 'Orbitron', sans-serif;">{phase}</span>
-                                    </div>
-                                    <div class="phase-content">
-                            """, unsafe_allow_html=True)
-                            
-                            for sentence in sentences:
+                        # Display each phase with its sentences
+                        for phase, color in phases:
+                            sentences = classified_sentences.get(phase.lower(), [])
+                            if sentences:
                                 st.markdown(f"""
-                                    <div class="sentence-item">
-                                        {sentence}
-                                    </div>
+                                    <div class="phase-card">
+                                        <div class="phase-header">
+                                            <span style="font-size: 1.5rem;">📋</span>
+                                            <span style="color: {color}; font-family: 'Orbitron', sans-serif;">{phase}</span>
+                                        </div>
+                                        <div class="phase-content">
                                 """, unsafe_allow_html=True)
                             
-                            st.markdown("</div></div>", unsafe_allow_html=True)
-                        else:
-                            st.markdown(f"""
-                                <div class="phase-card">
-                                    <div class="phase-header">
-                                        <span style="font-size: 1.5rem;">📋</span>
-                                        <span style="color: {color}; font-family: 'Orbitron', sans-serif;">{phase}</span>
-                                    </div>
-                                    <div class="phase-content">
+                                for sentence in sentences:
+                                    st.markdown(f"""
                                         <div class="sentence-item">
-                                            No sentences classified for this phase.
+                                            {sentence}
+                                        </div>
+                                    """, unsafe_allow_html=True)
+                            
+                                st.markdown("</div></div>", unsafe_allow_html=True)
+                            else:
+                                st.markdown(f"""
+                                    <div class="phase-card">
+                                        <div class="phase-header">
+                                            <span style="font-size: 1.5rem;">📋</span>
+                                            <span style="color: {color}; font-family: 'Orbitron', sans-serif;">{phase}</span>
+                                        </div>
+                                        <div class="phase-content">
+                                            <div class="sentence-item">
+                                                No sentences classified for this phase.
+                                            </div>
                                         </div>
                                     </div>
-                                </div>
-                            """, unsafe_allow_html=True)
+                                """, unsafe_allow_html=True)
                     
-                    # Close result container
-                    st.markdown("</div>", unsafe_allow_html=True)
-            else:
-                st.error("❌ Failed to classify the PDF. Please check the file and try again.")
-                if result:
-                    st.error("Raw backend response:")
-                    st.code(json.dumps(result, indent=2))
+                        # Close result container
+                        st.markdown("</div>", unsafe_allow_html=True)
+                else:
+                    st.error("❌ Failed to classify the PDF. Please check the file and try again.")
+                    if result:
+                        st.error("Raw backend response:")
+                        st.code(json.dumps(result, indent=2))
+            trace.show()
         else:
             st.warning("⚠️ Please upload a PDF file first!")
 
@@ -0,0 +1,210 @@
+import os
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# IBM Cloud credentials
+API_KEY = os.getenv("API_KEY")
+IAM_TOKEN_URL = os.getenv("IAM_TOKEN_URL", "https://iam.cloud.ibm.com/identity/token")
+
+# Bearer token cache
+# Tokens are treated as expired this many seconds before their real `expiration`
+TOKEN_EXPIRY_MARGIN = float(os.getenv("TOKEN_EXPIRY_MARGIN", "60"))
+# A background refresh is started once a cached token is this close to expiry
+TOKEN_REFRESH_AHEAD = float(os.getenv("TOKEN_REFRESH_AHEAD", "300"))
+
+# Shared upstream HTTP client
+HTTP2_ENABLED = os.getenv("HTTP2_ENABLED", "true").lower() in ("1", "true", "yes")
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "100"))
+HTTP_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("HTTP_MAX_KEEPALIVE_CONNECTIONS", "20"))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "60"))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "10"))
+HTTP_POOL_TIMEOUT = float(os.getenv("HTTP_POOL_TIMEOUT", "10"))
+
+# Read timeouts (seconds) per endpoint profile
+TIMEOUT_PROFILES = {
+    "iam": float(os.getenv("TIMEOUT_IAM", "15")),
+    "chat": float(os.getenv("TIMEOUT_CHAT", "60")),
+    "generate": float(os.getenv("TIMEOUT_GENERATE", "120")),
+    "bug": float(os.getenv("TIMEOUT_BUG", "120")),
+    "test": float(os.getenv("TIMEOUT_TEST", "120")),
+    "pdf": float(os.getenv("TIMEOUT_PDF", "60")),
+    "summary": float(os.getenv("TIMEOUT_SUMMARY", "60")),
+}
+
+# watsonx.ai
+WATSONX_BASE_URL = os.getenv("WATSONX_BASE_URL", "https://us-south.ml.cloud.ibm.com")
+WATSONX_API_VERSION = os.getenv("WATSONX_API_VERSION", "2023-05-29")
+
+# Point IAM and watsonx.ai at the local mock server (tools/mock_watsonx.py),
+# e.g. UPSTREAM_MOCK_URL=http://127.0.0.1:8081, for offline load and latency testing
+UPSTREAM_MOCK_URL = os.getenv("UPSTREAM_MOCK_URL", "").rstrip("/")
+if UPSTREAM_MOCK_URL:
+    WATSONX_BASE_URL = UPSTREAM_MOCK_URL
+    IAM_TOKEN_URL = f"{UPSTREAM_MOCK_URL}/identity/token"
+    API_KEY = API_KEY or "mock-api-key"
+
+# Record upstream (IAM + watsonx.ai) exchanges to a cassette, or serve them back from one:
+# "off", "record" or "replay". Cassettes are JSONL with credentials redacted.
+UPSTREAM_CASSETTE_MODE = os.getenv("UPSTREAM_CASSETTE_MODE", "off").lower()
+UPSTREAM_CASSETTE_PATH = os.getenv("UPSTREAM_CASSETTE_PATH", "cassettes/upstream.jsonl")
+# Replayed latency = recorded latency x this factor (0 = answer immediately)
+UPSTREAM_CASSETTE_LATENCY_SCALE = float(os.getenv("UPSTREAM_CASSETTE_LATENCY_SCALE", "1.0"))
+
+# Admission control in front of watsonx calls
+# Default concurrent upstream calls per model, overridable per model with
+# GATEWAY_MODEL_CONCURRENCY="ibm/granite-3-2b-instruct=8,ibm/granite-3-2-8b-instruct=4"
+GATEWAY_MAX_CONCURRENCY = int(os.getenv("GATEWAY_MAX_CONCURRENCY", "8"))
+GATEWAY_MODEL_CONCURRENCY = {
+    model.strip(): int(limit)
+    for model, _, limit in (
+        item.partition("=") for item in os.getenv("GATEWAY_MODEL_CONCURRENCY", "").split(",") if "=" in item
+    )
+}
+# Requests waiting for a slot per model before new ones are shed with 429
+GATEWAY_MAX_QUEUE = int(os.getenv("GATEWAY_MAX_QUEUE", "50"))
+# Longest a request may wait for a slot before it is shed
+GATEWAY_QUEUE_TIMEOUT = float(os.getenv("GATEWAY_QUEUE_TIMEOUT", "30"))
+
+# Adaptive (AIMD) upstream concurrency per model
+# The gateway limits above become the starting window when AIMD is enabled
+AIMD_ENABLED = os.getenv("AIMD_ENABLED", "true").lower() in ("1", "true", "yes")
+AIMD_MIN_CONCURRENCY = int(os.getenv("AIMD_MIN_CONCURRENCY", "1"))
+AIMD_MAX_CONCURRENCY = int(os.getenv("AIMD_MAX_CONCURRENCY", "32"))
+# Window growth per full window of successful calls
+AIMD_ADDITIVE_INCREASE = float(os.getenv("AIMD_ADDITIVE_INCREASE", "1"))
+# Multiplicative cut on 429 / 5xx / transport errors, and the gentler cut on slow calls
+AIMD_DECREASE_FACTOR = float(os.getenv("AIMD_DECREASE_FACTOR", "0.5"))
+AIMD_LATENCY_DECREASE_FACTOR = float(os.getenv("AIMD_LATENCY_DECREASE_FACTOR", "0.8"))
+# Latency as time per generated token, so long completions are not mistaken for slow ones.
+# A call counts as congested when the smoothed ms/token is above AIMD_LATENCY_TOLERANCE times
+# the model's baseline (its lowest recent ms/token) and above AIMD_TARGET_MS_PER_TOKEN
+AIMD_TARGET_MS_PER_TOKEN = float(os.getenv("AIMD_TARGET_MS_PER_TOKEN", "100"))
+AIMD_LATENCY_TOLERANCE = float(os.getenv("AIMD_LATENCY_TOLERANCE", "2"))
+# Shorter completions are dominated by time to first token and give no latency signal
+AIMD_MIN_COMPLETION_TOKENS = int(os.getenv("AIMD_MIN_COMPLETION_TOKENS", "32"))
+# Minimum seconds between two decreases, so one burst of failures only cuts once
+AIMD_DECREASE_COOLDOWN = float(os.getenv("AIMD_DECREASE_COOLDOWN", "5"))
+
+# In-memory response cache for reproducible (low-temperature) upstream calls
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+RESPONSE_CACHE_MAX_BYTES = int(os.getenv("RESPONSE_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "3600"))
+# Only calls sampled at or below this temperature are considered reproducible
+RESPONSE_CACHE_MAX_TEMPERATURE = float(os.getenv("RESPONSE_CACHE_MAX_TEMPERATURE", "0.1"))
+
+# Persistent SQLite tier under the in-memory response cache, shared by all workers on the host
+DISK_CACHE_ENABLED = os.getenv("DISK_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+DISK_CACHE_PATH = os.getenv("DISK_CACHE_PATH", os.path.join("cache_data", "responses.sqlite3"))
+DISK_CACHE_MAX_BYTES = int(os.getenv("DISK_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+DISK_CACHE_MAX_AGE = float(os.getenv("DISK_CACHE_MAX_AGE", str(7 * 24 * 3600)))
+DISK_CACHE_COMPRESSION_LEVEL = int(os.getenv("DISK_CACHE_COMPRESSION_LEVEL", "6"))
+
+# /ws/chat WebSocket sessions
+# Seconds between server pings, and silence after which a client is considered gone
+WS_PING_INTERVAL = float(os.getenv("WS_PING_INTERVAL", "20"))
+WS_IDLE_TIMEOUT = float(os.getenv("WS_IDLE_TIMEOUT", "90"))
+# Outgoing frames buffered per connection, and how long a full buffer may block before the client is dropped
+WS_SEND_QUEUE_SIZE = int(os.getenv("WS_SEND_QUEUE_SIZE", "256"))
+WS_SEND_TIMEOUT = float(os.getenv("WS_SEND_TIMEOUT", "10"))
+WS_MAX_CONVERSATIONS = int(os.getenv("WS_MAX_CONVERSATIONS", "4"))
+WS_MAX_MESSAGE_CHARS = int(os.getenv("WS_MAX_MESSAGE_CHARS", "32000"))
+
+# Server-side chat memory
+CHAT_MEMORY_MAX_SESSIONS = int(os.getenv("CHAT_MEMORY_MAX_SESSIONS", "1000"))
+CHAT_MEMORY_MAX_BYTES = int(os.getenv("CHAT_MEMORY_MAX_BYTES", str(32 * 1024 * 1024)))
+# Sessions untouched for this long are dropped
+CHAT_MEMORY_TTL = float(os.getenv("CHAT_MEMORY_TTL", str(24 * 3600)))
+# Estimated prompt tokens for history + summary + new message, and the share kept for the summary
+CHAT_PROMPT_TOKEN_BUDGET = int(os.getenv("CHAT_PROMPT_TOKEN_BUDGET", "3000"))
+CHAT_SUMMARY_TOKEN_BUDGET = int(os.getenv("CHAT_SUMMARY_TOKEN_BUDGET", "400"))
+# Fold old turns into the summary with the model (falls back to an extractive summary)
+CHAT_SUMMARIZE_WITH_MODEL = os.getenv("CHAT_SUMMARIZE_WITH_MODEL", "true").lower() in ("1", "true", "yes")
+
+# Token usage accounting: per-minute and per-day rollups by endpoint, model and caller
+TOKEN_USAGE_ENABLED = os.getenv("TOKEN_USAGE_ENABLED", "true").lower() in ("1", "true", "yes")
+TOKEN_USAGE_DB_PATH = os.getenv("TOKEN_USAGE_DB_PATH", os.path.join("cache_data", "token_usage.sqlite3"))
+# Seconds between writes of the in-process counters to the shared store
+TOKEN_USAGE_FLUSH_INTERVAL = float(os.getenv("TOKEN_USAGE_FLUSH_INTERVAL", "5"))
+TOKEN_USAGE_MINUTE_RETENTION = float(os.getenv("TOKEN_USAGE_MINUTE_RETENTION", str(2 * 24 * 3600)))
+TOKEN_USAGE_DAY_RETENTION = float(os.getenv("TOKEN_USAGE_DAY_RETENTION", str(400 * 24 * 3600)))
+# Request header naming the caller; callers past the limit are counted as "other"
+TOKEN_USAGE_CALLER_HEADER = os.getenv("TOKEN_USAGE_CALLER_HEADER", "X-Caller-Id").lower()
+TOKEN_USAGE_MAX_CALLERS = int(os.getenv("TOKEN_USAGE_MAX_CALLERS", "200"))
+
+# Token budgets (prompt + completion) per minute or per UTC day, overall or for one endpoint
+# TOKEN_BUDGETS="day=3000000,minute=60000,day:pdf=500000"
+TOKEN_BUDGETS = {
+    tuple(scope.strip().partition(":")[::2]): int(limit)
+    for scope, _, limit in (item.partition("=") for item in os.getenv("TOKEN_BUDGETS", "").split(",") if "=" in item)
+}
+# Past this share of a budget requests are degraded, at 100% they are throttled with 429
+TOKEN_BUDGET_DEGRADE_AT = float(os.getenv("TOKEN_BUDGET_DEGRADE_AT", "0.8"))
+# max_tokens cap applied to degraded requests
+TOKEN_BUDGET_DEGRADED_MAX_TOKENS = int(os.getenv("TOKEN_BUDGET_DEGRADED_MAX_TOKENS", "1000"))
+# Endpoints throttled as soon as a budget degrades, e.g. background chat summaries
+TOKEN_BUDGET_SHED_WHEN_DEGRADED = [p.strip() for p in os.getenv("TOKEN_BUDGET_SHED_WHEN_DEGRADED", "summary").split(",") if p.strip()]
+
+# OpenTelemetry tracing (needs opentelemetry-sdk; the OTLP exporter also needs opentelemetry-exporter-otlp-proto-http)
+TRACING_ENABLED = os.getenv("TRACING_ENABLED", "false").lower() in ("1", "true", "yes")
+TRACING_SERVICE_NAME = os.getenv("TRACING_SERVICE_NAME", "smartsdlc-backend")
+# Share of new traces recorded; requests arriving with a W3C traceparent follow the caller's decision
+TRACING_SAMPLE_RATIO = float(os.getenv("TRACING_SAMPLE_RATIO", "0.1"))
+# "file" (JSON lines), "otlp" (OTLP/HTTP, e.g. tools/trace_collector.py or an OpenTelemetry Collector) or "console"
+TRACING_EXPORTER = os.getenv("TRACING_EXPORTER", "file")
+TRACING_FILE_PATH = os.getenv("TRACING_FILE_PATH", os.path.join("traces", "spans.jsonl"))
+TRACING_OTLP_ENDPOINT = os.getenv("TRACING_OTLP_ENDPOINT", "http://127.0.0.1:4318/v1/traces")
+
+# On-demand profiling of single requests (X-Profile: sampling|deterministic, or ?profile=...)
+# Only honoured with X-Admin-Token (or ?admin_token=) equal to this; empty turns the feature off
+PROFILING_ADMIN_TOKEN = os.getenv("PROFILING_ADMIN_TOKEN", "")
+PROFILING_DIR = os.getenv("PROFILING_DIR", "profiles")
+PROFILING_SAMPLE_INTERVAL = float(os.getenv("PROFILING_SAMPLE_INTERVAL", "0.001"))
+# Profiles kept on disk; the oldest are deleted beyond this
+PROFILING_MAX_FILES = int(os.getenv("PROFILING_MAX_FILES", "200"))
+
+# Admin token (X-Admin-Token or ?admin_token=) required by the /ops routes that change state, e.g. DELETE /ops/cache.
+# Defaults to PROFILING_ADMIN_TOKEN; with neither set those routes are refused
+OPS_ADMIN_TOKEN = os.getenv("OPS_ADMIN_TOKEN", PROFILING_ADMIN_TOKEN)
+
+# Event loop lag monitor: a task measures how late its timer fires, a watchdog
+# thread captures the stack of whatever holds the loop past the threshold
+LOOP_MONITOR_ENABLED = os.getenv("LOOP_MONITOR_ENABLED", "true").lower() in ("1", "true", "yes")
+LOOP_MONITOR_INTERVAL = float(os.getenv("LOOP_MONITOR_INTERVAL", "0.05"))
+LOOP_BLOCK_THRESHOLD = float(os.getenv("LOOP_BLOCK_THRESHOLD", "0.1"))
+# Lag samples kept for the percentiles in /ops/event-loop (1200 x 50 ms = the last minute)
+LOOP_MONITOR_WINDOW = int(os.getenv("LOOP_MONITOR_WINDOW", "1200"))
+
+# Per-request memory accounting of /classify-pdf-sdlc/ (tracemalloc peak, RSS delta, bytes per stage),
+# exported to /metrics. Off by default: tracemalloc slows every allocation in the process while on
+PDF_MEMORY_TRACKING = os.getenv("PDF_MEMORY_TRACKING", "false").lower() in ("1", "true", "yes")
+# Estimated memory a single PDF request may need before it is rejected with 413 (0 = no ceiling)
+PDF_MEMORY_CEILING_MB = float(os.getenv("PDF_MEMORY_CEILING_MB", "256"))
+
+# PDF text extraction in a process pool: large documents are split into page ranges
+# extracted in parallel. 0 workers extracts in a thread of this process instead
+PDF_EXTRACTION_WORKERS = int(os.getenv("PDF_EXTRACTION_WORKERS", str(min(4, os.cpu_count() or 1))))
+# Fewest pages worth a range of their own
+PDF_PAGES_PER_TASK = int(os.getenv("PDF_PAGES_PER_TASK", "25"))
+# Seconds a document may take; past it the workers are killed and the request fails with 422
+PDF_EXTRACTION_TIMEOUT = float(os.getenv("PDF_EXTRACTION_TIMEOUT", "60"))
+
+# Streamed uploads (/classify-pdf-sdlc/): refused with 413 past UPLOAD_MAX_MB while still
+# arriving; kept in memory up to UPLOAD_SPOOL_KB, beyond that in a temp file on disk
+UPLOAD_MAX_MB = float(os.getenv("UPLOAD_MAX_MB", "50"))
+UPLOAD_SPOOL_KB = int(os.getenv("UPLOAD_SPOOL_KB", "1024"))
+# Directory of the temp files; empty uses the system temp directory
+UPLOAD_TMP_DIR = os.getenv("UPLOAD_TMP_DIR", "") or None
+
+# Resumable chunked uploads (/uploads): chunks are written into a file per session under
+# CHUNKED_UPLOAD_DIR, shared by all workers; sessions untouched for CHUNKED_UPLOAD_TTL_HOURS
+# are deleted. /classify-pdf-sdlc/ still refuses a session over UPLOAD_MAX_MB
+CHUNKED_UPLOAD_DIR = os.getenv("CHUNKED_UPLOAD_DIR", "uploads")
+CHUNKED_UPLOAD_MAX_MB = float(os.getenv("CHUNKED_UPLOAD_MAX_MB", str(UPLOAD_MAX_MB)))
+# Chunk size suggested to clients, and the largest chunk accepted
+CHUNKED_UPLOAD_CHUNK_KB = int(os.getenv("CHUNKED_UPLOAD_CHUNK_KB", "1024"))
+CHUNKED_UPLOAD_MAX_CHUNK_MB = float(os.getenv("CHUNKED_UPLOAD_MAX_CHUNK_MB", "8"))
+CHUNKED_UPLOAD_TTL_HOURS = float(os.getenv("CHUNKED_UPLOAD_TTL_HOURS", "24"))
+# Seconds between sweeps deleting expired sessions (also swept when an upload is created)
+CHUNKED_UPLOAD_PRUNE_INTERVAL = float(os.getenv("CHUNKED_UPLOAD_PRUNE_INTERVAL", "600"))
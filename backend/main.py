@@ -1,3 +1,4 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI 
 from routers import pdf
 from routers import generate
@@ -5,7 +6,49 @@ from routers import chat
 from routers import bug
 from routers import test     
 from routers import feedback                
-app = FastAPI()
+from routers import uploads
+from routers import ops
+from routers import metrics
+from config import PROFILING_ADMIN_TOKEN
+from services import http_client
+from services import tracing
+from services.chunked_uploads import chunked_uploads
+from services.loop_monitor import loop_monitor
+from services.metrics import MetricsMiddleware
+from services.pdf_extraction import pdf_extractor
+from services.profiler import ProfilingMiddleware
+from services.request_context import RequestContextMiddleware
+from services.token_manager import token_manager
+from services.token_usage import token_usage
+from services.tracing import TracingMiddleware
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    tracing.setup()
+    await loop_monitor.start()
+    # One pooled upstream client for the whole app
+    await http_client.startup()
+    await token_usage.start()
+    await chunked_uploads.start()
+    yield
+    await chunked_uploads.close()
+    await token_usage.close()
+    await token_manager.close()
+    await http_client.shutdown()
+    pdf_extractor.close()
+    await loop_monitor.close()
+    tracing.shutdown()
+
+
+app = FastAPI(lifespan=lifespan)
+# Added first so they run inside RequestContextMiddleware and see the stage timings
+app.add_middleware(TracingMiddleware)
+app.add_middleware(MetricsMiddleware)
+if PROFILING_ADMIN_TOKEN:
+    # Admin-only, on request; without the token configured the flag costs nothing
+    app.add_middleware(ProfilingMiddleware)
+app.add_middleware(RequestContextMiddleware)
 
 app.include_router(pdf.router)
 app.include_router(generate.router)
@@ -13,5 +56,6 @@ app.include_router(bug.router)
 app.include_router(test.router)
 app.include_router(chat.router)
 app.include_router(feedback.router)
-
-
+app.include_router(uploads.router)
+app.include_router(ops.router)
+app.include_router(metrics.router)
@@ -1,16 +1,18 @@
 from fastapi import APIRouter, HTTPException
 from pydantic import BaseModel
-import httpx
 import os
 from dotenv import load_dotenv
 import time
+from services.gateway import gateway
+from services.metrics import TimedRoute
+from services.request_context import timed_stage
+from services.code_normalizer import canonicalize_code
+from services.sse import sse_response
 
 load_dotenv()
 
-router = APIRouter()
+router = APIRouter(route_class=TimedRoute)
 
-API_KEY = os.getenv("API_KEY")
-BASE_URL = "https://us-south.ml.cloud.ibm.com"
 PROJECT_ID = os.getenv("PROJECT_ID")
 MODEL_ID = "ibm/granite-3-2b-instruct"
 
@@ -23,25 +25,12 @@ class BugFixResponse(BaseModel):
     processing_time: float
     raw_response: dict
 
-async def get_bearer_token(api_key: str):
-    token_url = "https://iam.cloud.ibm.com/identity/token"
-    data = {
-        "grant_type": "urn:ibm:params:oauth:grant-type:apikey",
-        "apikey": api_key
-    }
-    async with httpx.AsyncClient() as client:
-        response = await client.post(token_url, data=data, headers={"Content-Type": "application/x-www-form-urlencoded"})
-        response.raise_for_status()
-        return response.json()["access_token"]
-
 @router.post("/fix-bug/", response_model=BugFixResponse)
-async def fix_bug_endpoint(req: BugFixRequest):
+async def fix_bug_endpoint(req: BugFixRequest, stream: bool = False):
     try:
         if not req.code.strip():
             raise HTTPException(status_code=400, detail="Code input cannot be empty")
 
-        bearer_token = await get_bearer_token(API_KEY)
-
         system_prompt = (
             f"You are an expert {req.programming_language} programmer and debugging specialist. "
             "Analyze the provided code and fix all bugs, including syntax errors, logic errors, runtime errors, "
@@ -51,7 +40,6 @@ async def fix_bug_endpoint(req: BugFixRequest):
 
         user_message = f"Code to analyze and fix:\n{req.code}"
 
-        url = f"{BASE_URL}/ml/v1/text/chat?version=2023-05-29"
         body = {
             "project_id": PROJECT_ID,
             "model_id": MODEL_ID,
@@ -65,21 +53,26 @@ async def fix_bug_endpoint(req: BugFixRequest):
                 {"role": "user", "content": user_message}
             ]
         }
-        headers = {
-            "Accept": "application/json",
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {bearer_token}"
-        }
+
+        # Opt-in streaming: relay tokens as server-sent events
+        if stream:
+            start_time = time.time()
+            chunks = await gateway.chat_stream(body, "bug")
+            return sse_response(chunks, start_time)
+
+        # Key the cache on the canonical code so formatting-only edits share an answer
+        key_message = {"code": canonicalize_code(req.code, req.programming_language)}
+        key_body = {**body, "messages": [body["messages"][0], {"role": "user", "content": key_message}]}
 
         start_time = time.time()
-        async with httpx.AsyncClient(timeout=120.0) as client:
-            response = await client.post(url, headers=headers, json=body)
+        response = await gateway.chat(body, "bug", key_body=key_body)
 
         if response.status_code != 200:
             raise HTTPException(status_code=response.status_code, detail=f"WatsonX AI API error: {response.text}")
 
-        response_data = response.json()
-        fixed_code = response_data.get("choices", [{}])[0].get("message", {}).get("content", req.code)
+        with timed_stage("response_parsing"):
+            response_data = response.json()
+            fixed_code = response_data.get("choices", [{}])[0].get("message", {}).get("content", req.code)
         processing_time = time.time() - start_time
 
         return BugFixResponse(
@@ -1,73 +1,140 @@
-from fastapi import APIRouter
+from fastapi import APIRouter, HTTPException, WebSocket
 from pydantic import BaseModel
-import httpx
+from typing import AsyncIterator, List, Optional
 import os
 from dotenv import load_dotenv
+from config import CHAT_SUMMARY_TOKEN_BUDGET, CHAT_SUMMARIZE_WITH_MODEL
+from services.chat_memory import ChatSession, chat_memory
+from services.gateway import gateway
+from services.metrics import TimedRoute
+from services.token_usage import caller_from_headers, set_caller
+from services.ws_session import ChatSocketSession
 
 # Load environment variables
 load_dotenv()
 
-router = APIRouter()
+router = APIRouter(route_class=TimedRoute)
 
 # Config
-API_KEY = os.getenv("API_KEY")
-BASE_URL = "https://us-south.ml.cloud.ibm.com"  # adjust region if needed
 PROJECT_ID = os.getenv("PROJECT_ID")  # put your project id in .env
 MODEL_ID = "ibm/granite-3-2-8b-instruct"
 
 # Request schema
 class ChatRequest(BaseModel):
     message: str
+    # Continue a server-side conversation; without it the message is answered on its own
+    session_id: Optional[str] = None
 
 
-async def get_bearer_token(api_key: str):
-    """Get IAM bearer token from IBM Cloud"""
-    token_url = "https://iam.cloud.ibm.com/identity/token"
-    data = {
-        "grant_type": "urn:ibm:params:oauth:grant-type:apikey",
-        "apikey": api_key
+def build_chat_body(messages: List[dict]) -> dict:
+    """watsonx chat request for a list of messages ending with the user's new one"""
+    return {
+        "project_id": PROJECT_ID,
+        "model_id": MODEL_ID,
+        "frequency_penalty": 0,
+        "max_tokens": 2000,
+        "presence_penalty": 0,
+        "temperature": 0,
+        "top_p": 1,
+        "messages": messages
     }
-    async with httpx.AsyncClient() as client:
-        response = await client.post(token_url, data=data, headers={"Content-Type": "application/x-www-form-urlencoded"})
-        response.raise_for_status()
-        return response.json()["access_token"]
+
+
+def build_session_body(message: str, session_id: Optional[str]):
+    """Request body with the session's history window; returns (body, session or None)"""
+    if not session_id:
+        return build_chat_body([{"role": "user", "content": message}]), None
+    session = chat_memory.session(session_id)
+    return build_chat_body(chat_memory.build_messages(session, message)), session
+
+
+async def summarize_turns(summary: str, turns: List[dict]) -> str:
+    """Fold older turns into the running summary of a conversation"""
+    transcript = "\n".join(f"{turn['role'].capitalize()}: {turn['content']}" for turn in turns)
+    prompt = (
+        "Update the summary of a conversation between a user and an AI assistant. "
+        "Keep facts, decisions, code names and open questions; drop greetings and filler. "
+        "Answer with the updated summary only.\n\n"
+        f"Current summary:\n{summary or '(none)'}\n\nNew turns:\n{transcript}"
+    )
+    body = {
+        "project_id": PROJECT_ID,
+        "model_id": MODEL_ID,
+        "max_tokens": CHAT_SUMMARY_TOKEN_BUDGET,
+        "temperature": 0,
+        "messages": [{"role": "user", "content": prompt}],
+    }
+    response = await gateway.chat(body, "summary")
+    if response.status_code != 200:
+        raise RuntimeError(f"Summary request failed with {response.status_code}")
+    return response.json()["choices"][0]["message"]["content"]
+
+
+if CHAT_SUMMARIZE_WITH_MODEL:
+    chat_memory.summarizer = summarize_turns
+
+
+async def remember_reply(chunks: AsyncIterator[dict], session: ChatSession, message: str) -> AsyncIterator[dict]:
+    """Pass stream chunks through and record the exchange once the reply is complete"""
+    pieces = []
+    try:
+        async for chunk in chunks:
+            for choice in chunk.get("choices", []):
+                content = (choice.get("delta") or {}).get("content")
+                if content:
+                    pieces.append(content)
+            yield chunk
+    finally:
+        await chunks.aclose()
+    chat_memory.record_exchange(session, message, "".join(pieces))
 
 
 @router.post("/chat/")
 async def chat_endpoint(req: ChatRequest):
     try:
-        # Step 1: get bearer token
-        bearer_token = await get_bearer_token(API_KEY)
-
-        # Step 2: prepare request
-        url = f"{BASE_URL}/ml/v1/text/chat?version=2023-05-29"
-        body = {
-            "project_id": PROJECT_ID,
-            "model_id": MODEL_ID,
-            "frequency_penalty": 0,
-            "max_tokens": 2000,
-            "presence_penalty": 0,
-            "temperature": 0,
-            "top_p": 1,
-            "messages": [
-                {"role": "user", "content": req.message}
-            ]
-        }
-        headers = {
-            "Accept": "application/json",
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {bearer_token}"
-        }
-
-        # Step 3: make request
-        async with httpx.AsyncClient() as client:
-            response = await client.post(url, headers=headers, json=body)
-
-        # Step 4: return response
+        # Step 1: prepare request
+        body, session = build_session_body(req.message, req.session_id)
+
+        # Step 2: make request
+        response = await gateway.chat(body, "chat")
+
+        # Step 3: return response
         if response.status_code != 200:
             return {"error": response.text}
 
-        return response.json()
+        result = response.json()
+        if session is not None:
+            chat_memory.record_exchange(session, req.message, result["choices"][0]["message"]["content"])
+            result["session_id"] = session.session_id
+        return result
 
+    except HTTPException:
+        raise
     except Exception as e:
         return {"error": str(e)}
+
+
+
+@router.websocket("/ws/chat")
+async def chat_websocket(websocket: WebSocket):
+    """
+    Persistent chat connection with streamed replies.
+
+    Client frames: {"type": "chat", "conversation_id": "...", "message": "...",
+    "session_id": "..." (optional)}, {"type": "cancel", "conversation_id": "..."}
+    and {"type": "pong"}. Server frames: "token", "done", "error", "cancelled" (all
+    tagged with their conversation_id) and "ping"; "done" carries the stage
+    timings of the reply in milliseconds.
+    """
+    async def open_stream(frame: dict):
+        session_id = frame.get("session_id")
+        body, session = build_session_body(frame["message"], str(session_id) if session_id else None)
+        chunks = await gateway.chat_stream(body, "chat")
+        if session is None:
+            return chunks
+        # Cancelled or failed replies never reach the history
+        return remember_reply(chunks, session, frame["message"])
+
+    # No HTTP request context here: attribute the connection's token spend explicitly
+    set_caller(caller_from_headers(dict(websocket.headers)))
+    await ChatSocketSession(websocket, open_stream).run()
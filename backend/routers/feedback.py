@@ -4,8 +4,9 @@ import json
 import os
 from datetime import datetime
 import uuid
+from services.metrics import TimedRoute
 
-router = APIRouter()
+router = APIRouter(route_class=TimedRoute)
 
 # Feedback storage directory
 FEEDBACK_DIR = "feedback_data"
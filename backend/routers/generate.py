@@ -1,17 +1,19 @@
-from fastapi import APIRouter
+from fastapi import APIRouter, HTTPException
 from pydantic import BaseModel
-import httpx
 import os
 from dotenv import load_dotenv
+from services.gateway import gateway
+from services.metrics import TimedRoute
+from services.request_context import timed_stage
+from services.sse import sse_response
+import time
 
 # Load environment variables
 load_dotenv()
 
-router = APIRouter()
+router = APIRouter(route_class=TimedRoute)
 
 # Config
-API_KEY = os.getenv("API_KEY")
-BASE_URL = "https://us-south.ml.cloud.ibm.com"  # adjust region if needed
 PROJECT_ID = os.getenv("PROJECT_ID")  # put your project id in .env
 MODEL_ID = "ibm/granite-3-2b-instruct"
 
@@ -19,30 +21,16 @@ MODEL_ID = "ibm/granite-3-2b-instruct"
 class CodeGenRequest(BaseModel):
     prompt: str  # default to Python, can specify other languages
 
-async def get_bearer_token(api_key: str):
-    """Get IAM bearer token from IBM Cloud"""
-    token_url = "https://iam.cloud.ibm.com/identity/token"
-    data = {
-        "grant_type": "urn:ibm:params:oauth:grant-type:apikey",
-        "apikey": api_key
-    }
-    async with httpx.AsyncClient() as client:
-        response = await client.post(token_url, data=data, headers={"Content-Type": "application/x-www-form-urlencoded"})
-        response.raise_for_status()
-        return response.json()["access_token"]
-
 @router.post("/generate-code/")
-async def codegen_endpoint(req: CodeGenRequest):
+async def codegen_endpoint(req: CodeGenRequest, stream: bool = False):
     try:
-        # Step 1: get bearer token
-        bearer_token = await get_bearer_token(API_KEY)
+        start_time = time.time()
 
-        # Step 2: prepare request with a system prompt for code generation
+        # Step 1: prepare request with a system prompt for code generation
         system_prompt = (
             f"Generate only the implementation code (do not include test cases, Do not wrap it in markdown (like ``` python ``` or explanations):\n{req.prompt}"
         )
 
-        url = f"{BASE_URL}/ml/v1/text/chat?version=2023-05-29"
         body = {
             "project_id": PROJECT_ID,
             "model_id": MODEL_ID,
@@ -56,28 +44,30 @@ async def codegen_endpoint(req: CodeGenRequest):
                 {"role": "user", "content": req.prompt}
             ]
         }
-        headers = {
-            "Accept": "application/json",
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {bearer_token}"
-        }
 
-        # Step 3: make request
-        async with httpx.AsyncClient() as client:
-            response = await client.post(url, headers=headers, json=body)
+        # Opt-in streaming: relay tokens as server-sent events
+        if stream:
+            chunks = await gateway.chat_stream(body, "generate")
+            return sse_response(chunks, start_time)
+
+        # Step 2: make request
+        response = await gateway.chat(body, "generate")
 
-        # Step 4: return response
+        # Step 3: return response
         if response.status_code != 200:
             return {"error": response.text}
 
         # Extract the generated code from the response
-        response_data = response.json()
-        generated_code = response_data.get("choices", [{}])[0].get("message", {}).get("content", "")
+        with timed_stage("response_parsing"):
+            response_data = response.json()
+            generated_code = response_data.get("choices", [{}])[0].get("message", {}).get("content", "")
         
         return {
 
             "generated_code": generated_code
         }
 
+    except HTTPException:
+        raise
     except Exception as e:
         return {"error": str(e)}
\ No newline at end of file
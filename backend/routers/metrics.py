@@ -0,0 +1,11 @@
+from fastapi import APIRouter, Response
+from services.metrics import TimedRoute, render_metrics
+
+router = APIRouter(tags=["ops"], route_class=TimedRoute)
+
+
+@router.get("/metrics", include_in_schema=False)
+async def metrics():
+    """Prometheus scrape endpoint"""
+    body, content_type = render_metrics()
+    return Response(content=body, media_type=content_type)
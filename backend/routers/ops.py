@@ -0,0 +1,127 @@
+import asyncio
+import hmac
+import os
+from fastapi import APIRouter, Depends, Header, HTTPException
+from fastapi.responses import FileResponse
+from config import OPS_ADMIN_TOKEN, PROFILING_DIR
+from services import http_client
+from services.chat_memory import chat_memory
+from services.chunked_uploads import chunked_uploads
+from services.gateway import gateway
+from services.loop_monitor import loop_monitor
+from services.metrics import TimedRoute
+from services.pdf_extraction import pdf_extractor
+from services.profiler import PROFILE_FILE, is_admin
+from services.response_cache import response_cache
+from services.token_manager import token_manager
+from services.token_usage import GRANULARITIES, GROUP_FIELDS, token_budgets, token_usage
+
+router = APIRouter(prefix="/ops", tags=["ops"], route_class=TimedRoute)
+
+
+def require_ops_admin(admin_token: str = "", x_admin_token: str = Header(default="")):
+    """Dependency of the routes that change state: reads stay open, changes need OPS_ADMIN_TOKEN"""
+    token = x_admin_token or admin_token
+    if not OPS_ADMIN_TOKEN or not hmac.compare_digest(token.encode(), OPS_ADMIN_TOKEN.encode()):
+        raise HTTPException(status_code=403, detail="This operation requires a valid admin token")
+
+
+@router.get("/http-pool")
+async def http_pool_stats():
+    """Connection pool utilisation of the shared upstream client"""
+    return http_client.pool_stats()
+
+
+@router.get("/token")
+async def token_stats():
+    """State of the cached IAM bearer token (never the token itself)"""
+    return token_manager.stats()
+
+
+@router.get("/gateway")
+async def gateway_stats():
+    """Admission control state per model: slots in use, queue depth, shed requests"""
+    return gateway.stats()
+
+
+@router.get("/coalescing")
+async def coalescing_stats():
+    """How many upstream calls were shared by identical in-flight requests"""
+    return gateway.coalescing_stats()
+
+
+@router.get("/cache")
+async def cache_stats():
+    """Hit/miss/eviction counters of the upstream response cache"""
+    # The disk tier is queried with blocking SQLite calls
+    return await asyncio.to_thread(response_cache.stats)
+
+
+@router.delete("/cache", dependencies=[Depends(require_ops_admin)])
+async def clear_cache():
+    await response_cache.clear()
+    return {"message": "Response cache cleared"}
+
+
+@router.get("/chat-memory")
+async def chat_memory_stats():
+    """Server-side chat sessions: count, memory use and summary folds"""
+    return chat_memory.stats()
+
+
+@router.get("/event-loop")
+async def event_loop_stats():
+    """
+    Event loop lag percentiles over the recent window, and the stacks of the
+    last calls that held the loop past LOOP_BLOCK_THRESHOLD
+    """
+    return loop_monitor.stats()
+
+
+@router.get("/pdf-extraction")
+async def pdf_extraction_stats():
+    """PDF extraction worker pool: documents, page ranges, crashes and timeouts"""
+    return pdf_extractor.stats()
+
+
+@router.get("/uploads")
+async def upload_stats():
+    """Resumable upload sessions: created, chunks, checksum failures, completed and expired"""
+    # Counts the sessions on disk
+    return await asyncio.to_thread(chunked_uploads.stats)
+
+
+@router.get("/token-usage")
+async def token_usage_stats(window: str = "day", buckets: int = 1, group_by: str = "endpoint,model"):
+    """
+    Tokens spent upstream over the last `buckets` minutes or UTC days, grouped by
+    endpoint, model and/or caller with the biggest spenders first, plus the state
+    of the token budgets.
+    """
+    fields = tuple(field.strip() for field in group_by.split(",") if field.strip())
+    if window not in GRANULARITIES:
+        raise HTTPException(status_code=400, detail=f"window must be one of {list(GRANULARITIES)}")
+    if not fields or any(field not in GROUP_FIELDS for field in fields):
+        raise HTTPException(status_code=400, detail=f"group_by must be a comma separated subset of {list(GROUP_FIELDS)}")
+    if buckets < 1:
+        raise HTTPException(status_code=400, detail="buckets must be at least 1")
+    if not token_usage.enabled:
+        return {"ledger": token_usage.stats(), "budgets": token_budgets.stats()}
+    # Flushes pending counts and queries SQLite
+    report = await asyncio.to_thread(token_usage.report, window, buckets, fields)
+    return {**report, "budgets": token_budgets.stats(), "ledger": token_usage.stats()}
+
+
+@router.get("/profiles/{name}")
+async def get_profile(name: str, admin_token: str = "", x_admin_token: str = Header(default="")):
+    """
+    A request profile named in an `X-Profile` response header: `.speedscope.json`
+    (open in https://www.speedscope.app) or `.collapsed` folded stacks.
+    """
+    if not is_admin(x_admin_token or admin_token):
+        raise HTTPException(status_code=403, detail="Profiles require a valid admin token")
+    path = os.path.join(PROFILING_DIR, name)
+    if not PROFILE_FILE.match(name) or not os.path.isfile(path):
+        raise HTTPException(status_code=404, detail="No such profile")
+    media_type = "application/json" if name.endswith(".json") else "text/plain"
+    return FileResponse(path, media_type=media_type)
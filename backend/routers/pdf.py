@@ -1,86 +1,104 @@
 
-from fastapi import APIRouter, File, UploadFile, HTTPException
+from fastapi import APIRouter, HTTPException, Request
 from pydantic import BaseModel
-import httpx
 import os
 from dotenv import load_dotenv
-import fitz  # PyMuPDF
-from typing import List, Dict
+from typing import List, Dict, Optional
+from config import UPLOAD_MAX_MB
+from services import pdf_memory, tracing
+from services.chunked_uploads import chunked_uploads
+from services.gateway import gateway
+from services.metrics import TimedRoute
+from services.pdf_extraction import ExtractionError, ExtractionTimeout, ExtractionWorkerError, assemble, extract_pages, pdf_extractor
+from services.pdf_memory import memory_ceiling
+from services.request_context import set_response_header, timed_stage
+from services.uploads import FILE_UPLOAD_OPENAPI, receive_upload, too_large
 
 # Load environment variables
 load_dotenv()
 
-router = APIRouter()
+router = APIRouter(route_class=TimedRoute)
 
 # Config
-API_KEY = os.getenv("API_KEY")
-BASE_URL = "https://us-south.ml.cloud.ibm.com"  # adjust region if needed
 PROJECT_ID = os.getenv("PROJECT_ID")  # put your project id in .env
 MODEL_ID = "ibm/granite-3-2b-instruct"
+UPLOAD_MAX_BYTES = int(UPLOAD_MAX_MB * 2 ** 20)
 
 # Response schema
 class SDLCClassificationResponse(BaseModel):
     extracted_text: str
     classified_sentences: str
     raw_response: dict
+    # Where each page starts in extracted_text
+    page_offsets: List[int] = []
 
 class SentenceClassification(BaseModel):
     sentence: str
     phase: str
     confidence: float = None
 
-async def get_bearer_token(api_key: str):
-    """Get IAM bearer token from IBM Cloud"""
-    token_url = "https://iam.cloud.ibm.com/identity/token"
-    data = {
-        "grant_type": "urn:ibm:params:oauth:grant-type:apikey",
-        "apikey": api_key
-    }
-    async with httpx.AsyncClient() as client:
-        response = await client.post(token_url, data=data, headers={"Content-Type": "application/x-www-form-urlencoded"})
-        response.raise_for_status()
-        return response.json()["access_token"]
-
 def extract_text_from_pdf(pdf_content: bytes) -> str:
-    """Extract text from PDF using PyMuPDF"""
+    """Extract text from PDF using PyMuPDF, in this process (the route uses the worker pool)"""
     try:
-        # Create a PDF document from bytes
-        pdf_document = fitz.open(stream=pdf_content, filetype="pdf")
-        
-        extracted_text = ""
-        for page_num in range(pdf_document.page_count):
-            page = pdf_document[page_num]
-            extracted_text += page.get_text() + "\n"
-        
-        pdf_document.close()
-        return extracted_text.strip()
-    
+        return assemble(extract_pages(pdf_content)).text
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Error extracting text from PDF: {str(e)}")
 
-@router.post("/classify-pdf-sdlc/", response_model=SDLCClassificationResponse)
-async def classify_pdf_sdlc(file: UploadFile = File(...)):
+@router.post(
+    "/classify-pdf-sdlc/",
+    response_model=SDLCClassificationResponse,
+    # The body is optional: a completed chunked upload can be named with upload_id instead
+    openapi_extra={"requestBody": {**FILE_UPLOAD_OPENAPI["requestBody"], "required": False}},
+)
+async def classify_pdf_sdlc(request: Request, upload_id: Optional[str] = None):
     """
-    Upload a PDF file, extract text, and classify each sentence into SDLC phases
+    Upload a PDF file, extract text, and classify each sentence into SDLC phases.
+    Large files can be sent through /uploads first and classified with `upload_id`.
     """
+    memory = pdf_memory.track()
+    upload = None
     try:
+        with memory.stage("upload"):
+            if upload_id is not None:
+                upload = await chunked_uploads.get(upload_id)
+                if not upload.completed:
+                    raise HTTPException(status_code=409, detail="Upload not completed yet")
+                if upload.size > UPLOAD_MAX_BYTES:
+                    # The same cap as a streamed upload, whatever CHUNKED_UPLOAD_MAX_MB allows
+                    raise too_large(UPLOAD_MAX_BYTES)
+            else:
+                # Stream the upload to memory or a temp file, refusing it once past the size cap
+                upload = await receive_upload(request, "file")
+        set_response_header("X-Content-SHA256", upload.sha256)
+
         # Validate file type
-        if not file.filename.lower().endswith('.pdf'):
+        if not upload.filename.lower().endswith('.pdf'):
             raise HTTPException(status_code=400, detail="Only PDF files are allowed")
+        # Charged at its full size: however little of it is held in memory here, MuPDF
+        # loads the whole document to extract it
+        memory_ceiling.check("upload", upload.size)
         
-        # Read PDF content
-        pdf_content = await file.read()
-        
-        # Extract text from PDF
-        extracted_text = extract_text_from_pdf(pdf_content)
+        # Extract text from PDF in the worker pool (which opens large uploads from
+        # their temp file), giving up once past the memory ceiling
+        with timed_stage("pdf_extraction"), memory.stage("pdf_extraction"):
+            try:
+                extracted = await pdf_extractor.extract(
+                    upload.source(), lambda chars: memory_ceiling.check("pdf_extraction", upload.size, chars)
+                )
+            except ExtractionTimeout as e:
+                raise HTTPException(status_code=422, detail=f"Error extracting text from PDF: {str(e)}")
+            except ExtractionError as e:
+                raise HTTPException(status_code=400, detail=f"Error extracting text from PDF: {str(e)}")
+            except ExtractionWorkerError as e:
+                # Our workers failed, not the document: the client may retry
+                raise HTTPException(status_code=503, detail=f"PDF extraction is temporarily unavailable: {str(e)}")
+        extracted_text = extracted.text
+        tracing.set_attributes({tracing.ATTR_PDF_PAGES: extracted.page_count, "smartsdlc.pdf.bytes": upload.size})
         
         if not extracted_text:
             raise HTTPException(status_code=400, detail="No text found in the PDF")
         
-        # Step 1: Get bearer token
-        bearer_token = await get_bearer_token(API_KEY)
-
-        # Step 2: Prepare request with SDLC classification prompt
+        # Step 1: Prepare request with SDLC classification prompt
         classification_prompt = (
             "Classify each sentence into specific SDLC phases such as Requirements, Design, Development, Testing, or Deployment. "
             "Analyze the following text and for each sentence, identify which SDLC phase it belongs to. "
@@ -88,46 +106,49 @@ async def classify_pdf_sdlc(file: UploadFile = File(...)):
             "If a sentence doesn't clearly fit into any SDLC phase, classify it as 'General' or 'Other'."
         )
 
-        url = f"{BASE_URL}/ml/v1/text/chat?version=2023-05-29"
-        body = {
-            "project_id": PROJECT_ID,
-            "model_id": MODEL_ID,
-            "frequency_penalty": 0,
-            "max_tokens": 3000,
-            "presence_penalty": 0,
-            "temperature": 0.1,  # Lower temperature for more consistent classification
-            "top_p": 1,
-            "messages": [
-                {"role": "system", "content": classification_prompt},
-                {"role": "user", "content": f"Text to classify:\n\n{extracted_text}"}
-            ]
-        }
-        headers = {
-            "Accept": "application/json",
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {bearer_token}"
-        }
-
-        # Step 3: Make request to WatsonX AI
-        async with httpx.AsyncClient(timeout=60.0) as client:
-            response = await client.post(url, headers=headers, json=body)
-
-        # Step 4: Process response
+        with memory.stage("prompt"):
+            body = {
+                "project_id": PROJECT_ID,
+                "model_id": MODEL_ID,
+                "frequency_penalty": 0,
+                "max_tokens": 3000,
+                "presence_penalty": 0,
+                "temperature": 0.1,  # Lower temperature for more consistent classification
+                "top_p": 1,
+                "messages": [
+                    {"role": "system", "content": classification_prompt},
+                    {"role": "user", "content": f"Text to classify:\n\n{extracted_text}"}
+                ]
+            }
+
+        # Step 2: Make request to WatsonX AI
+        with memory.stage("upstream"):
+            response = await gateway.chat(body, "pdf")
+
+        # Step 3: Process response
         if response.status_code != 200:
             raise HTTPException(status_code=response.status_code, detail=f"WatsonX AI API error: {response.text}")
 
         # Extract the classification result from the response
-        response_data = response.json()
-        classified_sentences = response_data.get("choices", [{}])[0].get("message", {}).get("content", "")
+        with timed_stage("response_parsing"), memory.stage("response_parsing"):
+            response_data = response.json()
+            classified_sentences = response_data.get("choices", [{}])[0].get("message", {}).get("content", "")
         
-        return SDLCClassificationResponse(
-            extracted_text=extracted_text,
-            classified_sentences=classified_sentences,
-            raw_response=response_data
-        )
+        with memory.stage("response"):
+            result = SDLCClassificationResponse(
+                extracted_text=extracted_text,
+                classified_sentences=classified_sentences,
+                raw_response=response_data,
+                page_offsets=extracted.page_offsets
+            )
+        return result
 
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
+    finally:
+        if upload is not None:
+            upload.close()
+        memory.finish()
 
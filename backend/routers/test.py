@@ -1,18 +1,21 @@
 from fastapi import APIRouter, HTTPException
 from pydantic import BaseModel
-import httpx
 import os
 from dotenv import load_dotenv
 from typing import Optional, List
+from services.gateway import gateway
+from services.metrics import TimedRoute
+from services.request_context import timed_stage
+from services.code_normalizer import canonicalize_code
+from services.sse import sse_response
+import time
 
 # Load environment variables
 load_dotenv()
 
-router = APIRouter()
+router = APIRouter(route_class=TimedRoute)
 
 # Config
-API_KEY = os.getenv("API_KEY")
-BASE_URL = "https://us-south.ml.cloud.ibm.com"  # Adjust region if needed
 PROJECT_ID = os.getenv("PROJECT_ID")  # Put your project id in .env
 MODEL_ID = "ibm/granite-3-2b-instruct"
 
@@ -51,31 +54,19 @@ class TestCaseCheckResponse(BaseModel):
     test_framework: str
     raw_response: dict
 
-async def get_bearer_token(api_key: str):
-    """Get IAM bearer token from IBM Cloud"""
-    token_url = "https://iam.cloud.ibm.com/identity/token"
-    data = {
-        "grant_type": "urn:ibm:params:oauth:grant-type:apikey",
-        "apikey": api_key
-    }
-    async with httpx.AsyncClient() as client:
-        response = await client.post(token_url, data=data, headers={"Content-Type": "application/x-www-form-urlencoded"})
-        response.raise_for_status()
-        return response.json()["access_token"]
-
 @router.post("/generate-test-cases/", response_model=TestCaseGenerateResponse)
-async def generate_test_cases_endpoint(req: TestCaseGenerateRequest):
+async def generate_test_cases_endpoint(req: TestCaseGenerateRequest, stream: bool = False):
     """
-    Generate comprehensive test cases for given code
+    Generate comprehensive test cases for given code.
+    With `?stream=true` the tests are streamed as server-sent events.
     """
     try:
+        start_time = time.time()
+
         # Validate input
         if not req.code.strip():
             raise HTTPException(status_code=400, detail="Code input cannot be empty")
         
-        # Get bearer token
-        bearer_token = await get_bearer_token(API_KEY)
-
         # Prepare request with test case generation prompt
         framework_info = f" using {req.test_framework}" if req.test_framework else ""
         system_prompt = (
@@ -94,7 +85,6 @@ async def generate_test_cases_endpoint(req: TestCaseGenerateRequest):
         if req.description:
             user_message += f"\n\nAdditional context:\n{req.description}"
 
-        url = f"{BASE_URL}/ml/v1/text/chat?version=2023-05-29"
         body = {
             "project_id": PROJECT_ID,
             "model_id": MODEL_ID,
@@ -108,21 +98,28 @@ async def generate_test_cases_endpoint(req: TestCaseGenerateRequest):
                 {"role": "user", "content": user_message}
             ]
         }
-        headers = {
-            "Accept": "application/json",
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {bearer_token}"
+
+        # Opt-in streaming: relay tokens as server-sent events
+        if stream:
+            chunks = await gateway.chat_stream(body, "test")
+            return sse_response(chunks, start_time)
+
+        # Key the cache on the canonical code so formatting-only edits share an answer
+        key_message = {
+            "code": canonicalize_code(req.code, req.programming_language),
+            "description": req.description,
         }
+        key_body = {**body, "messages": [body["messages"][0], {"role": "user", "content": key_message}]}
 
         # Make request to WatsonX AI
-        async with httpx.AsyncClient(timeout=120.0) as client:
-            response = await client.post(url, headers=headers, json=body)
+        response = await gateway.chat(body, "test", key_body=key_body)
 
         if response.status_code != 200:
             raise HTTPException(status_code=response.status_code, detail=f"WatsonX AI API error: {response.text}")
 
-        response_data = response.json()
-        generated_tests = response_data.get("choices", [{}])[0].get("message", {}).get("content", "")
+        with timed_stage("response_parsing"):
+            response_data = response.json()
+            generated_tests = response_data.get("choices", [{}])[0].get("message", {}).get("content", "")
 
         return TestCaseGenerateResponse(
             original_code=req.code,
@@ -138,6 +135,67 @@ async def generate_test_cases_endpoint(req: TestCaseGenerateRequest):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
 
+def parse_test_analysis(ai_response: str):
+    """Split a test-analysis reply into (analysis, improved tests, coverage suggestions)"""
+    test_analysis = ""
+    improved_tests = ""
+    coverage_suggestions = ""
+
+    # Try to parse structured response
+    if "**TEST ANALYSIS:**" in ai_response:
+        sections = ai_response.split("**TEST ANALYSIS:**")[1]
+        if "**IMPROVED TESTS:**" in sections:
+            parts = sections.split("**IMPROVED TESTS:**")
+            test_analysis = parts[0].strip()
+            remaining = parts[1]
+
+            if "**COVERAGE SUGGESTIONS:**" in remaining:
+                test_parts = remaining.split("**COVERAGE SUGGESTIONS:**")
+                improved_tests = test_parts[0].strip()
+                coverage_suggestions = test_parts[1].strip()
+            else:
+                improved_tests = remaining.strip()
+        else:
+            test_analysis = sections.strip()
+
+    # Fallback parsing if structured format not found
+    if not test_analysis and not improved_tests:
+        lines = ai_response.split('\n')
+        current_section = ""
+
+        for line in lines:
+            line_lower = line.lower().strip()
+            if "analysis" in line_lower or "current test" in line_lower:
+                current_section = "analysis"
+                continue
+            elif "improved" in line_lower or "better test" in line_lower or "additional test" in line_lower:
+                current_section = "improved"
+                continue
+            elif "coverage" in line_lower or "suggestion" in line_lower or "recommend" in line_lower:
+                current_section = "coverage"
+                continue
+
+            if line.strip():
+                if current_section == "analysis":
+                    test_analysis += line + "\n"
+                elif current_section == "improved":
+                    improved_tests += line + "\n"
+                elif current_section == "coverage":
+                    coverage_suggestions += line + "\n"
+
+    # If parsing completely fails, distribute content
+    if not test_analysis and not improved_tests and not coverage_suggestions:
+        sections = ai_response.split('\n\n')
+        if len(sections) >= 3:
+            test_analysis = sections[0]
+            improved_tests = sections[1]
+            coverage_suggestions = '\n\n'.join(sections[2:])
+        else:
+            test_analysis = ai_response
+
+    return test_analysis, improved_tests, coverage_suggestions
+
+
 @router.post("/check-test-cases/", response_model=TestCaseCheckResponse)
 async def check_test_cases_endpoint(req: TestCaseCheckRequest):
     """
@@ -150,9 +208,6 @@ async def check_test_cases_endpoint(req: TestCaseCheckRequest):
         if not req.test_cases.strip():
             raise HTTPException(status_code=400, detail="Test cases cannot be empty")
 
-        # Get bearer token
-        bearer_token = await get_bearer_token(API_KEY)
-
         # Prepare request with test case analysis prompt
         system_prompt = (
             f"You are an expert {req.programming_language} developer and testing specialist. "
@@ -190,7 +245,6 @@ Existing test cases{framework_info}:
         if req.description:
             user_message += f"\n\nAdditional context:\n{req.description}"
 
-        url = f"{BASE_URL}/ml/v1/text/chat?version=2023-05-29"
         body = {
             "project_id": PROJECT_ID,
             "model_id": MODEL_ID,
@@ -204,80 +258,30 @@ Existing test cases{framework_info}:
                 {"role": "user", "content": user_message}
             ]
         }
-        headers = {
-            "Accept": "application/json",
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {bearer_token}"
+
+        # Key the cache on the canonical code and tests so formatting-only edits share an answer
+        key_message = {
+            "code": canonicalize_code(req.code, req.programming_language),
+            "test_cases": canonicalize_code(req.test_cases, req.programming_language),
+            "test_framework": req.test_framework,
+            "description": req.description,
         }
+        key_body = {**body, "messages": [body["messages"][0], {"role": "user", "content": key_message}]}
 
         # Make request to WatsonX AI
-        async with httpx.AsyncClient(timeout=120.0) as client:
-            response = await client.post(url, headers=headers, json=body)
+        response = await gateway.chat(body, "test", key_body=key_body)
 
         if response.status_code != 200:
             raise HTTPException(status_code=response.status_code, detail=f"WatsonX AI API error: {response.text}")
 
-        # Extract the test analysis result from the response
-        response_data = response.json()
-        ai_response = response_data.get("choices", [{}])[0].get("message", {}).get("content", "")
-        
-        # Parse the AI response to extract different sections
-        test_analysis = ""
-        improved_tests = ""
-        coverage_suggestions = ""
-        
-        # Try to parse structured response
-        if "**TEST ANALYSIS:**" in ai_response:
-            sections = ai_response.split("**TEST ANALYSIS:**")[1]
-            if "**IMPROVED TESTS:**" in sections:
-                parts = sections.split("**IMPROVED TESTS:**")
-                test_analysis = parts[0].strip()
-                remaining = parts[1]
-                
-                if "**COVERAGE SUGGESTIONS:**" in remaining:
-                    test_parts = remaining.split("**COVERAGE SUGGESTIONS:**")
-                    improved_tests = test_parts[0].strip()
-                    coverage_suggestions = test_parts[1].strip()
-                else:
-                    improved_tests = remaining.strip()
-            else:
-                test_analysis = sections.strip()
-        
-        # Fallback parsing if structured format not found
-        if not test_analysis and not improved_tests:
-            lines = ai_response.split('\n')
-            current_section = ""
-            
-            for line in lines:
-                line_lower = line.lower().strip()
-                if "analysis" in line_lower or "current test" in line_lower:
-                    current_section = "analysis"
-                    continue
-                elif "improved" in line_lower or "better test" in line_lower or "additional test" in line_lower:
-                    current_section = "improved"
-                    continue
-                elif "coverage" in line_lower or "suggestion" in line_lower or "recommend" in line_lower:
-                    current_section = "coverage"
-                    continue
-                
-                if line.strip():
-                    if current_section == "analysis":
-                        test_analysis += line + "\n"
-                    elif current_section == "improved":
-                        improved_tests += line + "\n"
-                    elif current_section == "coverage":
-                        coverage_suggestions += line + "\n"
-        
-        # If parsing completely fails, distribute content
-        if not test_analysis and not improved_tests and not coverage_suggestions:
-            sections = ai_response.split('\n\n')
-            if len(sections) >= 3:
-                test_analysis = sections[0]
-                improved_tests = sections[1]
-                coverage_suggestions = '\n\n'.join(sections[2:])
-            else:
-                test_analysis = ai_response
-        
+        with timed_stage("response_parsing"):
+            # Extract the test analysis result from the response
+            response_data = response.json()
+            ai_response = response_data.get("choices", [{}])[0].get("message", {}).get("content", "")
+
+            # Parse the AI response to extract different sections
+            test_analysis, improved_tests, coverage_suggestions = parse_test_analysis(ai_response)
+
         return TestCaseCheckResponse(
             original_code=req.code,
             original_tests=req.test_cases,
@@ -0,0 +1,74 @@
+from typing import Optional
+
+from fastapi import APIRouter, Header, HTTPException, Request
+from pydantic import BaseModel
+
+from services.chunked_uploads import chunked_uploads
+from services.metrics import TimedRoute
+
+router = APIRouter(prefix="/uploads", tags=["uploads"], route_class=TimedRoute)
+
+
+# Request schema
+class CreateUploadRequest(BaseModel):
+    filename: str
+    size: int
+    # SHA-256 of the whole file, checked when the upload is completed
+    sha256: Optional[str] = None
+
+
+async def read_chunk(request: Request, limit: int) -> bytes:
+    """The request body, refused with 413 as soon as it passes `limit` bytes"""
+    declared = request.headers.get("content-length")
+    if declared and declared.isdigit() and int(declared) > limit:
+        raise HTTPException(status_code=413, detail=f"Chunk too large, the limit is {limit} bytes")
+    body = bytearray()
+    async for data in request.stream():
+        body += data
+        if len(body) > limit:
+            raise HTTPException(status_code=413, detail=f"Chunk too large, the limit is {limit} bytes")
+    return bytes(body)
+
+
+@router.post("", status_code=201)
+async def create_upload(upload: CreateUploadRequest):
+    """
+    Start a resumable upload. PUT the file's bytes in chunks to
+    /uploads/{upload_id}?offset=N with an X-Chunk-SHA256 header, then POST
+    /uploads/{upload_id}/complete and classify with
+    /classify-pdf-sdlc/?upload_id={upload_id}.
+    """
+    session = await chunked_uploads.create(upload.filename, upload.size, upload.sha256)
+    return {**session.to_dict(), "max_chunk_size": chunked_uploads.max_chunk_bytes}
+
+
+@router.get("/{upload_id}")
+async def get_upload(upload_id: str):
+    """Byte ranges received so far and those still missing, to resume an interrupted upload"""
+    session = await chunked_uploads.get(upload_id)
+    return session.to_dict()
+
+
+@router.put("/{upload_id}")
+async def put_chunk(upload_id: str, offset: int, request: Request, x_chunk_sha256: str = Header(...)):
+    """Write one chunk (the raw request body) at `offset`; resending a chunk is harmless"""
+    # 404 before reading the body
+    await chunked_uploads.get(upload_id)
+    data = await read_chunk(request, chunked_uploads.max_chunk_bytes)
+    if not data:
+        raise HTTPException(status_code=400, detail="Empty chunk")
+    session = await chunked_uploads.write_chunk(upload_id, offset, data, x_chunk_sha256)
+    return {"received_bytes": session.received_bytes, "size": session.size, "received": session.ranges}
+
+
+@router.post("/{upload_id}/complete")
+async def complete_upload(upload_id: str):
+    """Check that every byte arrived and that the file matches its announced SHA-256"""
+    session = await chunked_uploads.complete(upload_id)
+    return {**session.to_dict(), "sha256": session.final_sha256}
+
+
+@router.delete("/{upload_id}")
+async def delete_upload(upload_id: str):
+    await chunked_uploads.delete(upload_id)
+    return {"message": "Upload deleted"}
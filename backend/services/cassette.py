@@ -0,0 +1,299 @@
+import asyncio
+import base64
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+import zlib
+from typing import AsyncIterator, List, Optional
+from urllib.parse import parse_qsl, urlencode
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+REDACTED = "REDACTED"
+
+# Never written to a cassette
+_SECRET_HEADERS = {"authorization", "cookie", "set-cookie", "x-api-key", "proxy-authorization"}
+_SECRET_FIELDS = {"apikey", "api_key", "access_token", "refresh_token", "project_id", "space_id", "password"}
+# Describe the bytes as they went over the wire, which no longer holds after redaction
+_DROPPED_RESPONSE_HEADERS = {"content-length", "transfer-encoding", "content-encoding", "connection", "keep-alive"}
+
+
+def _redact_json(value):
+    if isinstance(value, dict):
+        return {k: (REDACTED if k.lower() in _SECRET_FIELDS else _redact_json(v)) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_redact_json(v) for v in value]
+    return value
+
+
+def _redact_headers(headers: httpx.Headers) -> dict:
+    return {k: (REDACTED if k.lower() in _SECRET_HEADERS else v) for k, v in headers.items()}
+
+
+def _redact_body(content: bytes, content_type: str) -> str:
+    text = content.decode("utf-8", errors="replace")
+    if "application/x-www-form-urlencoded" in content_type:
+        fields = [(k, REDACTED if k.lower() in _SECRET_FIELDS else v) for k, v in parse_qsl(text, keep_blank_values=True)]
+        return urlencode(fields)
+    try:
+        return json.dumps(_redact_json(json.loads(text)), sort_keys=True, ensure_ascii=False)
+    except ValueError:
+        return text
+
+
+def _decode(content: bytes, encoding: str) -> Optional[bytes]:
+    """Undo gzip/deflate so bodies can be redacted and read; None for other encodings"""
+    encoding = (encoding or "identity").strip().lower()
+    if encoding == "identity":
+        return content
+    try:
+        if encoding == "gzip":
+            return zlib.decompress(content, 16 + zlib.MAX_WBITS)
+        if encoding == "deflate":
+            return zlib.decompress(content)
+    except zlib.error:
+        return None
+    return None
+
+
+def request_key(method: str, path: str, body: str) -> str:
+    """Exact-match key of a redacted request"""
+    return hashlib.sha256(f"{method} {path}\n{body}".encode("utf-8")).hexdigest()
+
+
+class _RecordingStream(httpx.AsyncByteStream):
+    """Passes response bytes through to the caller while noting when each chunk arrived"""
+
+    def __init__(self, inner: httpx.AsyncByteStream, on_close):
+        self.inner = inner
+        self.on_close = on_close
+        self.started = time.perf_counter()
+        self.chunks = []  # (seconds after the response headers, bytes)
+        self.complete = False
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        async for chunk in self.inner:
+            self.chunks.append((time.perf_counter() - self.started, chunk))
+            yield chunk
+        self.complete = True
+
+    async def aclose(self):
+        await self.inner.aclose()
+        await self.on_close(self)
+
+
+class RecordingTransport(httpx.AsyncBaseTransport):
+    """
+    Forwards upstream calls to the real transport and appends each exchange to a
+    JSONL cassette: the redacted request, the response status, headers and body
+    chunks, the time to the response headers and the arrival time of every chunk.
+
+    Credentials never reach the file: auth headers, API keys, bearer tokens and
+    project ids are replaced with "REDACTED". Streams are recorded as they are
+    consumed, so callers see no difference.
+    """
+
+    def __init__(self, inner: httpx.AsyncBaseTransport, path: str):
+        self.inner = inner
+        self.path = path
+        self._lock = threading.Lock()
+        self.recorded = 0
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        content = await request.aread()
+        sent = time.perf_counter()
+        response = await self.inner.handle_async_request(request)
+        ttfb = time.perf_counter() - sent
+
+        body = _redact_body(content, request.headers.get("content-type", ""))
+        entry = {
+            "recorded_at": time.time(),
+            "request": {
+                "method": request.method,
+                "url": str(request.url.copy_with(query=None)),
+                "path": request.url.path,
+                "query": request.url.query.decode("ascii", errors="replace"),
+                "headers": _redact_headers(request.headers),
+                "body": body,
+                "key": request_key(request.method, request.url.path, body),
+            },
+            "response": {"status": response.status_code, "headers": dict(response.headers)},
+            "timing": {"ttfb": round(ttfb, 6)},
+        }
+
+        async def on_close(stream: _RecordingStream):
+            await asyncio.to_thread(self._write, entry, stream)
+
+        return httpx.Response(
+            status_code=response.status_code,
+            headers=response.headers,
+            stream=_RecordingStream(response.stream, on_close),
+            extensions=response.extensions,
+        )
+
+    def _write(self, entry: dict, stream: _RecordingStream):
+        headers = entry["response"]["headers"]
+        raw = b"".join(chunk for _, chunk in stream.chunks)
+        decoded = _decode(raw, headers.get("content-encoding", "identity"))
+        if decoded is None:
+            chunks = None
+        elif decoded is raw:
+            chunks = stream.chunks
+        else:
+            # Compressed bodies are stored as one decoded chunk
+            chunks = [(stream.chunks[-1][0], decoded)]
+
+        if chunks is None:
+            # Undecodable encoding: keep the wire bytes, nothing in them can be redacted
+            entry["response"]["body_base64"] = base64.b64encode(raw).decode("ascii")
+            entry["response"]["headers"] = _redact_headers(httpx.Headers(headers))
+        else:
+            body_chunks = []
+            if any(field in decoded for field in (b'"access_token"', b'"refresh_token"')):
+                # IAM token response: one redacted chunk
+                chunks = [(chunks[-1][0] if chunks else 0.0, _redact_body(decoded, "application/json").encode("utf-8"))]
+            for offset, chunk in chunks:
+                try:
+                    body_chunks.append({"t": round(offset, 6), "text": chunk.decode("utf-8")})
+                except UnicodeDecodeError:
+                    body_chunks.append({"t": round(offset, 6), "base64": base64.b64encode(chunk).decode("ascii")})
+            entry["response"]["chunks"] = body_chunks
+            entry["response"]["headers"] = {
+                k: v for k, v in _redact_headers(httpx.Headers(headers)).items() if k.lower() not in _DROPPED_RESPONSE_HEADERS
+            }
+        entry["response"]["complete"] = stream.complete
+        entry["timing"]["total"] = round(entry["timing"]["ttfb"] + (stream.chunks[-1][0] if stream.chunks else 0.0), 6)
+
+        line = json.dumps(entry, ensure_ascii=False)
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+            self.recorded += 1
+
+    async def aclose(self):
+        await self.inner.aclose()
+
+    def stats(self) -> dict:
+        return {"mode": "record", "path": self.path, "recorded": self.recorded}
+
+
+class _ReplayStream(httpx.AsyncByteStream):
+    def __init__(self, chunks: List[tuple], latency_scale: float):
+        self.chunks = chunks
+        self.latency_scale = latency_scale
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        previous = 0.0
+        for offset, chunk in self.chunks:
+            if self.latency_scale > 0 and offset > previous:
+                await asyncio.sleep((offset - previous) * self.latency_scale)
+            previous = offset
+            yield chunk
+
+
+class ReplayTransport(httpx.AsyncBaseTransport):
+    """
+    Serves upstream calls from a cassette instead of the network, with the recorded
+    time to first byte and chunk pacing multiplied by `latency_scale` (1 = as
+    recorded, 0 = no delay).
+
+    A request is matched on method, path and redacted body. Requests that were
+    never recorded (e.g. generated load-test payloads) get the recorded exchanges
+    for the same path in recording order, cycling, so a run is deterministic
+    either way. Token responses get a fresh `expiration` on replay.
+    """
+
+    def __init__(self, path: str, latency_scale: float = 1.0):
+        self.path = path
+        self.latency_scale = latency_scale
+        self._by_key = {}
+        self._by_path = {}
+        self._cursors = {}
+        self.exact_hits = 0
+        self.path_hits = 0
+        self.misses = 0
+
+        entries = []
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    entries.append(json.loads(line))
+        # Streams cut short by the client are only used when nothing complete was recorded
+        complete = [entry for entry in entries if entry["response"].get("complete", True)]
+        for entry in complete or entries:
+            request = entry["request"]
+            self._by_key.setdefault(request["key"], []).append(entry)
+            self._by_path.setdefault((request["method"], request["path"]), []).append(entry)
+        logger.info("Replaying %d upstream exchanges from %s", len(complete or entries), path)
+
+    def _next(self, bucket: str, entries: list) -> dict:
+        cursor = self._cursors.get(bucket, 0)
+        self._cursors[bucket] = cursor + 1
+        return entries[cursor % len(entries)]
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        content = await request.aread()
+        body = _redact_body(content, request.headers.get("content-type", ""))
+        key = request_key(request.method, request.url.path, body)
+        if key in self._by_key:
+            self.exact_hits += 1
+            entry = self._next(key, self._by_key[key])
+        elif (request.method, request.url.path) in self._by_path:
+            self.path_hits += 1
+            entry = self._next(f"{request.method} {request.url.path}", self._by_path[(request.method, request.url.path)])
+        else:
+            self.misses += 1
+            return httpx.Response(
+                404,
+                json={"errors": [{"code": "cassette_miss", "message": f"No recorded exchange for {request.method} {request.url.path}"}]},
+                request=request,
+            )
+
+        if self.latency_scale > 0:
+            await asyncio.sleep(entry["timing"]["ttfb"] * self.latency_scale)
+
+        recorded = entry["response"]
+        if "body_base64" in recorded:
+            chunks = [(0.0, base64.b64decode(recorded["body_base64"]))]
+        else:
+            chunks = [
+                (chunk["t"], chunk["text"].encode("utf-8") if "text" in chunk else base64.b64decode(chunk["base64"]))
+                for chunk in recorded.get("chunks", [])
+            ]
+        if len(chunks) == 1 and b'"expiration"' in chunks[0][1]:
+            chunks = [(chunks[0][0], self._refresh_expiration(chunks[0][1]))]
+
+        return httpx.Response(
+            status_code=recorded["status"],
+            headers=recorded["headers"],
+            stream=_ReplayStream(chunks, self.latency_scale),
+            request=request,
+        )
+
+    @staticmethod
+    def _refresh_expiration(content: bytes) -> bytes:
+        try:
+            payload = json.loads(content)
+        except ValueError:
+            return content
+        if isinstance(payload, dict) and "expiration" in payload:
+            payload["expiration"] = int(time.time() + float(payload.get("expires_in", 3600)))
+            return json.dumps(payload).encode("utf-8")
+        return content
+
+    def stats(self) -> dict:
+        return {
+            "mode": "replay",
+            "path": self.path,
+            "latency_scale": self.latency_scale,
+            "recorded_requests": sum(len(entries) for entries in self._by_path.values()),
+            "exact_hits": self.exact_hits,
+            "path_hits": self.path_hits,
+            "misses": self.misses,
+        }
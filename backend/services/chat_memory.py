@@ -0,0 +1,221 @@
+import asyncio
+import contextvars
+import logging
+import math
+import time
+import uuid
+from collections import OrderedDict
+from typing import Awaitable, Callable, List, Optional
+
+from config import (
+    CHAT_MEMORY_MAX_SESSIONS,
+    CHAT_MEMORY_MAX_BYTES,
+    CHAT_MEMORY_TTL,
+    CHAT_PROMPT_TOKEN_BUDGET,
+    CHAT_SUMMARY_TOKEN_BUDGET,
+)
+
+logger = logging.getLogger(__name__)
+
+# Folds (previous summary, turns) into a new summary
+Summarizer = Callable[[str, List[dict]], Awaitable[str]]
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (~4 characters per token); no tokenizer is needed to keep budgets flat"""
+    return math.ceil(len(text) / 4) + 1
+
+
+def _truncate_to_tokens(text: str, tokens: int, keep_end: bool = False) -> str:
+    limit = max(tokens, 0) * 4
+    if len(text) <= limit:
+        return text
+    return "…" + text[-limit:] if keep_end else text[:limit] + "…"
+
+
+def extractive_summary(summary: str, turns: List[dict], budget: int = CHAT_SUMMARY_TOKEN_BUDGET) -> str:
+    """Cheap summary: the previous summary plus the opening of each folded turn, newest kept on overflow"""
+    lines = [summary] if summary else []
+    for turn in turns:
+        speaker = "User" if turn["role"] == "user" else "Assistant"
+        lines.append(f"{speaker}: {_truncate_to_tokens(turn['content'].strip(), 40)}")
+    return _truncate_to_tokens("\n".join(lines), budget, keep_end=True)
+
+
+class ChatSession:
+    __slots__ = ("session_id", "turns", "summary", "pending", "last_used", "folding")
+
+    def __init__(self, session_id: str):
+        self.session_id = session_id
+        # Recent turns kept verbatim, oldest first
+        self.turns: List[dict] = []
+        # Rolling summary of everything older than `turns`
+        self.summary = ""
+        # Turns pushed out of the window but not yet folded into `summary`
+        self.pending: List[dict] = []
+        self.last_used = time.time()
+        self.folding: Optional[asyncio.Task] = None
+
+    def size(self) -> int:
+        return len(self.summary) + sum(len(turn["content"]) for turn in self.turns + self.pending)
+
+
+class ChatMemory:
+    """
+    Server-side chat history keyed by session id.
+
+    Each prompt is built from a fixed token budget: the rolling summary first,
+    then as many of the most recent turns as fit, verbatim. Turns that fall out of
+    the window are folded into the summary in the background (by the model when a
+    summarizer is given, extractively otherwise), so prompt size stays flat however
+    long the conversation runs. Sessions live in an LRU bounded by count, total
+    bytes and idle time.
+    """
+
+    def __init__(
+        self,
+        summarizer: Optional[Summarizer] = None,
+        max_sessions: int = CHAT_MEMORY_MAX_SESSIONS,
+        max_bytes: int = CHAT_MEMORY_MAX_BYTES,
+        ttl: float = CHAT_MEMORY_TTL,
+        prompt_budget: int = CHAT_PROMPT_TOKEN_BUDGET,
+        summary_budget: int = CHAT_SUMMARY_TOKEN_BUDGET,
+    ):
+        self.summarizer = summarizer
+        self.max_sessions = max_sessions
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.prompt_budget = prompt_budget
+        self.summary_budget = min(summary_budget, prompt_budget // 2)
+        self._sessions: "OrderedDict[str, ChatSession]" = OrderedDict()
+        self._bytes = 0
+
+        self.evictions = 0
+        self.folds = 0
+        self.fold_failures = 0
+
+    def session(self, session_id: Optional[str] = None) -> ChatSession:
+        """Return the session, creating it (with a fresh id when none is given)"""
+        self._expire()
+        session_id = session_id or str(uuid.uuid4())
+        session = self._sessions.get(session_id)
+        if session is None:
+            session = ChatSession(session_id)
+            self._sessions[session_id] = session
+            self._evict()
+        else:
+            self._sessions.move_to_end(session_id)
+        session.last_used = time.time()
+        return session
+
+    def build_messages(self, session: ChatSession, message: str) -> List[dict]:
+        """Summary + recent turns + the new user message, within the prompt budget"""
+        remaining = self.prompt_budget - estimate_tokens(message)
+
+        summary = session.summary
+        if session.pending:
+            # Folding still running: stand in with an extractive summary of the pending turns
+            summary = extractive_summary(summary, session.pending, self.summary_budget)
+        summary_message = None
+        if summary and remaining > 0:
+            summary_message = {
+                "role": "system",
+                "content": "Summary of the earlier conversation:\n" + _truncate_to_tokens(summary, min(self.summary_budget, remaining), keep_end=True),
+            }
+            remaining -= estimate_tokens(summary_message["content"])
+
+        recent = []
+        for turn in reversed(session.turns):
+            cost = estimate_tokens(turn["content"])
+            if cost > remaining:
+                break
+            recent.append({"role": turn["role"], "content": turn["content"]})
+            remaining -= cost
+        recent.reverse()
+
+        messages = [summary_message] if summary_message else []
+        return messages + recent + [{"role": "user", "content": message}]
+
+    def record_exchange(self, session: ChatSession, message: str, reply: str):
+        """Append a user/assistant exchange and push what no longer fits out of the window"""
+        before = session.size()
+        session.turns.append({"role": "user", "content": message})
+        session.turns.append({"role": "assistant", "content": reply})
+
+        # Keep the verbatim window within what build_messages can ever use
+        window_budget = self.prompt_budget - self.summary_budget
+        while len(session.turns) > 2 and sum(estimate_tokens(turn["content"]) for turn in session.turns) > window_budget:
+            session.pending.extend(session.turns[:2])
+            del session.turns[:2]
+
+        if self._tracked(session):
+            self._bytes += session.size() - before
+        if session.pending and session.folding is None:
+            # A fresh context: the fold must not inherit the triggering request's cache mode,
+            # caller (token budget), response headers or timing stages
+            session.folding = asyncio.get_running_loop().create_task(self._fold(session), context=contextvars.Context())
+        self._evict()
+
+    async def _fold(self, session: ChatSession):
+        try:
+            # Stops once the session is evicted or expires: nobody reads its summary any more
+            while session.pending and self._tracked(session):
+                batch = list(session.pending)
+                summary = None
+                if self.summarizer is not None:
+                    try:
+                        summary = await self.summarizer(session.summary, batch)
+                    except Exception as e:
+                        self.fold_failures += 1
+                        logger.warning("Chat summary failed, using extractive summary: %s", e)
+                if not summary:
+                    summary = extractive_summary(session.summary, batch, self.summary_budget)
+                previous = len(session.summary)
+                session.summary = _truncate_to_tokens(summary.strip(), self.summary_budget, keep_end=True)
+                del session.pending[:len(batch)]
+                if self._tracked(session):
+                    # Only this fold's change: turns recorded during the await were counted by
+                    # record_exchange(), and drop() already subtracted an evicted session
+                    self._bytes += len(session.summary) - previous - sum(len(turn["content"]) for turn in batch)
+                self.folds += 1
+        finally:
+            session.folding = None
+
+    def _tracked(self, session: ChatSession) -> bool:
+        """Whether `session` is still stored and counted in the byte total"""
+        return self._sessions.get(session.session_id) is session
+
+    def drop(self, session_id: str):
+        session = self._sessions.pop(session_id, None)
+        if session is not None:
+            self._bytes -= session.size()
+
+    def _expire(self):
+        cutoff = time.time() - self.ttl
+        while self._sessions:
+            oldest = next(iter(self._sessions.values()))
+            if oldest.last_used >= cutoff:
+                break
+            self.drop(oldest.session_id)
+            self.evictions += 1
+
+    def _evict(self):
+        while len(self._sessions) > 1 and (len(self._sessions) > self.max_sessions or self._bytes > self.max_bytes):
+            self.drop(next(iter(self._sessions)))
+            self.evictions += 1
+
+    def stats(self) -> dict:
+        return {
+            "sessions": len(self._sessions),
+            "max_sessions": self.max_sessions,
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "prompt_budget_tokens": self.prompt_budget,
+            "summary_budget_tokens": self.summary_budget,
+            "evictions": self.evictions,
+            "folds": self.folds,
+            "fold_failures": self.fold_failures,
+        }
+
+
+chat_memory = ChatMemory()
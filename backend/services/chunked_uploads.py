@@ -0,0 +1,414 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import re
+import time
+import uuid
+from contextlib import contextmanager
+from typing import List, Optional
+
+from fastapi import HTTPException
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+from config import (
+    CHUNKED_UPLOAD_DIR,
+    CHUNKED_UPLOAD_MAX_MB,
+    CHUNKED_UPLOAD_CHUNK_KB,
+    CHUNKED_UPLOAD_MAX_CHUNK_MB,
+    CHUNKED_UPLOAD_TTL_HOURS,
+    CHUNKED_UPLOAD_PRUNE_INTERVAL,
+)
+
+logger = logging.getLogger(__name__)
+
+_UPLOAD_ID = re.compile(r"^[0-9a-f]{32}$")
+_SHA256 = re.compile(r"^[0-9a-f]{64}$")
+# Read size when hashing an assembled file
+_HASH_BLOCK = 1024 * 1024
+
+
+def add_range(ranges: List[List[int]], start: int, end: int) -> List[List[int]]:
+    """Merge [start, end) into sorted, non-overlapping ranges"""
+    merged = []
+    for current in sorted(ranges + [[start, end]]):
+        if merged and current[0] <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], current[1])
+        else:
+            merged.append(list(current))
+    return merged
+
+
+@contextmanager
+def _file_lock(path: str):
+    """Exclusive lock on `path`, held against every worker process (blocking)"""
+    with open(path, "a+b") as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        else:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def missing_ranges(ranges: List[List[int]], size: int) -> List[List[int]]:
+    gaps, position = [], 0
+    for start, end in ranges:
+        if start > position:
+            gaps.append([position, start])
+        position = max(position, end)
+    if position < size:
+        gaps.append([position, size])
+    return gaps
+
+
+class UploadSession:
+    """
+    One resumable upload: the chunks received so far, written at their
+    offsets into a file of the final size. Once completed it can stand in for
+    the streamed upload of /classify-pdf-sdlc/ (`?upload_id=`).
+
+    The metadata file is the only record of a session: any worker may receive
+    any chunk, so an instance is a snapshot, re-read under the session's lock
+    before every change.
+    """
+
+    def __init__(self, directory: str, id: str, filename: str, size: int, sha256: Optional[str], chunk_size: int,
+                 ranges: Optional[list] = None, completed: bool = False, created: Optional[float] = None,
+                 updated: Optional[float] = None, final_sha256: Optional[str] = None):
+        self.directory = directory
+        self.id = id
+        self.filename = filename
+        self.size = size
+        # Checksum of the whole file announced by the client, verified on completion
+        self.expected_sha256 = sha256
+        self.chunk_size = chunk_size
+        self.ranges = ranges or []
+        self.completed = completed
+        self.created = created or time.time()
+        self.updated = updated or self.created
+        self.final_sha256 = final_sha256
+
+    @property
+    def data_path(self) -> str:
+        return os.path.join(self.directory, f"{self.id}.part")
+
+    @property
+    def meta_path(self) -> str:
+        return os.path.join(self.directory, f"{self.id}.json")
+
+    @property
+    def received_bytes(self) -> int:
+        return sum(end - start for start, end in self.ranges)
+
+    def to_dict(self) -> dict:
+        return {
+            "upload_id": self.id,
+            "filename": self.filename,
+            "size": self.size,
+            "sha256": self.expected_sha256,
+            "chunk_size": self.chunk_size,
+            "received": self.ranges,
+            "received_bytes": self.received_bytes,
+            "missing": missing_ranges(self.ranges, self.size),
+            "completed": self.completed,
+            "created": self.created,
+            "updated": self.updated,
+        }
+
+    def save(self):
+        record = self.to_dict()
+        record["final_sha256"] = self.final_sha256
+        # Written whole and renamed, so readers without the lock never see half a file
+        temporary = self.meta_path + f".{os.getpid()}.tmp"
+        with open(temporary, "w", encoding="utf-8") as f:
+            json.dump(record, f)
+        os.replace(temporary, self.meta_path)
+
+    @classmethod
+    def load(cls, directory: str, id: str) -> Optional["UploadSession"]:
+        try:
+            with open(os.path.join(directory, f"{id}.json"), encoding="utf-8") as f:
+                record = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return cls(
+            directory, id, record["filename"], record["size"], record["sha256"], record["chunk_size"],
+            ranges=record["received"], completed=record["completed"], created=record["created"],
+            updated=record["updated"], final_sha256=record.get("final_sha256"),
+        )
+
+    # The interface of uploads.SpooledUpload used by the PDF route
+
+    @property
+    def sha256(self) -> Optional[str]:
+        return self.final_sha256
+
+    def source(self) -> str:
+        return self.data_path
+
+    def close(self):
+        """Kept until deleted or expired, so a failed classification can be retried"""
+
+
+class ChunkedUploadStore:
+    """
+    Resumable uploads for documents too large to send reliably in one request.
+
+    A client creates a session with the file's size (and optionally its
+    SHA-256), PUTs chunks at byte offsets, each with its own SHA-256, asks
+    which ranges arrived after a failure and resends only the missing ones,
+    then completes the session, which verifies the whole file.
+
+    Sessions live on disk only, so an upload survives a backend restart and
+    its chunks may reach different uvicorn workers. Every change takes the
+    session's file lock (flock), reloads the metadata, applies itself and
+    saves it, so concurrent workers never overwrite each other's ranges. The
+    counters in stats() are per worker.
+
+    A session untouched for `ttl` seconds is gone: loading it deletes it, and
+    a background sweep every `prune_interval` seconds removes the rest.
+    """
+
+    def __init__(
+        self,
+        directory: str = CHUNKED_UPLOAD_DIR,
+        max_bytes: int = int(CHUNKED_UPLOAD_MAX_MB * 2 ** 20),
+        chunk_size: int = CHUNKED_UPLOAD_CHUNK_KB * 1024,
+        max_chunk_bytes: int = int(CHUNKED_UPLOAD_MAX_CHUNK_MB * 2 ** 20),
+        ttl: float = CHUNKED_UPLOAD_TTL_HOURS * 3600,
+        prune_interval: float = CHUNKED_UPLOAD_PRUNE_INTERVAL,
+    ):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.chunk_size = min(chunk_size, max_chunk_bytes)
+        self.max_chunk_bytes = max_chunk_bytes
+        self.ttl = ttl
+        self.prune_interval = prune_interval
+        self._task: Optional[asyncio.Task] = None
+        self.created = 0
+        self.chunks = 0
+        self.checksum_failures = 0
+        self.completed = 0
+        self.expired = 0
+
+    def _lock_path(self, upload_id: str) -> str:
+        return os.path.join(self.directory, f"{upload_id}.lock")
+
+    def _expired(self, session: UploadSession) -> bool:
+        return session.updated + self.ttl < time.time()
+
+    def _load(self, upload_id: str) -> UploadSession:
+        """The session as on disk, read without the lock; an expired one is deleted"""
+        session = UploadSession.load(self.directory, upload_id) if _UPLOAD_ID.match(upload_id) else None
+        if session is not None and self._expired(session):
+            # Deleted now, unless another worker touched it meanwhile
+            session = None if self._expire(upload_id) else UploadSession.load(self.directory, upload_id)
+        if session is None:
+            raise HTTPException(status_code=404, detail="Unknown or expired upload")
+        return session
+
+    def _expire(self, upload_id: str) -> bool:
+        """Delete the session if it is still expired once locked; False if it is not"""
+        with _file_lock(self._lock_path(upload_id)):
+            session = UploadSession.load(self.directory, upload_id)
+            if session is not None and not self._expired(session):
+                return False
+            if session is not None:
+                self._remove(session)
+                self.expired += 1
+            self._remove_lock(upload_id)
+        return True
+
+    @contextmanager
+    def _locked(self, upload_id: str):
+        """The session as currently on disk, locked against every worker (blocking)"""
+        # Checked first so unknown ids do not leave lock files behind
+        self._load(upload_id)
+        with _file_lock(self._lock_path(upload_id)):
+            # Reloaded under the lock: another worker may have changed or deleted it meanwhile
+            session = UploadSession.load(self.directory, upload_id)
+            if session is None or self._expired(session):
+                raise HTTPException(status_code=404, detail="Unknown or expired upload")
+            yield session
+
+    def _create_files(self, session: UploadSession):
+        os.makedirs(self.directory, exist_ok=True)
+        with open(session.data_path, "wb") as f:
+            # Sparse on most filesystems: space is used as chunks arrive
+            f.truncate(session.size)
+        session.save()
+
+    async def create(self, filename: str, size: int, sha256: Optional[str] = None) -> UploadSession:
+        if size <= 0:
+            raise HTTPException(status_code=400, detail="size must be positive")
+        if size > self.max_bytes:
+            raise HTTPException(status_code=413, detail=f"File too large, the limit is {self.max_bytes / 2 ** 20:g} MB")
+        if sha256 is not None and not _SHA256.match(sha256.lower()):
+            raise HTTPException(status_code=400, detail="sha256 must be 64 hexadecimal characters")
+        await asyncio.to_thread(self.prune)
+        session = UploadSession(
+            self.directory, uuid.uuid4().hex, filename, size, sha256.lower() if sha256 else None, self.chunk_size
+        )
+        await asyncio.to_thread(self._create_files, session)
+        self.created += 1
+        return session
+
+    async def get(self, upload_id: str) -> UploadSession:
+        return await asyncio.to_thread(self._load, upload_id)
+
+    def _write_chunk(self, upload_id: str, offset: int, data: bytes, checksum: str) -> UploadSession:
+        if hashlib.sha256(data).hexdigest() != checksum.lower():
+            self.checksum_failures += 1
+            raise HTTPException(status_code=400, detail="Chunk checksum mismatch, send the chunk again")
+        with self._locked(upload_id) as session:
+            if session.completed:
+                raise HTTPException(status_code=409, detail="Upload already completed")
+            if offset < 0 or offset + len(data) > session.size:
+                raise HTTPException(
+                    status_code=416,
+                    detail=f"Chunk [{offset}, {offset + len(data)}) is outside the file's {session.size} bytes",
+                )
+            with open(session.data_path, "r+b") as f:
+                f.seek(offset)
+                f.write(data)
+            session.ranges = add_range(session.ranges, offset, offset + len(data))
+            session.updated = time.time()
+            session.save()
+        self.chunks += 1
+        return session
+
+    async def write_chunk(self, upload_id: str, offset: int, data: bytes, checksum: str) -> UploadSession:
+        """Verify and write one chunk; returns the session with the ranges of every worker"""
+        return await asyncio.to_thread(self._write_chunk, upload_id, offset, data, checksum)
+
+    def _hash_file(self, path: str) -> str:
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(_HASH_BLOCK), b""):
+                digest.update(block)
+        return digest.hexdigest()
+
+    def _complete(self, upload_id: str) -> UploadSession:
+        with self._locked(upload_id) as session:
+            if session.completed:
+                return session
+            missing = missing_ranges(session.ranges, session.size)
+            if missing:
+                raise HTTPException(status_code=409, detail={"message": "Upload incomplete", "missing": missing})
+            digest = self._hash_file(session.data_path)
+            if session.expected_sha256 and digest != session.expected_sha256:
+                # Every chunk matched its checksum, so the client announced the wrong file
+                session.ranges = []
+                session.save()
+                raise HTTPException(status_code=422, detail="File checksum mismatch, the upload was reset")
+            session.final_sha256 = digest
+            session.completed = True
+            session.updated = time.time()
+            session.save()
+        self.completed += 1
+        return session
+
+    async def complete(self, upload_id: str) -> UploadSession:
+        return await asyncio.to_thread(self._complete, upload_id)
+
+    def _remove(self, session: UploadSession):
+        for path in (session.meta_path, session.data_path):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def _remove_lock(self, upload_id: str):
+        # After the metadata is gone, so a worker waiting on the old lock finds no session
+        try:
+            os.remove(self._lock_path(upload_id))
+        except OSError:
+            pass
+
+    def _delete(self, upload_id: str):
+        with self._locked(upload_id) as session:
+            self._remove(session)
+        self._remove_lock(upload_id)
+
+    async def delete(self, upload_id: str):
+        await asyncio.to_thread(self._delete, upload_id)
+
+    def _session_ids(self) -> List[str]:
+        if not os.path.isdir(self.directory):
+            return []
+        ids = []
+        for name in os.listdir(self.directory):
+            upload_id, extension = os.path.splitext(name)
+            if extension == ".json" and _UPLOAD_ID.match(upload_id):
+                ids.append(upload_id)
+        return ids
+
+    def prune(self):
+        """Delete sessions untouched for longer than the TTL (blocking)"""
+        cutoff = time.time() - self.ttl
+        for upload_id in self._session_ids():
+            session = UploadSession.load(self.directory, upload_id)
+            if session is not None and self._expired(session):
+                self._expire(upload_id)
+        # Lock files left by a delete racing a chunk
+        for name in os.listdir(self.directory) if os.path.isdir(self.directory) else ():
+            upload_id, extension = os.path.splitext(name)
+            path = os.path.join(self.directory, name)
+            if extension == ".lock" and _UPLOAD_ID.match(upload_id) and not os.path.exists(os.path.join(self.directory, f"{upload_id}.json")):
+                try:
+                    if os.path.getmtime(path) < cutoff:
+                        os.remove(path)
+                except OSError:
+                    pass
+
+    async def _prune_loop(self):
+        while True:
+            await asyncio.sleep(self.prune_interval)
+            try:
+                await asyncio.to_thread(self.prune)
+            except OSError as e:
+                logger.warning("Pruning expired uploads failed: %s", e)
+
+    async def start(self):
+        """Start the periodic sweep of expired sessions; called from the app lifespan"""
+        if self._task is None and self.prune_interval > 0:
+            self._task = asyncio.create_task(self._prune_loop())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> dict:
+        """Blocking: counts the sessions on disk"""
+        return {
+            "directory": self.directory,
+            "active": len(self._session_ids()),
+            "created": self.created,
+            "chunks": self.chunks,
+            "checksum_failures": self.checksum_failures,
+            "completed": self.completed,
+            "expired": self.expired,
+        }
+
+
+# Shared instance used by the uploads and PDF routers
+chunked_uploads = ChunkedUploadStore()
@@ -0,0 +1,61 @@
+import ast
+import io
+import re
+import tokenize
+
+# Languages whose layout carries meaning: only line endings are normalised
+_WHITESPACE_SENSITIVE = {"yaml", "yml", "makefile", "make", "markdown", "md", "haskell", "fsharp", "f#", "nim", "coffeescript"}
+
+# Delimiters of multi-line string literals, inside which blank lines and trailing spaces are content
+_MULTILINE_LITERAL = re.compile(r'`|"""|\'\'\'|R"\(|@"|\[\[|<<-?\s*[\'"]?[A-Za-z_]+')
+
+
+def canonicalize_code(code: str, language: str = "python") -> str:
+    """
+    Canonical form of a code submission, used only to build cache keys.
+
+    Two submissions map to the same canonical form only if they have the same
+    semantics: Python goes through the AST (or the token stream when it does not
+    parse), other languages through a conservative lexical pass. The model still
+    receives the code exactly as submitted.
+    """
+    language = (language or "").strip().lower()
+    if language in ("python", "py", "python3"):
+        return _canonical_python(code)
+    return _canonical_lexical(code, language)
+
+
+def _canonical_python(code: str) -> str:
+    source = code.replace("\r\n", "\n").replace("\r", "\n")
+    try:
+        # Comments, blank lines, spacing and redundant parentheses are not part of the AST
+        return "ast:" + ast.dump(ast.parse(source))
+    except (SyntaxError, ValueError, RecursionError, MemoryError):
+        pass
+
+    # Code that does not parse (the usual input of /fix-bug/) is compared token by token
+    try:
+        parts = []
+        for token in tokenize.generate_tokens(io.StringIO(source).readline):
+            if token.type in (tokenize.COMMENT, tokenize.NL, tokenize.ENCODING):
+                continue
+            if token.type == tokenize.NEWLINE:
+                parts.append("\n")
+            elif token.type == tokenize.DEDENT:
+                parts.append("<dedent>")
+            else:
+                # INDENT keeps its exact whitespace: mixed tabs/spaces may be the bug
+                parts.append(token.string)
+        return "tokens:" + "\x1f".join(parts)
+    except (tokenize.TokenError, IndentationError, SyntaxError):
+        return _canonical_lexical(code, "python")
+
+
+def _canonical_lexical(code: str, language: str) -> str:
+    source = code.replace("\r\n", "\n").replace("\r", "\n")
+    if language in _WHITESPACE_SENSITIVE or _MULTILINE_LITERAL.search(source):
+        # Blank lines or trailing spaces could be significant: only trim the ends
+        return "text:" + source.strip("\n")
+
+    lines = [line.rstrip() for line in source.split("\n")]
+    return "lines:" + "\n".join(line for line in lines if line)
@@ -0,0 +1,137 @@
+import time
+from collections import deque
+from typing import Optional
+
+from config import (
+    AIMD_MIN_CONCURRENCY,
+    AIMD_MAX_CONCURRENCY,
+    AIMD_ADDITIVE_INCREASE,
+    AIMD_DECREASE_FACTOR,
+    AIMD_LATENCY_DECREASE_FACTOR,
+    AIMD_TARGET_MS_PER_TOKEN,
+    AIMD_LATENCY_TOLERANCE,
+    AIMD_MIN_COMPLETION_TOKENS,
+    AIMD_DECREASE_COOLDOWN,
+)
+
+# How fast the latency baseline drifts up towards slower samples (it drops to faster ones at once)
+BASELINE_DRIFT = 0.002
+
+
+class AIMDController:
+    """
+    Additive-increase / multiplicative-decrease concurrency window for one model.
+
+    Every successful call that is not clearly overloaded while the window is in
+    use grows the window by `additive_increase / window`, i.e. by
+    `additive_increase` per full window of successes. A 429, a 5xx, a transport
+    error or congestion shrinks it multiplicatively, at most once per cooldown
+    period.
+
+    Congestion is judged relative to the model's own baseline, the lowest recent
+    ms per generated token: the smoothed ms/token must exceed `latency_tolerance`
+    times the baseline and the absolute target. Calls with fewer than
+    `min_completion_tokens` tokens are left out, since their time is mostly time
+    to first token spread over a handful of tokens.
+    """
+
+    def __init__(
+        self,
+        model_id: str,
+        initial: float,
+        min_limit: int = AIMD_MIN_CONCURRENCY,
+        max_limit: int = AIMD_MAX_CONCURRENCY,
+        additive_increase: float = AIMD_ADDITIVE_INCREASE,
+        decrease_factor: float = AIMD_DECREASE_FACTOR,
+        latency_decrease_factor: float = AIMD_LATENCY_DECREASE_FACTOR,
+        target_ms_per_token: float = AIMD_TARGET_MS_PER_TOKEN,
+        latency_tolerance: float = AIMD_LATENCY_TOLERANCE,
+        min_completion_tokens: int = AIMD_MIN_COMPLETION_TOKENS,
+        cooldown: float = AIMD_DECREASE_COOLDOWN,
+    ):
+        self.model_id = model_id
+        self.min_limit = min_limit
+        self.max_limit = max(max_limit, min_limit)
+        self.window = float(min(max(initial, self.min_limit), self.max_limit))
+        self.additive_increase = additive_increase
+        self.decrease_factor = decrease_factor
+        self.latency_decrease_factor = latency_decrease_factor
+        self.target_ms_per_token = target_ms_per_token
+        self.latency_tolerance = latency_tolerance
+        self.min_completion_tokens = min_completion_tokens
+        self.cooldown = cooldown
+
+        self._last_decrease = 0.0
+        # Smoothed ms per generated token of successful calls
+        self.ms_per_token: Optional[float] = None
+        # Lowest recent ms per token, the model's uncongested speed
+        self.baseline_ms_per_token: Optional[float] = None
+        self.successes = 0
+        self.failures = 0
+        self.changes = deque(maxlen=50)
+
+    @property
+    def limit(self) -> int:
+        return int(self.window)
+
+    def on_success(self, latency: float, completion_tokens: Optional[int] = None, saturated: bool = True):
+        """Record a 2xx call; `saturated` says whether the window was fully used"""
+        self.successes += 1
+        if completion_tokens and completion_tokens >= self.min_completion_tokens:
+            sample = latency * 1000 / completion_tokens
+            self.ms_per_token = sample if self.ms_per_token is None else 0.8 * self.ms_per_token + 0.2 * sample
+            if self.baseline_ms_per_token is None or sample < self.baseline_ms_per_token:
+                self.baseline_ms_per_token = sample
+            else:
+                self.baseline_ms_per_token += BASELINE_DRIFT * (sample - self.baseline_ms_per_token)
+            threshold = max(self.target_ms_per_token, self.baseline_ms_per_token * self.latency_tolerance)
+            if self.ms_per_token > threshold:
+                self._decrease(
+                    self.latency_decrease_factor,
+                    f"latency {self.ms_per_token:.0f} ms/token above {threshold:.0f} "
+                    f"(baseline {self.baseline_ms_per_token:.0f})",
+                )
+                return
+
+        if saturated and self.window < self.max_limit:
+            old_limit = self.limit
+            self.window = min(self.max_limit, self.window + self.additive_increase / self.window)
+            if self.limit != old_limit:
+                self._record(old_limit, "additive increase after successful window")
+
+    def on_failure(self, reason: str):
+        """Record a 429, a 5xx or a transport error"""
+        self.failures += 1
+        self._decrease(self.decrease_factor, reason)
+
+    def _decrease(self, factor: float, reason: str):
+        now = time.monotonic()
+        if now - self._last_decrease < self.cooldown:
+            return
+        self._last_decrease = now
+        old_limit = self.limit
+        self.window = max(float(self.min_limit), self.window * factor)
+        self._record(old_limit, reason)
+
+    def _record(self, old_limit: int, reason: str):
+        self.changes.append({
+            "at": time.time(),
+            "from": old_limit,
+            "to": self.limit,
+            "reason": reason,
+        })
+
+    def stats(self) -> dict:
+        return {
+            "window": round(self.window, 3),
+            "limit": self.limit,
+            "min_limit": self.min_limit,
+            "max_limit": self.max_limit,
+            "ms_per_token": round(self.ms_per_token, 2) if self.ms_per_token is not None else None,
+            "baseline_ms_per_token": round(self.baseline_ms_per_token, 2) if self.baseline_ms_per_token is not None else None,
+            "target_ms_per_token": self.target_ms_per_token,
+            "successes": self.successes,
+            "failures": self.failures,
+            "last_change": self.changes[-1] if self.changes else None,
+            "recent_changes": list(self.changes),
+        }
@@ -0,0 +1,180 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from typing import Optional
+
+from config import (
+    DISK_CACHE_ENABLED,
+    DISK_CACHE_PATH,
+    DISK_CACHE_MAX_BYTES,
+    DISK_CACHE_MAX_AGE,
+    DISK_CACHE_COMPRESSION_LEVEL,
+)
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    value BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    accessed_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS responses_accessed_at ON responses (accessed_at);
+CREATE INDEX IF NOT EXISTS responses_created_at ON responses (created_at);
+"""
+
+# Bump accessed_at at most this often per entry, to keep hot reads from turning into writes
+_TOUCH_INTERVAL = 60.0
+
+
+class DiskCache:
+    """
+    SQLite-backed store of compressed upstream response bodies.
+
+    The database runs in WAL mode with a busy timeout, so several uvicorn workers
+    on the same host can read and write the same file concurrently. Entries older
+    than `max_age` are dropped, and when the stored (compressed) bytes exceed
+    `max_bytes` the least recently used entries are evicted. All methods block and
+    are meant to be run off the event loop with `asyncio.to_thread`.
+    """
+
+    def __init__(
+        self,
+        path: str = DISK_CACHE_PATH,
+        max_bytes: int = DISK_CACHE_MAX_BYTES,
+        max_age: float = DISK_CACHE_MAX_AGE,
+        compression_level: int = DISK_CACHE_COMPRESSION_LEVEL,
+        enabled: bool = DISK_CACHE_ENABLED,
+    ):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.compression_level = compression_level
+        self.enabled = enabled
+
+        self._local = threading.local()
+        self._init_lock = threading.Lock()
+        self._initialised = False
+
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+        self.errors = 0
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute("PRAGMA busy_timeout=5000")
+            with self._init_lock:
+                if not self._initialised:
+                    connection.executescript(_SCHEMA)
+                    self._initialised = True
+            self._local.connection = connection
+        return connection
+
+    def get(self, key: str) -> Optional[bytes]:
+        try:
+            connection = self._connection()
+            row = connection.execute(
+                "SELECT value, created_at, accessed_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            now = time.time()
+            if row is None:
+                self.misses += 1
+                return None
+            value, created_at, accessed_at = row
+            if now - created_at > self.max_age:
+                connection.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self.misses += 1
+                return None
+            if now - accessed_at > _TOUCH_INTERVAL:
+                connection.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+            self.hits += 1
+            return zlib.decompress(value)
+        except (sqlite3.Error, zlib.error) as e:
+            self.errors += 1
+            logger.warning("Disk cache read failed: %s", e)
+            return None
+
+    def put(self, key: str, value: bytes):
+        try:
+            compressed = zlib.compress(value, self.compression_level)
+            now = time.time()
+            connection = self._connection()
+            connection.execute(
+                "INSERT OR REPLACE INTO responses (key, value, size, created_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                (key, compressed, len(compressed), now, now),
+            )
+            self.writes += 1
+            self._evict(connection, now)
+        except (sqlite3.Error, zlib.error) as e:
+            self.errors += 1
+            logger.warning("Disk cache write failed: %s", e)
+
+    def _evict(self, connection: sqlite3.Connection, now: float):
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            expired = connection.execute(
+                "DELETE FROM responses WHERE created_at < ?", (now - self.max_age,)
+            ).rowcount
+            # Keep the most recently used entries whose running size fits the budget
+            over_budget = connection.execute(
+                """
+                DELETE FROM responses WHERE key IN (
+                    SELECT key FROM (
+                        SELECT key, SUM(size) OVER (ORDER BY accessed_at DESC, key) AS running
+                        FROM responses
+                    ) WHERE running > ?
+                )
+                """,
+                (self.max_bytes,),
+            ).rowcount
+            connection.execute("COMMIT")
+        except sqlite3.Error:
+            connection.execute("ROLLBACK")
+            raise
+        self.evictions += max(expired, 0) + max(over_budget, 0)
+
+    def clear(self):
+        try:
+            self._connection().execute("DELETE FROM responses")
+        except sqlite3.Error as e:
+            self.errors += 1
+            logger.warning("Disk cache clear failed: %s", e)
+
+    def stats(self) -> dict:
+        stats = {
+            "enabled": self.enabled,
+            "path": self.path,
+            "max_bytes": self.max_bytes,
+            "max_age": self.max_age,
+            "hits": self.hits,
+            "misses": self.misses,
+            "writes": self.writes,
+            "evictions": self.evictions,
+            "errors": self.errors,
+        }
+        if not self.enabled:
+            return stats
+        try:
+            entries, stored_bytes = self._connection().execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses"
+            ).fetchone()
+            stats["entries"] = entries
+            stats["bytes"] = stored_bytes
+            stats["file_bytes"] = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+        except (sqlite3.Error, OSError) as e:
+            stats["error"] = str(e)
+        return stats
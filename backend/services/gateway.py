@@ -0,0 +1,472 @@
+import asyncio
+import heapq
+import itertools
+import json
+import math
+import time
+from typing import AsyncIterator, Optional
+
+import httpx
+from fastapi import HTTPException
+
+from config import (
+    WATSONX_BASE_URL,
+    WATSONX_API_VERSION,
+    GATEWAY_MAX_CONCURRENCY,
+    GATEWAY_MODEL_CONCURRENCY,
+    GATEWAY_MAX_QUEUE,
+    GATEWAY_QUEUE_TIMEOUT,
+    AIMD_ENABLED,
+)
+from services import tracing
+from services.concurrency import AIMDController
+from services.http_client import get_http_client, get_timeout
+from services.metrics import observe_upstream
+from services.request_context import add_stage, set_response_header, timed_stage
+from services.singleflight import SingleFlight
+from services.response_cache import response_cache, make_cache_key, is_reproducible, cache_mode, CACHE_USE, CACHE_BYPASS, TIER_MEMORY
+from services.token_manager import token_manager
+from services.token_usage import current_caller, token_budgets, token_usage, usage_tokens
+
+# Lower value = served first when several requests wait for the same model
+PRIORITIES = {
+    "chat": 0,
+    "generate": 1,
+    "bug": 2,
+    "test": 2,
+    "pdf": 3,
+    # Background folding of old chat turns into a summary
+    "summary": 4,
+}
+
+
+class QueueFull(Exception):
+    """Raised to a request that is shed instead of waiting for an upstream slot"""
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"Upstream queue is full, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+class AdmissionLimiter:
+    """
+    Caps concurrent upstream calls for one model.
+
+    The cap is either static or, with an AIMDController attached, follows the
+    controller's window as upstream outcomes are observed. Requests over the cap
+    wait in a bounded priority queue (lowest priority value first, FIFO within a
+    class). When the queue is full a lower-priority waiter is shed to make room for
+    a more important request, otherwise the newcomer is shed.
+    """
+
+    def __init__(
+        self,
+        model_id: str,
+        limit: int,
+        max_queue: int = GATEWAY_MAX_QUEUE,
+        controller: Optional[AIMDController] = None,
+    ):
+        self.model_id = model_id
+        self.static_limit = limit
+        self.controller = controller
+        self.max_queue = max_queue
+        self.active = 0
+        self._waiters = []  # heap of (priority, seq, future)
+        self._queued = 0
+        self._seq = itertools.count()
+
+        self.admitted = 0
+        self.shed = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        # Exponentially weighted upstream latency, used to estimate Retry-After
+        self.avg_latency = 1.0
+
+    @property
+    def limit(self) -> int:
+        if self.controller is not None:
+            return self.controller.limit
+        return self.static_limit
+
+    @property
+    def saturated(self) -> bool:
+        return self.active >= self.limit
+
+    def observe(self, status_code: Optional[int], latency: float, completion_tokens: Optional[int] = None, saturated: bool = True):
+        """Feed the outcome of an upstream call (None = transport error) to the adaptive controller"""
+        observe_upstream(self.model_id, status_code)
+        if self.controller is None:
+            return
+        old_limit = self.limit
+        if status_code is None:
+            self.controller.on_failure("transport error")
+        elif status_code == 429:
+            self.controller.on_failure("upstream 429")
+        elif status_code >= 500:
+            self.controller.on_failure(f"upstream {status_code}")
+        elif status_code < 400:
+            self.controller.on_success(latency, completion_tokens, saturated)
+        if self.limit > old_limit:
+            # Admit queued requests into the larger window now rather than at the next release
+            self._wake()
+
+    def retry_after(self) -> int:
+        backlog = (self._queued + 1) / max(self.limit, 1)
+        return max(1, math.ceil(backlog * self.avg_latency))
+
+    async def acquire(self, priority: int, timeout: float = GATEWAY_QUEUE_TIMEOUT) -> float:
+        """Wait for a slot and return the seconds spent queueing"""
+        if self.active < self.limit and self._queued == 0:
+            self.active += 1
+            self.admitted += 1
+            return 0.0
+
+        if self._queued >= self.max_queue and not self._shed_lower_than(priority):
+            self.shed += 1
+            raise QueueFull(self.retry_after())
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), future))
+        self._queued += 1
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(asyncio.shield(future), timeout)
+        except asyncio.TimeoutError:
+            self._abandon(future)
+            self.shed += 1
+            raise QueueFull(self.retry_after())
+        except BaseException:
+            self._abandon(future)
+            raise
+
+        waited = time.perf_counter() - started
+        self.admitted += 1
+        self.total_wait += waited
+        self.max_wait = max(self.max_wait, waited)
+        return waited
+
+    def release(self, latency: Optional[float] = None):
+        if latency is not None:
+            self.avg_latency = 0.8 * self.avg_latency + 0.2 * latency
+        self.active -= 1
+        self._wake()
+
+    def _wake(self):
+        while self.active < self.limit and self._waiters:
+            _, _, future = heapq.heappop(self._waiters)
+            if future.done():
+                continue
+            self._queued -= 1
+            self.active += 1
+            future.set_result(None)
+
+    def _abandon(self, future: asyncio.Future):
+        if future.done() and not future.cancelled() and future.exception() is None:
+            # The slot was granted just as we gave up on it: hand it on
+            self.release()
+            return
+        if not future.done():
+            future.cancel()
+            self._queued -= 1
+
+    def _shed_lower_than(self, priority: int) -> bool:
+        """Reject the least important waiter if it ranks below `priority`"""
+        live = [entry for entry in self._waiters if not entry[2].done()]
+        if not live:
+            return False
+        worst = max(live, key=lambda entry: (entry[0], entry[1]))
+        if worst[0] <= priority:
+            return False
+        worst[2].set_exception(QueueFull(self.retry_after()))
+        self._queued -= 1
+        self.shed += 1
+        return True
+
+    def stats(self) -> dict:
+        return {
+            "limit": self.limit,
+            "adaptive": self.controller.stats() if self.controller is not None else None,
+            "active": self.active,
+            "queued": self._queued,
+            "max_queue": self.max_queue,
+            "admitted": self.admitted,
+            "shed": self.shed,
+            "avg_queue_wait_ms": round(self.total_wait / self.admitted * 1000, 2) if self.admitted else 0.0,
+            "max_queue_wait_ms": round(self.max_wait * 1000, 2),
+            "avg_upstream_latency_s": round(self.avg_latency, 3),
+        }
+
+
+def _cache_outcome(outcome: str):
+    set_response_header("X-Cache", outcome)
+    tracing.set_attributes({tracing.ATTR_CACHE: outcome})
+
+
+def _cached_response(content: bytes) -> httpx.Response:
+    return httpx.Response(200, content=content, headers={"Content-Type": "application/json"})
+
+
+def _usage(response: httpx.Response) -> dict:
+    try:
+        return response.json().get("usage") or {}
+    except ValueError:
+        return {}
+
+
+class WatsonxGateway:
+    """Single path from the routers to the watsonx.ai chat API"""
+
+    def __init__(self, base_url: str = WATSONX_BASE_URL, api_version: str = WATSONX_API_VERSION):
+        self.base_url = base_url
+        self.api_version = api_version
+        self._limiters = {}
+        self._singleflight = SingleFlight()
+
+    @property
+    def chat_url(self) -> str:
+        return f"{self.base_url}/ml/v1/text/chat?version={self.api_version}"
+
+    @property
+    def chat_stream_url(self) -> str:
+        return f"{self.base_url}/ml/v1/text/chat_stream?version={self.api_version}"
+
+    def limiter(self, model_id: str) -> AdmissionLimiter:
+        if model_id not in self._limiters:
+            limit = GATEWAY_MODEL_CONCURRENCY.get(model_id, GATEWAY_MAX_CONCURRENCY)
+            controller = AIMDController(model_id, initial=limit) if AIMD_ENABLED else None
+            self._limiters[model_id] = AdmissionLimiter(model_id, limit, controller=controller)
+        return self._limiters[model_id]
+
+    async def _headers(self) -> dict:
+        with timed_stage("token_fetch"):
+            bearer_token = await token_manager.get_token()
+        return {
+            "Accept": "application/json",
+            "Content-Type": "application/json",
+            "Authorization": f"Bearer {bearer_token}"
+        }
+
+    async def chat(self, body: dict, profile: str, key_body: Optional[dict] = None) -> httpx.Response:
+        """
+        Send a /ml/v1/text/chat request once the model has a free slot.
+
+        `profile` names the calling endpoint ("chat", "generate", "bug", "test",
+        "pdf") and selects both its queue priority and its timeout. Answers to
+        reproducible requests are served from the response cache when possible.
+        `key_body` replaces `body` when computing the cache key, e.g. with the
+        submitted code in canonical form. Concurrent requests with the same key
+        are coalesced into a single upstream call. Token budgets are enforced on
+        calls that would go upstream: over budget they are degraded or rejected
+        with 429 (see TokenBudgets).
+        """
+        with tracing.span("watsonx.chat", {tracing.ATTR_ENDPOINT: profile, tracing.ATTR_MODEL: body["model_id"]}):
+            return await self._chat(body, profile, key_body)
+
+    async def _chat(self, body: dict, profile: str, key_body: Optional[dict]) -> httpx.Response:
+        mode = cache_mode()
+        key = make_cache_key(key_body if key_body is not None else body)
+        # Exact hash of what is sent, to measure hits that only the canonical key finds
+        fingerprint = make_cache_key(body) if key_body is not None else None
+        cacheable = False
+
+        if not response_cache.enabled:
+            pass
+        elif not is_reproducible(body):
+            response_cache.uncacheable += 1
+            _cache_outcome("UNCACHEABLE")
+        elif mode == CACHE_BYPASS:
+            response_cache.bypasses += 1
+            _cache_outcome("BYPASS")
+        else:
+            cacheable = True
+            if mode == CACHE_USE:
+                cached, tier = await response_cache.lookup(key, fingerprint)
+                if cached is not None:
+                    _cache_outcome("HIT" if tier == TIER_MEMORY else "HIT-DISK")
+                    return _cached_response(cached)
+            _cache_outcome("MISS")
+
+        body, degraded = token_budgets.enforce(body, profile)
+        if mode == CACHE_BYPASS:
+            # The caller asked for its own fresh answer
+            return await self._send(body, profile)
+
+        async def call_upstream() -> httpx.Response:
+            response = await self._send(body, profile)
+            # A shortened answer must not be served later to requests with the full budget
+            if cacheable and not degraded and response.status_code == 200:
+                await response_cache.store(key, response.content, fingerprint)
+            return response
+
+        # Identical requests already in flight share one upstream call. Degraded calls
+        # coalesce only with each other, for the same reason they are not cached
+        flight_key = f"{key}:degraded" if degraded else key
+        response, shared = await self._singleflight.do(flight_key, call_upstream)
+        if shared:
+            set_response_header("X-Coalesced", "1")
+            tracing.set_attributes({"smartsdlc.coalesced": True})
+        return response
+
+    async def _admit(self, body: dict, profile: str) -> AdmissionLimiter:
+        """Take an upstream slot for the body's model, or shed the request with 429"""
+        limiter = self.limiter(body["model_id"])
+        try:
+            queue_wait = await limiter.acquire(PRIORITIES.get(profile, max(PRIORITIES.values())))
+        except QueueFull as e:
+            raise HTTPException(
+                status_code=429,
+                detail=f"Too many requests for {body['model_id']}, please retry later",
+                headers={"Retry-After": str(e.retry_after)},
+            )
+        add_stage("queue_wait", queue_wait)
+        return limiter
+
+    async def _post(self, client: httpx.AsyncClient, body: dict, profile: str) -> httpx.Response:
+        headers = await self._headers()
+        with timed_stage("upstream"):
+            # The upstream span's traceparent goes with the call
+            response = await client.post(self.chat_url, headers=tracing.inject(headers), json=body, timeout=get_timeout(profile))
+            tracing.set_attributes({"http.response.status_code": response.status_code})
+        return response
+
+    async def _send(self, body: dict, profile: str) -> httpx.Response:
+        limiter = await self._admit(body, profile)
+        saturated = limiter.saturated
+        started = time.perf_counter()
+        status_code = None
+        completion_tokens = None
+        transport_error = False
+        try:
+            client = get_http_client()
+            response = await self._post(client, body, profile)
+            if response.status_code == 401:
+                # The cached token was revoked or expired early: fetch a new one once
+                token_manager.invalidate()
+                response = await self._post(client, body, profile)
+            status_code = response.status_code
+            if status_code == 200:
+                prompt_tokens, completion_tokens = usage_tokens(_usage(response))
+                token_usage.record(profile, body["model_id"], prompt_tokens, completion_tokens)
+                tracing.set_attributes({tracing.ATTR_INPUT_TOKENS: prompt_tokens, tracing.ATTR_OUTPUT_TOKENS: completion_tokens})
+        except httpx.TransportError:
+            transport_error = True
+            raise
+        finally:
+            latency = time.perf_counter() - started
+            if status_code is not None or transport_error:
+                limiter.observe(status_code, latency, completion_tokens or None, saturated)
+            limiter.release(latency)
+        return response
+
+    async def chat_stream(self, body: dict, profile: str) -> AsyncIterator[dict]:
+        """
+        Open a /ml/v1/text/chat_stream request and return an iterator of its chunks.
+
+        Admission, authentication and the upstream status are settled before this
+        returns, so callers can still answer with a proper HTTP error (429, or the
+        upstream status). The upstream slot is held until the iterator finishes, fails
+        or is closed. Streams are neither cached nor coalesced, but do count against
+        the token budgets.
+        """
+        body, _ = token_budgets.enforce(body, profile)
+        caller = current_caller()
+        # Ends with the stream, after the request handler has returned
+        stream_span = tracing.start_span(
+            "watsonx.chat_stream", {tracing.ATTR_ENDPOINT: profile, tracing.ATTR_MODEL: body["model_id"]}, client=True
+        )
+        try:
+            limiter = await self._admit(body, profile)
+        except BaseException:
+            tracing.end_span(stream_span)
+            raise
+        saturated = limiter.saturated
+        started = time.perf_counter()
+        client = get_http_client()
+        try:
+            headers = tracing.inject(await self._headers(), stream_span)
+            request = client.build_request("POST", self.chat_stream_url, headers=headers, json=body, timeout=get_timeout(profile))
+            response = await client.send(request, stream=True)
+            if response.status_code == 401:
+                await response.aclose()
+                token_manager.invalidate()
+                headers = tracing.inject(await self._headers(), stream_span)
+                request = client.build_request("POST", self.chat_stream_url, headers=headers, json=body, timeout=get_timeout(profile))
+                response = await client.send(request, stream=True)
+        except httpx.TransportError:
+            limiter.observe(None, time.perf_counter() - started, saturated=saturated)
+            limiter.release(time.perf_counter() - started)
+            tracing.end_span(stream_span)
+            raise
+        except BaseException:
+            limiter.release()
+            tracing.end_span(stream_span)
+            raise
+
+        if response.status_code != 200:
+            detail = (await response.aread()).decode("utf-8", errors="replace")
+            await response.aclose()
+            latency = time.perf_counter() - started
+            limiter.observe(response.status_code, latency, saturated=saturated)
+            limiter.release(latency)
+            tracing.end_span(stream_span, {"http.response.status_code": response.status_code})
+            raise HTTPException(status_code=response.status_code, detail=f"WatsonX AI API error: {detail}")
+
+        return self._iter_stream(response, limiter, started, saturated, profile, caller, stream_span)
+
+    async def _iter_stream(
+        self,
+        response: httpx.Response,
+        limiter: AdmissionLimiter,
+        started: float,
+        saturated: bool,
+        profile: str,
+        caller: str,
+        stream_span=None,
+    ) -> AsyncIterator[dict]:
+        usage = {}
+        outcome = None  # 200 once the stream ended normally, None on a transport error
+        finished = False
+        try:
+            async for line in response.aiter_lines():
+                # Server-sent events: only `data:` lines carry chunks
+                if not line.startswith("data:"):
+                    continue
+                data = line[len("data:"):].strip()
+                if not data or data == "[DONE]":
+                    continue
+                chunk = json.loads(data)
+                if chunk.get("usage"):
+                    usage = chunk["usage"]
+                yield chunk
+            outcome = 200
+            finished = True
+        except httpx.TransportError:
+            finished = True
+            raise
+        finally:
+            await response.aclose()
+            latency = time.perf_counter() - started
+            add_stage("upstream", latency)
+            prompt_tokens, completion_tokens = usage_tokens(usage)
+            # Streams cut short still count as a request; their tokens are only known once the usage chunk arrived
+            token_usage.record(profile, limiter.model_id, prompt_tokens, completion_tokens, caller)
+            # A stream closed early by the client says nothing about upstream health
+            if finished:
+                limiter.observe(outcome, latency, completion_tokens or None, saturated)
+            limiter.release(latency)
+            tracing.end_span(stream_span, {
+                "http.response.status_code": 200,
+                "smartsdlc.stream.completed": outcome == 200,
+                tracing.ATTR_INPUT_TOKENS: prompt_tokens,
+                tracing.ATTR_OUTPUT_TOKENS: completion_tokens,
+            })
+
+    def stats(self) -> dict:
+        return {model_id: limiter.stats() for model_id, limiter in self._limiters.items()}
+
+    def coalescing_stats(self) -> dict:
+        return self._singleflight.stats()
+
+
+# Shared instance used by all routers
+gateway = WatsonxGateway()
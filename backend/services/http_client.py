@@ -0,0 +1,130 @@
+import importlib.util
+import logging
+from typing import Optional
+
+import httpx
+
+from config import (
+    HTTP2_ENABLED,
+    HTTP_MAX_CONNECTIONS,
+    HTTP_MAX_KEEPALIVE_CONNECTIONS,
+    HTTP_KEEPALIVE_EXPIRY,
+    HTTP_CONNECT_TIMEOUT,
+    HTTP_POOL_TIMEOUT,
+    TIMEOUT_PROFILES,
+    UPSTREAM_CASSETTE_MODE,
+    UPSTREAM_CASSETTE_PATH,
+    UPSTREAM_CASSETTE_LATENCY_SCALE,
+)
+from services.cassette import RecordingTransport, ReplayTransport
+
+logger = logging.getLogger(__name__)
+
+_client: Optional[httpx.AsyncClient] = None
+_requests_total = 0
+_requests_by_host = {}
+
+
+def _http2_available() -> bool:
+    # HTTP/2 needs the optional `h2` package
+    return importlib.util.find_spec("h2") is not None
+
+
+def get_timeout(profile: str) -> httpx.Timeout:
+    """Build the httpx timeout for an endpoint profile ("chat", "bug", "pdf", ...)"""
+    read_timeout = TIMEOUT_PROFILES.get(profile, TIMEOUT_PROFILES["chat"])
+    return httpx.Timeout(read_timeout, connect=HTTP_CONNECT_TIMEOUT, pool=HTTP_POOL_TIMEOUT)
+
+
+async def _count_request(request: httpx.Request):
+    global _requests_total
+    _requests_total += 1
+    host = request.url.host
+    _requests_by_host[host] = _requests_by_host.get(host, 0) + 1
+
+
+def _build_client() -> httpx.AsyncClient:
+    http2 = HTTP2_ENABLED and _http2_available()
+    if HTTP2_ENABLED and not http2:
+        logger.warning("HTTP2_ENABLED is set but the `h2` package is not installed; falling back to HTTP/1.1")
+
+    limits = httpx.Limits(
+        max_connections=HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+    )
+    transport = httpx.AsyncHTTPTransport(http2=http2, limits=limits)
+    if UPSTREAM_CASSETTE_MODE == "record":
+        logger.warning("Recording upstream traffic to %s", UPSTREAM_CASSETTE_PATH)
+        transport = RecordingTransport(transport, UPSTREAM_CASSETTE_PATH)
+    elif UPSTREAM_CASSETTE_MODE == "replay":
+        logger.warning("Replaying upstream traffic from %s; nothing is sent upstream", UPSTREAM_CASSETTE_PATH)
+        transport = ReplayTransport(UPSTREAM_CASSETTE_PATH, UPSTREAM_CASSETTE_LATENCY_SCALE)
+    return httpx.AsyncClient(
+        transport=transport,
+        timeout=get_timeout("chat"),
+        event_hooks={"request": [_count_request]},
+    )
+
+
+async def startup():
+    """Create the shared client; called from the app lifespan"""
+    global _client
+    if _client is None:
+        _client = _build_client()
+
+
+async def shutdown():
+    """Close the shared client and its pooled connections"""
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """Return the app-wide pooled client, creating it lazily outside the app lifespan"""
+    global _client
+    if _client is None:
+        _client = _build_client()
+    return _client
+
+
+def pool_stats() -> dict:
+    """Connection pool utilisation of the shared client"""
+    stats = {
+        "started": _client is not None,
+        "http2_enabled": HTTP2_ENABLED and _http2_available(),
+        "max_connections": HTTP_MAX_CONNECTIONS,
+        "max_keepalive_connections": HTTP_MAX_KEEPALIVE_CONNECTIONS,
+        "keepalive_expiry": HTTP_KEEPALIVE_EXPIRY,
+        "timeout_profiles": TIMEOUT_PROFILES,
+        "requests_total": _requests_total,
+        "requests_by_host": dict(_requests_by_host),
+        "connections": 0,
+        "active_connections": 0,
+        "idle_connections": 0,
+        "http2_connections": 0,
+        "queued_requests": 0,
+        "utilisation": 0.0,
+    }
+    if _client is not None and hasattr(_client._transport, "stats"):
+        stats["cassette"] = _client._transport.stats()
+    if _client is None:
+        return stats
+
+    # httpx does not publish pool stats, so read them off the underlying httpcore pool
+    transport = getattr(_client._transport, "inner", _client._transport)
+    pool = getattr(transport, "_pool", None)
+    if pool is None:
+        return stats
+
+    connections = list(getattr(pool, "connections", []))
+    active = [conn for conn in connections if not conn.is_idle() and not conn.is_closed()]
+    stats["connections"] = len(connections)
+    stats["active_connections"] = len(active)
+    stats["idle_connections"] = sum(1 for conn in connections if conn.is_idle())
+    stats["http2_connections"] = sum(1 for conn in connections if "HTTP/2" in conn.info())
+    stats["queued_requests"] = sum(1 for req in getattr(pool, "_requests", []) if req.connection is None)
+    stats["utilisation"] = round(len(active) / HTTP_MAX_CONNECTIONS, 4) if HTTP_MAX_CONNECTIONS else 0.0
+    return stats
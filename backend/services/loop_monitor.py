@@ -0,0 +1,161 @@
+import asyncio
+import logging
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from datetime import datetime, timezone
+from typing import Optional
+
+from config import LOOP_MONITOR_ENABLED, LOOP_MONITOR_INTERVAL, LOOP_BLOCK_THRESHOLD, LOOP_MONITOR_WINDOW
+from services.metrics import EVENT_LOOP_BLOCKS, EVENT_LOOP_LAG
+
+logger = logging.getLogger(__name__)
+
+# Blocking episodes kept for /ops/event-loop
+RECENT_BLOCKS = 20
+# Innermost frames kept from a blocking stack
+STACK_DEPTH = 30
+
+
+def _percentile(sorted_values: list, pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+class LoopLagMonitor:
+    """
+    Continuous event loop lag measurement.
+
+    A task sleeps `interval` over and over and records how much later than
+    asked it woke up: the time every coroutine on this loop had to wait for
+    whatever was running. A watchdog thread checks the task's heartbeat, and
+    when the loop has not come back for `threshold` it captures the loop
+    thread's stack, so blocking calls in async handlers (PyMuPDF extraction,
+    synchronous file I/O, ...) are reported with the line that held the loop.
+    """
+
+    def __init__(
+        self,
+        enabled: bool = LOOP_MONITOR_ENABLED,
+        interval: float = LOOP_MONITOR_INTERVAL,
+        threshold: float = LOOP_BLOCK_THRESHOLD,
+        window: int = LOOP_MONITOR_WINDOW,
+    ):
+        self.enabled = enabled
+        self.interval = interval
+        self.threshold = threshold
+        self._lags = deque(maxlen=window)
+        self.samples = 0
+        self.max_lag = 0.0
+        self.blocks = 0
+        self.recent_blocks = deque(maxlen=RECENT_BLOCKS)
+        # Episode the watchdog caught; completed by the next tick with its duration
+        self._open_block: Optional[dict] = None
+        self._heartbeat = 0.0
+        self._loop = None
+        self._loop_thread_id = None
+        self._task: Optional[asyncio.Task] = None
+        self._watchdog: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    async def start(self):
+        """Start the lag task and the watchdog; called from the app lifespan"""
+        if not self.enabled or self._task is not None:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._heartbeat = time.perf_counter()
+        self._stop.clear()
+        self._task = asyncio.create_task(self._measure())
+        self._watchdog = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._watchdog.start()
+
+    async def close(self):
+        if self._task is None:
+            return
+        self._stop.set()
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        await asyncio.to_thread(self._watchdog.join)
+        self._watchdog = None
+
+    async def _measure(self):
+        while True:
+            expected = time.perf_counter() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.perf_counter()
+            self._heartbeat = now
+            self._record(max(0.0, now - expected))
+
+    def _record(self, lag: float):
+        self._lags.append(lag)
+        self.samples += 1
+        self.max_lag = max(self.max_lag, lag)
+        EVENT_LOOP_LAG.observe(lag)
+        block = self._open_block
+        if block is not None:
+            self._open_block = None
+            block["blocked_ms"] = round(lag * 1000, 1)
+            logger.warning(
+                "Event loop blocked for %.0f ms in %s:\n%s",
+                lag * 1000, block["task"], "".join(block["stack"]),
+            )
+
+    def _watch(self):
+        # Checks often enough to catch the loop inside the blocking call
+        while not self._stop.wait(self.threshold / 4):
+            stalled = time.perf_counter() - self._heartbeat - self.interval
+            if stalled > self.threshold and self._open_block is None:
+                self._capture(stalled)
+
+    def _capture(self, stalled: float):
+        frame = sys._current_frames().get(self._loop_thread_id)
+        if frame is None or frame.f_code.co_filename.endswith("selectors.py"):
+            # Waiting for I/O: the loop is free, its timer is just late (e.g. a starved CPU)
+            return
+        task = asyncio.current_task(self._loop)
+        stack = traceback.format_stack(frame)[-STACK_DEPTH:]
+        del frame
+        block = {
+            "at": datetime.now(timezone.utc).isoformat(),
+            "task": task.get_name() if task is not None else "loop callback",
+            "coroutine": getattr(task.get_coro(), "__qualname__", None) if task is not None else None,
+            "blocked_ms": None,
+            "stalled_ms_at_capture": round(stalled * 1000, 1),
+            "stack": stack,
+        }
+        self.blocks += 1
+        EVENT_LOOP_BLOCKS.inc()
+        self.recent_blocks.append(block)
+        self._open_block = block
+
+    def stats(self) -> dict:
+        lags = sorted(self._lags)
+        return {
+            "enabled": self.enabled,
+            "interval_ms": self.interval * 1000,
+            "threshold_ms": self.threshold * 1000,
+            "samples": self.samples,
+            "window_samples": len(lags),
+            "lag_ms": {
+                "p50": round(_percentile(lags, 50) * 1000, 2),
+                "p90": round(_percentile(lags, 90) * 1000, 2),
+                "p99": round(_percentile(lags, 99) * 1000, 2),
+                "max": round(lags[-1] * 1000, 2) if lags else 0.0,
+            },
+            "max_lag_ms": round(self.max_lag * 1000, 2),
+            "blocks": self.blocks,
+            "recent_blocks": list(self.recent_blocks),
+        }
+
+
+# Shared instance started from the app lifespan
+loop_monitor = LoopLagMonitor()
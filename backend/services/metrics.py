@@ -0,0 +1,219 @@
+import functools
+import inspect
+import os
+import time
+
+from fastapi.routing import APIRoute
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, generate_latest
+from prometheus_client.core import GaugeMetricFamily
+
+from services.request_context import add_stage, current_context
+
+# Latency buckets (seconds): sub-millisecond local stages up to slow model calls
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+# Body size buckets (bytes): 100 B to 64 MiB
+SIZE_BUCKETS = tuple(100 * 4 ** n for n in range(10)) + (64 * 2 ** 20,)
+# Memory buckets (bytes): 64 KiB to 2 GiB
+MEMORY_BUCKETS = tuple(2 ** n for n in range(16, 32))
+
+# Label values are bounded: route templates (never raw paths), known stage names,
+# model ids from the routers, HTTP status codes, endpoint profiles, configured budgets
+UNMATCHED_ROUTE = "unmatched"
+
+HTTP_REQUESTS = Counter(
+    "smartsdlc_http_requests_total", "HTTP requests by route, method and status", ["route", "method", "status"]
+)
+HTTP_DURATION = Histogram(
+    "smartsdlc_http_request_duration_seconds", "End-to-end request latency", ["route", "method"], buckets=LATENCY_BUCKETS
+)
+HTTP_STAGE_DURATION = Histogram(
+    "smartsdlc_http_stage_duration_seconds",
+    "Time a request spent in each stage: token_fetch, queue_wait, upstream, pdf_extraction, response_parsing, serialization",
+    ["route", "stage"],
+    buckets=LATENCY_BUCKETS,
+)
+HTTP_IN_FLIGHT = Gauge("smartsdlc_http_requests_in_flight", "Requests being handled", ["route"], multiprocess_mode="livesum")
+HTTP_REQUEST_SIZE = Histogram("smartsdlc_http_request_size_bytes", "Request body size", ["route"], buckets=SIZE_BUCKETS)
+HTTP_RESPONSE_SIZE = Histogram("smartsdlc_http_response_size_bytes", "Response body size", ["route"], buckets=SIZE_BUCKETS)
+UPSTREAM_RESPONSES = Counter(
+    "smartsdlc_upstream_responses_total", "watsonx.ai responses by model and status (\"error\" = transport failure)", ["model", "status"]
+)
+UPSTREAM_TOKENS = Counter(
+    "smartsdlc_upstream_tokens_total", "Tokens spent upstream by endpoint, model and kind (prompt/completion)", ["endpoint", "model", "kind"]
+)
+TOKEN_BUDGET_ACTIONS = Counter(
+    "smartsdlc_token_budget_actions_total", "Requests degraded or throttled by a token budget", ["budget", "action"]
+)
+EVENT_LOOP_LAG = Histogram(
+    "smartsdlc_event_loop_lag_seconds", "How late the event loop ran a timer (scheduling delay)", buckets=LATENCY_BUCKETS
+)
+EVENT_LOOP_BLOCKS = Counter(
+    "smartsdlc_event_loop_blocks_total", "Times the event loop was held longer than LOOP_BLOCK_THRESHOLD"
+)
+PDF_MEMORY_PEAK = Histogram(
+    "smartsdlc_pdf_memory_peak_bytes", "Python heap peak of a PDF request above its start (tracemalloc)", buckets=MEMORY_BUCKETS
+)
+PDF_RSS_DELTA = Histogram(
+    "smartsdlc_pdf_rss_delta_bytes", "Process RSS growth over a PDF request, MuPDF's buffers included", buckets=MEMORY_BUCKETS
+)
+PDF_STAGE_MEMORY = Histogram(
+    "smartsdlc_pdf_stage_memory_bytes", "Python heap still held after each stage of a PDF request", ["stage"], buckets=MEMORY_BUCKETS
+)
+PDF_MEMORY_REJECTIONS = Counter(
+    "smartsdlc_pdf_memory_rejections_total", "PDF requests refused for exceeding the memory ceiling", ["stage"]
+)
+
+
+class GatewayCollector:
+    """Admission-control state per model, read from the gateway at scrape time"""
+
+    def collect(self):
+        # Imported here: the gateway itself reports into this module
+        from services.gateway import gateway
+
+        active = GaugeMetricFamily("smartsdlc_upstream_in_flight", "Upstream calls holding a slot", labels=["model"])
+        queued = GaugeMetricFamily("smartsdlc_upstream_queued", "Requests waiting for an upstream slot", labels=["model"])
+        limit = GaugeMetricFamily("smartsdlc_upstream_concurrency_limit", "Current upstream concurrency limit", labels=["model"])
+        shed = GaugeMetricFamily("smartsdlc_upstream_shed", "Requests shed with 429 since start", labels=["model"])
+        for model_id, stats in gateway.stats().items():
+            active.add_metric([model_id], stats["active"])
+            queued.add_metric([model_id], stats["queued"])
+            limit.add_metric([model_id], stats["limit"])
+            shed.add_metric([model_id], stats["shed"])
+        return [active, queued, limit, shed]
+
+
+def _registry():
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        # Several workers: aggregate the per-process files; gateway gauges stay per process
+        from prometheus_client import multiprocess
+
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return registry
+    from prometheus_client import REGISTRY
+
+    REGISTRY.register(GatewayCollector())
+    return REGISTRY
+
+
+_registry_instance = None
+
+
+def render_metrics():
+    """(body, content type) of the Prometheus text exposition"""
+    global _registry_instance
+    if _registry_instance is None:
+        _registry_instance = _registry()
+    return generate_latest(_registry_instance), CONTENT_TYPE_LATEST
+
+
+def observe_upstream(model_id: str, status_code):
+    UPSTREAM_RESPONSES.labels(model=model_id, status=str(status_code) if status_code is not None else "error").inc()
+
+
+class TimedRoute(APIRoute):
+    """
+    APIRoute that counts its requests as in flight and notes when the endpoint
+    function returns, so the time FastAPI then spends validating and serialising
+    the return value is recorded as the "serialization" stage.
+    """
+
+    def __init__(self, path, endpoint, **kwargs):
+        super().__init__(path, _mark_endpoint_return(endpoint), **kwargs)
+
+    def get_route_handler(self):
+        handler = super().get_route_handler()
+
+        async def timed_handler(request):
+            context = current_context()
+            if context is not None and context.route is None:
+                # Decremented by MetricsMiddleware once the response (or stream) is done
+                context.route = _route_label(request.scope)
+                HTTP_IN_FLIGHT.labels(route=context.route).inc()
+            response = await handler(request)
+            if context is not None and context.endpoint_returned is not None:
+                add_stage("serialization", time.perf_counter() - context.endpoint_returned)
+            return response
+
+        return timed_handler
+
+
+def _mark_endpoint_return(endpoint):
+    # functools.wraps keeps the signature FastAPI reads the parameters from
+    if inspect.iscoroutinefunction(endpoint):
+        @functools.wraps(endpoint)
+        async def wrapper(*args, **kwargs):
+            try:
+                return await endpoint(*args, **kwargs)
+            finally:
+                _note_return()
+    else:
+        @functools.wraps(endpoint)
+        def wrapper(*args, **kwargs):
+            try:
+                return endpoint(*args, **kwargs)
+            finally:
+                _note_return()
+    return wrapper
+
+
+def _note_return():
+    context = current_context()
+    if context is not None:
+        context.endpoint_returned = time.perf_counter()
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware recording request count, latency, stage breakdown and body
+    sizes per route template. Must run inside RequestContextMiddleware, whose
+    context carries the stage timings and the in-flight route set by TimedRoute.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        sizes = {"request": 0, "response": 0}
+        status = {"code": 500}
+
+        async def counting_receive():
+            message = await receive()
+            if message["type"] == "http.request":
+                sizes["request"] += len(message.get("body", b""))
+            return message
+
+        async def counting_send(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            elif message["type"] == "http.response.body":
+                sizes["response"] += len(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, counting_receive, counting_send)
+        finally:
+            context = current_context()
+            if context is not None and context.route is not None:
+                HTTP_IN_FLIGHT.labels(route=context.route).dec()
+            route = _route_label(scope)
+            method = scope["method"]
+            HTTP_REQUESTS.labels(route=route, method=method, status=str(status["code"])).inc()
+            HTTP_DURATION.labels(route=route, method=method).observe(time.perf_counter() - started)
+            HTTP_REQUEST_SIZE.labels(route=route).observe(sizes["request"])
+            HTTP_RESPONSE_SIZE.labels(route=route).observe(sizes["response"])
+            if context is not None:
+                for stage, seconds in context.stages.items():
+                    HTTP_STAGE_DURATION.labels(route=route, stage=stage).observe(seconds)
+
+
+def _route_label(scope) -> str:
+    # The router stores the matched route in the scope; unknown paths share one
+    # label so scanners cannot blow up the series count
+    return getattr(scope.get("route"), "path", None) or UNMATCHED_ROUTE
@@ -0,0 +1,258 @@
+import asyncio
+import logging
+import math
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass
+from typing import Callable, List, Optional, Union
+
+import fitz  # PyMuPDF
+
+from config import PDF_EXTRACTION_WORKERS, PDF_PAGES_PER_TASK, PDF_EXTRACTION_TIMEOUT
+
+logger = logging.getLogger(__name__)
+
+# Raw PDF bytes or the path of a PDF file
+Source = Union[bytes, str]
+
+
+class ExtractionError(Exception):
+    """The document could not be read"""
+
+
+class ExtractionTimeout(ExtractionError):
+    """The document took longer than the extraction timeout"""
+
+
+class ExtractionWorkerError(Exception):
+    """The worker pool failed (crash, spawn failure, killed pool): a server fault, not a bad document"""
+
+
+def open_document(source: Source):
+    if isinstance(source, str):
+        return fitz.open(source, filetype="pdf")
+    return fitz.open(stream=source, filetype="pdf")
+
+
+def page_count(source: Source) -> int:
+    """Number of pages of `source`; runs in the worker processes"""
+    try:
+        with open_document(source) as document:
+            return document.page_count
+    except MemoryError:
+        raise
+    except Exception as e:
+        raise ExtractionError(str(e)) from e
+
+
+def extract_pages(source: Source, start: int = 0, stop: Optional[int] = None) -> List[str]:
+    """Text of pages [start, stop) in order; runs in the worker processes"""
+    with open_document(source) as document:
+        stop = document.page_count if stop is None else stop
+        return [document[number].get_text() for number in range(start, stop)]
+
+
+@dataclass
+class ExtractedText:
+    text: str
+    # Offset in `text` where each page starts
+    page_offsets: List[int]
+
+    @property
+    def page_count(self) -> int:
+        return len(self.page_offsets)
+
+
+def assemble(pages: List[str]) -> ExtractedText:
+    """Join page texts in order, each followed by a newline and the whole stripped, noting where pages start"""
+    offsets, position = [], 0
+    for page in pages:
+        offsets.append(position)
+        position += len(page) + 1
+    joined = "\n".join(pages)
+    text = joined.lstrip()
+    lead = len(joined) - len(text)
+    text = text.rstrip()
+    return ExtractedText(text, [min(max(0, offset - lead), len(text)) for offset in offsets])
+
+
+def _kill_workers(pool: ProcessPoolExecutor):
+    """
+    Kill the worker processes of `pool`. ProcessPoolExecutor cannot stop a call
+    that is already running: shutdown() either waits for it or leaves it running,
+    so a document stuck inside MuPDF would hold its workers forever. The only way
+    to stop them is the executor's private map of processes, hence the guard in
+    case a Python version renames it.
+    """
+    processes = getattr(pool, "_processes", ())
+    if processes == ():
+        logger.warning("Cannot kill stuck PDF extraction workers: ProcessPoolExecutor._processes is gone")
+        return
+    # None once the pool has been shut down
+    for process in list((processes or {}).values()):
+        try:
+            process.kill()
+        except (OSError, ValueError):
+            # Already exited or closed
+            pass
+
+
+def page_ranges(pages: int, workers: int, min_pages: int) -> list:
+    """[start, stop) ranges spreading `pages` over the workers, none shorter than `min_pages` but the last"""
+    size = max(min_pages, math.ceil(pages / max(workers, 1)), 1)
+    return [(start, min(start + size, pages)) for start in range(0, pages, size)]
+
+
+class PDFExtractor:
+    """
+    Extracts PDF text in a pool of worker processes, so PyMuPDF neither blocks
+    the event loop nor holds the GIL other requests need, and a malformed
+    document cannot crash or stall the server: it is never opened here.
+
+    A first job counts the pages; the document is then split into page ranges
+    extracted in parallel and reassembled in page order. A worker that crashes
+    takes the pool down with it: the pool is replaced and the jobs it was
+    running are retried once, then fail with ExtractionWorkerError (errors
+    about the document raise ExtractionError). A document still unfinished
+    after `timeout` seconds, page count included, has its workers killed and
+    fails with ExtractionTimeout; jobs of other documents caught in the
+    killed pool are retried.
+    """
+
+    def __init__(
+        self,
+        workers: int = PDF_EXTRACTION_WORKERS,
+        pages_per_task: int = PDF_PAGES_PER_TASK,
+        timeout: float = PDF_EXTRACTION_TIMEOUT,
+    ):
+        self.workers = workers
+        self.pages_per_task = pages_per_task
+        self.timeout = timeout
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self.documents = 0
+        self.ranges = 0
+        self.crashes = 0
+        self.timeouts = 0
+        self.in_flight = 0
+
+    def _executor(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            # spawn: forking a process that runs threads (loop watchdog, exporters) is unsafe
+            self._pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+        return self._pool
+
+    def _discard(self, pool: ProcessPoolExecutor, kill: bool = False):
+        """Drop `pool` (if still current) so the next range starts a fresh one"""
+        if self._pool is pool:
+            self._pool = None
+        if kill:
+            _kill_workers(pool)
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    async def _run(self, what: str, fn: Callable, *args):
+        """Run fn(*args) in the pool, retrying once if the pool breaks; `what` names the job in errors"""
+        for attempt in (1, 2):
+            pool = None
+            try:
+                pool = self._executor()
+                future = pool.submit(fn, *args)
+            except (BrokenProcessPool, OSError, RuntimeError) as e:
+                # The workers could not be started, or the pool broke or was shut down meanwhile
+                if pool is not None:
+                    self._discard(pool)
+                failure = f"Extraction workers unavailable for {what}: {e}"
+            else:
+                try:
+                    return await asyncio.wrap_future(future)
+                except BrokenProcessPool:
+                    self._discard(pool)
+                    failure = f"Extraction worker crashed on {what}"
+                except asyncio.CancelledError:
+                    if not future.cancelled() or asyncio.current_task().cancelling():
+                        raise
+                    # Queued in a pool that was killed for another document's timeout
+                    failure = f"Extraction workers were restarted while {what} waited"
+                except MemoryError as e:
+                    raise ExtractionWorkerError(f"Extraction worker ran out of memory on {what}") from e
+                except Exception as e:
+                    # Raised by PyMuPDF in the worker: the document itself is unreadable
+                    raise ExtractionError(str(e)) from e
+            if attempt == 2:
+                self.crashes += 1
+                raise ExtractionWorkerError(failure)
+
+    async def _run_range(self, source: Source, start: int, stop: int) -> List[str]:
+        return await self._run(f"pages {start + 1}-{stop}", extract_pages, source, start, stop)
+
+    async def _run_ranges(self, source: Source, ranges: list, on_range: Optional[Callable[[int], None]]) -> List[str]:
+        tasks = [asyncio.ensure_future(self._run_range(source, start, stop)) for start, stop in ranges]
+        chars = 0
+        try:
+            for finished in asyncio.as_completed(tasks):
+                chars += sum(len(page) + 1 for page in await finished)
+                if on_range is not None:
+                    # May raise to give up early, e.g. past the memory ceiling
+                    on_range(chars)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            raise
+        return [page for task in tasks for page in task.result()]
+
+    async def _extract_in_pool(self, source: Source, on_range: Optional[Callable[[int], None]]) -> List[str]:
+        # Even opening an untrusted document happens in a worker, under the timeout
+        count = await self._run("the page count", page_count, source)
+        ranges = page_ranges(count, self.workers, self.pages_per_task)
+        self.ranges += len(ranges)
+        return await self._run_ranges(source, ranges, on_range)
+
+    async def extract(self, source: Source, on_range: Optional[Callable[[int], None]] = None) -> ExtractedText:
+        """
+        Text of every page of `source`. `on_range` is called with the number of
+        characters extracted so far each time a page range completes.
+        """
+        self.documents += 1
+        if self.workers <= 0:
+            try:
+                pages = await asyncio.to_thread(extract_pages, source)
+            except Exception as e:
+                raise ExtractionError(str(e)) from e
+            if on_range is not None:
+                on_range(sum(len(page) + 1 for page in pages))
+            return assemble(pages)
+
+        self.in_flight += 1
+        try:
+            pages = await asyncio.wait_for(self._extract_in_pool(source, on_range), self.timeout)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            logger.warning("PDF extraction timed out after %.0f s; restarting the workers", self.timeout)
+            if self._pool is not None:
+                self._discard(self._pool, kill=True)
+            raise ExtractionTimeout(f"Text extraction took longer than {self.timeout:g} s")
+        finally:
+            self.in_flight -= 1
+        return assemble(pages)
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=True, cancel_futures=True)
+            self._pool = None
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "pool_running": self._pool is not None,
+            "pages_per_task": self.pages_per_task,
+            "timeout_s": self.timeout,
+            "documents": self.documents,
+            "ranges": self.ranges,
+            "in_flight": self.in_flight,
+            "crashes": self.crashes,
+            "timeouts": self.timeouts,
+        }
+
+
+# Shared instance used by the PDF router
+pdf_extractor = PDFExtractor()
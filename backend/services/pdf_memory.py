@@ -0,0 +1,122 @@
+import os
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+from typing import Optional
+
+from fastapi import HTTPException
+
+from config import PDF_MEMORY_TRACKING, PDF_MEMORY_CEILING_MB
+from services.metrics import PDF_MEMORY_PEAK, PDF_MEMORY_REJECTIONS, PDF_RSS_DELTA, PDF_STAGE_MEMORY
+
+# Copies of the extracted text a request holds at its peak: the text itself,
+# the prompt message, the encoded upstream body, the response model and its JSON
+TEXT_COPIES = 5
+
+
+def _rss() -> Optional[int]:
+    """Resident set size of this process in bytes (psutil if installed, /proc otherwise)"""
+    try:
+        import psutil
+
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        pass
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class MemoryCeiling:
+    """
+    Rejects a PDF request with 413 as soon as its estimated footprint (the
+    upload plus TEXT_COPIES times the text extracted so far) passes the
+    ceiling, before the text is copied into the prompt and the response.
+    """
+
+    def __init__(self, ceiling_mb: float = PDF_MEMORY_CEILING_MB):
+        self.limit = int(ceiling_mb * 2 ** 20)
+
+    def check(self, stage: str, upload_bytes: int, text_chars: int = 0):
+        if not self.limit:
+            return
+        estimate = upload_bytes + text_chars * TEXT_COPIES
+        if estimate > self.limit:
+            PDF_MEMORY_REJECTIONS.labels(stage=stage).inc()
+            raise HTTPException(
+                status_code=413,
+                detail=(
+                    f"This PDF needs an estimated {estimate / 2 ** 20:.1f} MB to classify, over the "
+                    f"{self.limit / 2 ** 20:.0f} MB per-request limit. Split the document into smaller files."
+                ),
+            )
+
+
+class RequestMemory:
+    """
+    Memory accounting of one PDF request: the Python heap held after each
+    stage and at its peak (tracemalloc), and the RSS growth, which also
+    covers MuPDF's own allocations that tracemalloc cannot see.
+
+    tracemalloc's peak is process-wide: with several tracked requests in
+    flight, each reports the peak since the earliest of them started, an
+    upper bound on its own.
+    """
+
+    # Tracked requests in flight; the peak is only reset when the first one starts
+    _in_flight = 0
+
+    def __init__(self):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        if RequestMemory._in_flight == 0:
+            tracemalloc.reset_peak()
+        RequestMemory._in_flight += 1
+        self._baseline = tracemalloc.get_traced_memory()[0]
+        self._rss = _rss()
+        self.stages = {}
+        self._finished = False
+
+    @contextmanager
+    def stage(self, name: str):
+        try:
+            yield
+        finally:
+            held = tracemalloc.get_traced_memory()[0] - self._baseline
+            self.stages[name] = held
+            PDF_STAGE_MEMORY.labels(stage=name).observe(max(0, held))
+
+    def finish(self) -> dict:
+        """Export the request's figures; later calls are no-ops"""
+        if self._finished:
+            return {}
+        self._finished = True
+        RequestMemory._in_flight -= 1
+        peak = tracemalloc.get_traced_memory()[1] - self._baseline
+        PDF_MEMORY_PEAK.observe(max(0, peak))
+        summary = {"peak_bytes": peak, "stages": self.stages}
+        rss = _rss()
+        if rss is not None and self._rss is not None:
+            summary["rss_delta_bytes"] = rss - self._rss
+            PDF_RSS_DELTA.observe(max(0, rss - self._rss))
+        return summary
+
+
+class _Untracked:
+    """Stand-in for RequestMemory with tracking off"""
+
+    def stage(self, name: str):
+        return nullcontext()
+
+    def finish(self) -> dict:
+        return {}
+
+
+def track(enabled: bool = PDF_MEMORY_TRACKING):
+    """Memory accounting for a new PDF request (a no-op unless PDF_MEMORY_TRACKING is on)"""
+    return RequestMemory() if enabled else _Untracked()
+
+
+# Shared ceiling used by the PDF router
+memory_ceiling = MemoryCeiling()
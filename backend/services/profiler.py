@@ -0,0 +1,293 @@
+import asyncio
+import hmac
+import json
+import logging
+import os
+import re
+import signal
+import sys
+import sysconfig
+import threading
+import time
+import uuid
+from contextvars import ContextVar
+from typing import Optional
+from urllib.parse import parse_qs
+
+from starlette.responses import JSONResponse
+
+from config import PROFILING_ADMIN_TOKEN, PROFILING_DIR, PROFILING_SAMPLE_INTERVAL, PROFILING_MAX_FILES
+from services.request_context import current_context, set_response_header
+
+logger = logging.getLogger(__name__)
+
+# Request header (or `profile` query parameter) naming the profiler to run
+PROFILE_HEADER = "x-profile"
+# Header (or `admin_token` query parameter) that must carry PROFILING_ADMIN_TOKEN
+ADMIN_TOKEN_HEADER = "x-admin-token"
+MODES = ("sampling", "deterministic")
+# Profile files as named in the X-Profile response header; anything else is refused by /ops/profiles
+PROFILE_FILE = re.compile(r"^[0-9a-f]{32}\.(collapsed|speedscope\.json)$")
+
+# Stacks are cut at the event loop: what is below is the same for every task
+_LOOP_FRAMES = os.path.join("asyncio", "events.py")
+_STDLIB = sysconfig.get_paths()["stdlib"] + os.sep
+
+# Session of the request being profiled; inherited by the tasks it starts
+_session: ContextVar[Optional["ProfileSession"]] = ContextVar("profile_session", default=None)
+# Only one request is profiled at a time (the sampler owns SIGALRM)
+_running: Optional["ProfileSession"] = None
+
+
+def is_admin(token: str) -> bool:
+    return bool(PROFILING_ADMIN_TOKEN) and hmac.compare_digest(token.encode(), PROFILING_ADMIN_TOKEN.encode())
+
+
+def _stack(frame) -> tuple:
+    # Code objects from the outermost frame of the task to `frame`
+    codes = []
+    while frame is not None:
+        code = frame.f_code
+        if code.co_filename.endswith(_LOOP_FRAMES):
+            break
+        codes.append(code)
+        frame = frame.f_back
+    codes.reverse()
+    return tuple(codes)
+
+
+def _short_path(path: str) -> str:
+    marker = "site-packages" + os.sep
+    if marker in path:
+        return path.split(marker, 1)[1]
+    if path.startswith(_STDLIB):
+        return path[len(_STDLIB):]
+    try:
+        relative = os.path.relpath(path)
+    except ValueError:
+        return path
+    return path if relative.startswith("..") else relative
+
+
+def _frame_info(entry) -> dict:
+    # A code object, or the name of a C function seen by the deterministic profiler
+    if isinstance(entry, str):
+        return {"name": entry, "file": "", "line": 0}
+    return {"name": entry.co_qualname, "file": _short_path(entry.co_filename), "line": entry.co_firstlineno}
+
+
+class ProfileSession:
+    """
+    Profile of one request: elapsed seconds per call stack, counted only while
+    the loop runs the request's own code (its task and the tasks it starts).
+
+    "sampling" interrupts the event loop thread every PROFILING_SAMPLE_INTERVAL
+    with SIGALRM and charges the time since the previous sample to the
+    interrupted stack. "deterministic" hooks every Python and C call with
+    sys.setprofile, which is exact but slows the request down several times.
+    Work handed to other threads (asyncio.to_thread, sync endpoints) is not seen.
+    """
+
+    def __init__(self, mode: str, label: str):
+        self.mode = mode
+        self.label = label
+        self.id = uuid.uuid4().hex
+        self.stacks = {}
+        self.samples = 0
+        self._last = 0.0
+        self._last_key = None
+        self._previous_handler = None
+        self.started = None
+        self.duration = None
+
+    def _add(self, key: tuple, seconds: float):
+        self.stacks[key] = self.stacks.get(key, 0.0) + seconds
+        self.samples += 1
+
+    def _on_sample(self, signum, frame):
+        # Runs on the loop thread, in the context of whatever code was interrupted
+        now = time.perf_counter()
+        if _session.get() is self:
+            self._add(_stack(frame), now - self._last)
+        self._last = now
+
+    def _on_event(self, frame, event, arg):
+        now = time.perf_counter()
+        if self._last_key is not None:
+            self._add(self._last_key, now - self._last)
+        if _session.get() is not self:
+            key = None
+        elif event == "c_call":
+            key = _stack(frame) + (f"<built-in> {getattr(arg, '__qualname__', repr(arg))}",)
+        elif event == "return":
+            key = _stack(frame.f_back) or None
+        else:
+            key = _stack(frame)
+        self._last_key = key
+        # Leaves the profiler's own bookkeeping out of the next interval
+        self._last = time.perf_counter()
+
+    def start(self):
+        self.started = time.perf_counter()
+        self._last = self.started
+        if self.mode == "sampling":
+            self._previous_handler = signal.signal(signal.SIGALRM, self._on_sample)
+            signal.setitimer(signal.ITIMER_REAL, PROFILING_SAMPLE_INTERVAL, PROFILING_SAMPLE_INTERVAL)
+        else:
+            sys.setprofile(self._on_event)
+
+    def stop(self):
+        if self.duration is not None:
+            return
+        if self.mode == "sampling":
+            signal.setitimer(signal.ITIMER_REAL, 0)
+            signal.signal(signal.SIGALRM, self._previous_handler or signal.SIG_DFL)
+        else:
+            sys.setprofile(None)
+        self.duration = time.perf_counter() - self.started
+
+    def collapsed(self) -> str:
+        """Folded stacks ("outer;inner <microseconds>"), as read by flamegraph.pl and speedscope"""
+        lines = []
+        for key, seconds in self.stacks.items():
+            names = ";".join(
+                "{name} ({file}:{line})".format(**_frame_info(entry)).replace(";", ",") for entry in key
+            )
+            weight = round(seconds * 1e6)
+            if names and weight:
+                lines.append(f"{names} {weight}")
+        return "\n".join(sorted(lines)) + "\n"
+
+    def speedscope(self) -> dict:
+        """The profile in speedscope's file format: one sampled profile weighted in milliseconds"""
+        frames, index, samples, weights = [], {}, [], []
+        for key, seconds in self.stacks.items():
+            if not key:
+                continue
+            sample = []
+            for entry in key:
+                if entry not in index:
+                    index[entry] = len(frames)
+                    frames.append(_frame_info(entry))
+                sample.append(index[entry])
+            samples.append(sample)
+            weights.append(round(seconds * 1000, 4))
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "exporter": "smartsdlc",
+            "name": self.label,
+            "activeProfileIndex": 0,
+            "shared": {"frames": frames},
+            "profiles": [{
+                "type": "sampled",
+                "name": f"{self.label} ({self.mode})",
+                "unit": "milliseconds",
+                "startValue": 0,
+                "endValue": round(sum(weights), 4),
+                "samples": samples,
+                "weights": weights,
+            }],
+        }
+
+    def write(self, directory: str = PROFILING_DIR) -> str:
+        """Save the .collapsed and .speedscope.json files; returns the speedscope file name"""
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, f"{self.id}.collapsed"), "w", encoding="utf-8") as f:
+            f.write(self.collapsed())
+        name = f"{self.id}.speedscope.json"
+        with open(os.path.join(directory, name), "w", encoding="utf-8") as f:
+            json.dump(self.speedscope(), f)
+        _prune(directory)
+        return name
+
+
+def _prune(directory: str):
+    # Two files per profile; the oldest go first
+    paths = [os.path.join(directory, name) for name in os.listdir(directory) if PROFILE_FILE.match(name)]
+    if len(paths) <= 2 * PROFILING_MAX_FILES:
+        return
+    paths.sort(key=os.path.getmtime)
+    for path in paths[:len(paths) - 2 * PROFILING_MAX_FILES]:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+class ProfilingMiddleware:
+    """
+    ASGI middleware profiling the requests an admin asks for with
+    `X-Profile: sampling|deterministic` (or `?profile=`) and
+    `X-Admin-Token` (or `?admin_token=`). The profile is written before the
+    last body chunk is sent, and `X-Profile` in the response names it under
+    /ops/profiles/. Only installed when PROFILING_ADMIN_TOKEN is set; must run
+    inside RequestContextMiddleware.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        context = current_context()
+        headers = context.headers if context is not None else {}
+        mode = headers.get(PROFILE_HEADER)
+        token = headers.get(ADMIN_TOKEN_HEADER, "")
+        if mode is None and b"profile=" in scope.get("query_string", b""):
+            query = parse_qs(scope["query_string"].decode("latin-1"))
+            mode = query.get("profile", [None])[-1]
+            token = token or query.get("admin_token", [""])[-1]
+        if mode is None:
+            await self.app(scope, receive, send)
+            return
+
+        refused = self._refusal(mode.lower(), token)
+        if refused is not None:
+            await JSONResponse({"detail": refused[1]}, status_code=refused[0])(scope, receive, send)
+            return
+
+        global _running
+        session = ProfileSession(mode.lower(), f"{scope['method']} {scope['path']}")
+        set_response_header("X-Profile", f"/ops/profiles/{session.id}.speedscope.json")
+        _running = session
+        marker = _session.set(session)
+
+        async def finish():
+            session.stop()
+            try:
+                await asyncio.to_thread(session.write)
+            except OSError as e:
+                logger.warning("Could not save profile %s: %s", session.id, e)
+                return
+            logger.info(
+                "Profiled %s (%s): %d samples over %.1f ms -> %s",
+                session.label, session.mode, session.samples, session.duration * 1000, session.id,
+            )
+
+        async def send_after_profile(message):
+            if message["type"] == "http.response.body" and not message.get("more_body", False) and session.duration is None:
+                await finish()
+            await send(message)
+
+        session.start()
+        try:
+            await self.app(scope, receive, send_after_profile)
+        finally:
+            _session.reset(marker)
+            if session.duration is None:
+                await finish()
+            _running = None
+
+    @staticmethod
+    def _refusal(mode: str, token: str) -> Optional[tuple]:
+        if not is_admin(token):
+            return 403, "Profiling requires a valid admin token"
+        if mode not in MODES:
+            return 400, f"Unknown profiler {mode!r}, expected one of {list(MODES)}"
+        if mode == "sampling" and threading.current_thread() is not threading.main_thread():
+            return 400, "The sampling profiler needs the event loop on the main thread; use deterministic"
+        if _running is not None:
+            return 409, "Another request is being profiled, try again shortly"
+        return None
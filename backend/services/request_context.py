@@ -0,0 +1,159 @@
+import json
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+from urllib.parse import parse_qs
+
+from services import tracing
+
+# Request header (or `timings` query parameter) asking for a `timings` object in the response body
+TIMINGS_HEADER = "x-timings"
+_TRUTHY = ("1", "true", "yes")
+
+
+class RequestContext:
+    """Per-request state shared between the routers, the gateway and the middleware"""
+
+    def __init__(self, headers: Optional[dict] = None):
+        self.headers = headers or {}
+        self.started = time.perf_counter()
+        # Stage name -> accumulated seconds
+        self.stages = {}
+        # Extra headers added to the response by the middleware
+        self.response_headers = {}
+        # Matched route template and when the endpoint function returned (set by metrics.TimedRoute)
+        self.route: Optional[str] = None
+        self.endpoint_returned: Optional[float] = None
+        # Add per-stage durations to JSON response bodies and SSE `done` events
+        self.timings_requested = self.headers.get(TIMINGS_HEADER, "").lower() in _TRUTHY
+
+    def add_stage(self, name: str, seconds: float):
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def timings_ms(self) -> dict:
+        """Milliseconds per stage so far, plus the total since the request arrived"""
+        timings = {name: round(seconds * 1000, 2) for name, seconds in self.stages.items()}
+        timings["total"] = round((time.perf_counter() - self.started) * 1000, 2)
+        return timings
+
+
+_current: ContextVar[Optional[RequestContext]] = ContextVar("request_context", default=None)
+
+
+def current_context() -> Optional[RequestContext]:
+    return _current.get()
+
+
+def use_context(context: RequestContext) -> RequestContext:
+    """Make `context` the current one for the rest of this task (e.g. one WebSocket conversation)"""
+    _current.set(context)
+    return context
+
+
+def server_timing(timings: dict) -> str:
+    """`Server-Timing` header value for a timings_ms() dict"""
+    return ", ".join(f"{name};dur={ms:.1f}" for name, ms in timings.items())
+
+
+def set_response_header(name: str, value: str):
+    """Attach a header to the response of the current request, if there is one"""
+    context = _current.get()
+    if context is not None:
+        context.response_headers[name] = value
+
+
+def add_stage(name: str, seconds: float):
+    """Record time spent in a stage of the current request, if there is one"""
+    context = _current.get()
+    if context is not None:
+        context.add_stage(name, seconds)
+
+
+@contextmanager
+def timed_stage(name: str):
+    """Record the time spent in the `with` block as a stage of the current request, and trace it as a span"""
+    started = time.perf_counter()
+    with tracing.span(name):
+        try:
+            yield
+        finally:
+            add_stage(name, time.perf_counter() - started)
+
+
+class RequestContextMiddleware:
+    """
+    ASGI middleware that opens a RequestContext for every HTTP request, reports
+    the time it spent queueing for an upstream slot in `X-Queue-Wait-Ms`, the
+    stage durations in `Server-Timing` and adds any headers set through
+    `set_response_header`.
+
+    `Server-Timing` is written with the response headers, so for streamed
+    responses it only covers what happened before the first byte. When the
+    client sends `X-Timings: 1` (or `?timings=1`), JSON responses are buffered
+    and get a `timings` object with the complete breakdown in milliseconds.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = {key.decode("latin-1").lower(): value.decode("latin-1") for key, value in scope.get("headers", [])}
+        context = RequestContext(headers)
+        if not context.timings_requested:
+            query = parse_qs(scope.get("query_string", b"").decode("latin-1"))
+            context.timings_requested = query.get("timings", [""])[-1].lower() in _TRUTHY
+        token = _current.set(context)
+        held = {"start": None, "body": []}
+
+        def with_headers(start: dict, timings: dict, drop=()) -> dict:
+            extra = dict(context.response_headers)
+            extra["x-queue-wait-ms"] = f"{context.stages.get('queue_wait', 0.0) * 1000:.1f}"
+            extra["server-timing"] = server_timing(timings)
+            headers = [(name, value) for name, value in start.get("headers", []) if name.lower() not in drop]
+            return {**start, "headers": headers + [
+                (name.lower().encode("latin-1"), value.encode("latin-1")) for name, value in extra.items()
+            ]}
+
+        async def send_with_headers(message):
+            if message["type"] == "http.response.start":
+                if context.timings_requested and _is_json(message):
+                    # Sent with the body, once the timings are complete
+                    held["start"] = message
+                    return
+                message = with_headers(message, context.timings_ms())
+            elif message["type"] == "http.response.body" and held["start"] is not None:
+                held["body"].append(message.get("body", b""))
+                if message.get("more_body", False):
+                    return
+                body = b"".join(held["body"])
+                timings = context.timings_ms()
+                try:
+                    payload = json.loads(body)
+                except ValueError:
+                    payload = None
+                if isinstance(payload, dict):
+                    payload["timings"] = timings
+                    body = json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+                start = with_headers(held["start"], timings, drop=(b"content-length",))
+                start["headers"].append((b"content-length", str(len(body)).encode("latin-1")))
+                held["start"] = None
+                await send(start)
+                message = {"type": "http.response.body", "body": body, "more_body": False}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_headers)
+        finally:
+            _current.reset(token)
+
+
+def _is_json(start: dict) -> bool:
+    for name, value in start.get("headers", []):
+        if name.lower() == b"content-type":
+            return value.split(b";")[0].strip().lower() == b"application/json"
+    return False
@@ -0,0 +1,181 @@
+import asyncio
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+from config import (
+    RESPONSE_CACHE_ENABLED,
+    RESPONSE_CACHE_MAX_BYTES,
+    RESPONSE_CACHE_TTL,
+    RESPONSE_CACHE_MAX_TEMPERATURE,
+)
+from services.disk_cache import DiskCache
+from services.request_context import current_context
+
+# Tier that answered a lookup
+TIER_MEMORY = "memory"
+TIER_DISK = "disk"
+
+# Cache modes derived from the request headers
+CACHE_USE = "use"          # read and write the cache
+CACHE_REFRESH = "refresh"  # skip the lookup but store the fresh answer
+CACHE_BYPASS = "bypass"    # neither read nor write
+
+
+def make_cache_key(body: dict) -> str:
+    """Hash of the model, messages and sampling parameters of a chat request"""
+    canonical = json.dumps(body, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def is_reproducible(body: dict) -> bool:
+    """Only (near-)greedy sampling gives answers worth replaying"""
+    return float(body.get("temperature", 1.0)) <= RESPONSE_CACHE_MAX_TEMPERATURE
+
+
+def cache_mode() -> str:
+    """
+    Let callers opt out per request: `Cache-Control: no-store` or
+    `X-Cache-Bypass: 1` bypass the cache, `Cache-Control: no-cache` forces a
+    fresh upstream call whose answer is still stored.
+    """
+    context = current_context()
+    if context is None:
+        return CACHE_USE
+    if context.headers.get("x-cache-bypass", "").lower() in ("1", "true", "yes"):
+        return CACHE_BYPASS
+    cache_control = context.headers.get("cache-control", "").lower()
+    if "no-store" in cache_control:
+        return CACHE_BYPASS
+    if "no-cache" in cache_control:
+        return CACHE_REFRESH
+    return CACHE_USE
+
+
+class _Entry:
+    __slots__ = ("value", "expires_at", "fingerprint")
+
+    def __init__(self, value: bytes, expires_at: float, fingerprint: Optional[str] = None):
+        self.value = value
+        self.expires_at = expires_at
+        # Exact hash of the request that produced the entry, when the key is canonicalised
+        self.fingerprint = fingerprint
+
+
+class ResponseCache:
+    """
+    LRU + TTL cache of upstream response bodies, bounded by their total size in bytes.
+
+    An optional DiskCache sits underneath: `lookup` falls through to it on a memory
+    miss and promotes disk hits, `store` writes to both tiers.
+    """
+
+    def __init__(
+        self,
+        max_bytes: int = RESPONSE_CACHE_MAX_BYTES,
+        ttl: float = RESPONSE_CACHE_TTL,
+        enabled: bool = RESPONSE_CACHE_ENABLED,
+        disk: Optional[DiskCache] = None,
+    ):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.enabled = enabled
+        self.disk = disk if disk is not None and disk.enabled else None
+        self._pending_writes = set()
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self.current_bytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        # Hits on a canonical key whose exact request hash differed from the stored one
+        self.normalized_hits = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.bypasses = 0
+        self.uncacheable = 0
+
+    def get(self, key: str, fingerprint: Optional[str] = None) -> Optional[bytes]:
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        if entry.expires_at <= time.time():
+            self._remove(key)
+            self.expirations += 1
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        if fingerprint is not None and entry.fingerprint is not None and fingerprint != entry.fingerprint:
+            self.normalized_hits += 1
+        return entry.value
+
+    def put(self, key: str, value: bytes, ttl: Optional[float] = None, fingerprint: Optional[str] = None):
+        size = len(value)
+        if size > self.max_bytes:
+            return
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = _Entry(value, time.time() + (ttl if ttl is not None else self.ttl), fingerprint)
+        self.current_bytes += size
+        while self.current_bytes > self.max_bytes:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.evictions += 1
+
+    async def lookup(self, key: str, fingerprint: Optional[str] = None) -> Tuple[Optional[bytes], Optional[str]]:
+        """Return the cached body and the tier it came from, or (None, None)"""
+        value = self.get(key, fingerprint)
+        if value is not None:
+            return value, TIER_MEMORY
+        if self.disk is None:
+            return None, None
+        value = await asyncio.to_thread(self.disk.get, key)
+        if value is None:
+            return None, None
+        self.put(key, value, fingerprint=fingerprint)
+        return value, TIER_DISK
+
+    async def store(self, key: str, value: bytes, fingerprint: Optional[str] = None):
+        """Store in memory now and on disk in the background"""
+        self.put(key, value, fingerprint=fingerprint)
+        if self.disk is not None:
+            task = asyncio.ensure_future(asyncio.to_thread(self.disk.put, key, value))
+            self._pending_writes.add(task)
+            task.add_done_callback(self._pending_writes.discard)
+
+    async def clear(self):
+        self._entries.clear()
+        self.current_bytes = 0
+        if self.disk is not None:
+            await asyncio.to_thread(self.disk.clear)
+
+    def _remove(self, key: str):
+        entry = self._entries.pop(key)
+        self.current_bytes -= len(entry.value)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "entries": len(self._entries),
+            "bytes": self.current_bytes,
+            "max_bytes": self.max_bytes,
+            "ttl": self.ttl,
+            "max_temperature": RESPONSE_CACHE_MAX_TEMPERATURE,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "normalized_hits": self.normalized_hits,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "bypasses": self.bypasses,
+            "uncacheable": self.uncacheable,
+            "disk": self.disk.stats() if self.disk is not None else None,
+        }
+
+
+# Shared instance used by the gateway
+response_cache = ResponseCache(disk=DiskCache())
@@ -0,0 +1,65 @@
+import json
+import time
+from typing import AsyncIterator
+
+import httpx
+from fastapi.responses import StreamingResponse
+
+from services.request_context import current_context
+
+
+def sse_event(event: str, data: dict) -> str:
+    """Format one server-sent event"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+async def relay_chat_stream(chunks: AsyncIterator[dict], start_time: float) -> AsyncIterator[str]:
+    """
+    Turn watsonx chat_stream chunks into the SSE protocol of the streaming endpoints:
+
+    - `token`: `{"content": "..."}` for every piece of generated text
+    - `done`:  `{"processing_time": ..., "usage": {...}, "finish_reason": ...}` once, at the end,
+      with a `timings` object when the request asked for one
+    - `error`: `{"detail": "..."}` if the upstream stream fails midway; nothing follows it
+
+    If the client disconnects, the generator is cancelled and the upstream stream is
+    closed with it, releasing its slot.
+    """
+    usage = {}
+    finish_reason = None
+    try:
+        async for chunk in chunks:
+            if chunk.get("usage"):
+                usage = chunk["usage"]
+            for choice in chunk.get("choices", []):
+                content = (choice.get("delta") or {}).get("content")
+                if content:
+                    yield sse_event("token", {"content": content})
+                if choice.get("finish_reason"):
+                    finish_reason = choice["finish_reason"]
+    except (httpx.HTTPError, ValueError) as e:
+        yield sse_event("error", {"detail": f"Upstream stream failed: {str(e)}"})
+        return
+    finally:
+        if hasattr(chunks, "aclose"):
+            await chunks.aclose()
+
+    done = {
+        "processing_time": time.time() - start_time,
+        "usage": usage,
+        "finish_reason": finish_reason,
+    }
+    context = current_context()
+    if context is not None and context.timings_requested:
+        # Complete here, unlike the Server-Timing header sent before the first token
+        done["timings"] = context.timings_ms()
+    yield sse_event("done", done)
+
+
+def sse_response(chunks: AsyncIterator[dict], start_time: float) -> StreamingResponse:
+    return StreamingResponse(
+        relay_chat_stream(chunks, start_time),
+        media_type="text/event-stream",
+        # Keep proxies from buffering the stream
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
@@ -0,0 +1,104 @@
+import asyncio
+import logging
+import time
+from typing import Optional
+
+from config import API_KEY, IAM_TOKEN_URL, TOKEN_EXPIRY_MARGIN, TOKEN_REFRESH_AHEAD
+from services.http_client import get_http_client, get_timeout
+
+logger = logging.getLogger(__name__)
+
+
+class TokenManager:
+    """
+    Caches the IBM Cloud IAM bearer token shared by every router.
+
+    The token is reused until shortly before its `expiration`. Once it gets close
+    to expiry a refresh is started in the background while callers keep using the
+    still-valid token, and concurrent refreshes are collapsed into a single IAM call.
+    """
+
+    def __init__(
+        self,
+        api_key: Optional[str],
+        token_url: str = IAM_TOKEN_URL,
+        expiry_margin: float = TOKEN_EXPIRY_MARGIN,
+        refresh_ahead: float = TOKEN_REFRESH_AHEAD,
+    ):
+        self.api_key = api_key
+        self.token_url = token_url
+        self.expiry_margin = expiry_margin
+        self.refresh_ahead = max(refresh_ahead, expiry_margin)
+
+        self._token: Optional[str] = None
+        self._expires_at = 0.0
+        self._inflight: Optional[asyncio.Task] = None
+        self.fetch_count = 0
+
+    async def get_token(self) -> str:
+        """Return a valid bearer token, fetching one from IAM only when needed"""
+        now = time.time()
+        if self._token and now < self._expires_at - self.expiry_margin:
+            # Still valid: kick off a background refresh if we are close to expiry
+            if now >= self._expires_at - self.refresh_ahead and self._inflight is None:
+                self._start_refresh()
+            return self._token
+
+        # No usable token: every caller waits on the same refresh
+        return await asyncio.shield(self._start_refresh())
+
+    def invalidate(self):
+        """Drop the cached token, e.g. after the upstream rejected it with a 401"""
+        self._token = None
+        self._expires_at = 0.0
+
+    async def close(self):
+        """Cancel a refresh still in flight; called on app shutdown"""
+        if self._inflight is not None:
+            self._inflight.cancel()
+
+    def stats(self) -> dict:
+        return {
+            "cached": self._token is not None,
+            "expires_in": round(max(self._expires_at - time.time(), 0.0), 1),
+            "refreshing": self._inflight is not None,
+            "fetch_count": self.fetch_count,
+        }
+
+    def _start_refresh(self) -> asyncio.Task:
+        if self._inflight is None:
+            self._inflight = asyncio.ensure_future(self._fetch_token())
+            self._inflight.add_done_callback(self._on_refresh_done)
+        return self._inflight
+
+    def _on_refresh_done(self, task: asyncio.Task):
+        self._inflight = None
+        if not task.cancelled() and task.exception() is not None:
+            logger.warning("IAM token refresh failed: %s", task.exception())
+
+    async def _fetch_token(self) -> str:
+        data = {
+            "grant_type": "urn:ibm:params:oauth:grant-type:apikey",
+            "apikey": self.api_key
+        }
+        client = get_http_client()
+        response = await client.post(
+            self.token_url,
+            data=data,
+            headers={"Content-Type": "application/x-www-form-urlencoded"},
+            timeout=get_timeout("iam"),
+        )
+        response.raise_for_status()
+        payload = response.json()
+
+        self.fetch_count += 1
+        self._token = payload["access_token"]
+        if "expiration" in payload:
+            self._expires_at = float(payload["expiration"])
+        else:
+            self._expires_at = time.time() + float(payload.get("expires_in", 3600))
+        return self._token
+
+
+# Shared instance used by all routers
+token_manager = TokenManager(API_KEY)
@@ -0,0 +1,415 @@
+import asyncio
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from contextvars import ContextVar
+from typing import Optional, Tuple
+
+from fastapi import HTTPException
+
+from config import (
+    TOKEN_USAGE_ENABLED,
+    TOKEN_USAGE_DB_PATH,
+    TOKEN_USAGE_FLUSH_INTERVAL,
+    TOKEN_USAGE_MINUTE_RETENTION,
+    TOKEN_USAGE_DAY_RETENTION,
+    TOKEN_USAGE_CALLER_HEADER,
+    TOKEN_USAGE_MAX_CALLERS,
+    TOKEN_BUDGETS,
+    TOKEN_BUDGET_DEGRADE_AT,
+    TOKEN_BUDGET_DEGRADED_MAX_TOKENS,
+    TOKEN_BUDGET_SHED_WHEN_DEGRADED,
+)
+from services.metrics import TOKEN_BUDGET_ACTIONS, UPSTREAM_TOKENS
+from services.request_context import current_context, set_response_header
+
+logger = logging.getLogger(__name__)
+
+# Bucket width in seconds per rollup granularity; days are UTC days
+GRANULARITIES = {"minute": 60, "day": 86400}
+GROUP_FIELDS = ("endpoint", "model", "caller")
+# Budget scope covering every endpoint
+ALL_ENDPOINTS = ""
+
+ANONYMOUS = "anonymous"
+OTHER_CALLER = "other"
+_CALLER_PATTERN = re.compile(r"^[A-Za-z0-9._@:-]{1,64}$")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS token_usage (
+    granularity TEXT NOT NULL,
+    bucket INTEGER NOT NULL,
+    endpoint TEXT NOT NULL,
+    model TEXT NOT NULL,
+    caller TEXT NOT NULL,
+    requests INTEGER NOT NULL,
+    prompt_tokens INTEGER NOT NULL,
+    completion_tokens INTEGER NOT NULL,
+    PRIMARY KEY (granularity, bucket, endpoint, model, caller)
+) WITHOUT ROWID;
+"""
+
+# Caller of the upstream calls made by the current task when there is no HTTP request
+# context, e.g. a WebSocket connection
+_caller: ContextVar[Optional[str]] = ContextVar("token_usage_caller", default=None)
+
+
+def bucket_start(granularity: str, now: float) -> int:
+    width = GRANULARITIES[granularity]
+    return int(now // width) * width
+
+
+def caller_from_headers(headers: dict) -> str:
+    """Caller id from the configured request header (lower-case header names)"""
+    value = (headers.get(TOKEN_USAGE_CALLER_HEADER) or "").strip()
+    if not value:
+        return ANONYMOUS
+    return value if _CALLER_PATTERN.match(value) else OTHER_CALLER
+
+
+def set_caller(caller: str):
+    """Attribute upstream calls made from the current task (and tasks it starts) to `caller`"""
+    _caller.set(caller)
+
+
+def current_caller() -> str:
+    caller = _caller.get()
+    if caller is not None:
+        return caller
+    context = current_context()
+    return caller_from_headers(context.headers) if context is not None else ANONYMOUS
+
+
+def usage_tokens(usage: Optional[dict]) -> Tuple[int, int]:
+    """(prompt, completion) tokens of a watsonx.ai `usage` object"""
+    usage = usage or {}
+    return int(usage.get("prompt_tokens") or 0), int(usage.get("completion_tokens") or 0)
+
+
+class TokenUsageLedger:
+    """
+    Prompt and completion tokens spent upstream, rolled up per minute and per UTC
+    day by endpoint, model and caller.
+
+    Calls are counted in process and written to a small SQLite table every
+    `flush_interval` seconds: one row per (granularity, bucket, endpoint, model,
+    caller), upserted, with minute rows kept for `minute_retention` seconds and
+    day rows for `day_retention`. After each write the current minute and day
+    totals of all workers sharing the file are read back, so budget checks see
+    the spend of the whole host plus this process's unflushed calls.
+    """
+
+    def __init__(
+        self,
+        path: str = TOKEN_USAGE_DB_PATH,
+        enabled: bool = TOKEN_USAGE_ENABLED,
+        flush_interval: float = TOKEN_USAGE_FLUSH_INTERVAL,
+        minute_retention: float = TOKEN_USAGE_MINUTE_RETENTION,
+        day_retention: float = TOKEN_USAGE_DAY_RETENTION,
+        max_callers: int = TOKEN_USAGE_MAX_CALLERS,
+    ):
+        self.path = path
+        self.enabled = enabled
+        self.flush_interval = flush_interval
+        self.retention = {"minute": minute_retention, "day": day_retention}
+        self.max_callers = max_callers
+
+        self._lock = threading.Lock()
+        self._db_lock = threading.Lock()
+        self._connection_instance: Optional[sqlite3.Connection] = None
+        # (granularity, bucket, endpoint, model, caller) -> [requests, prompt, completion]
+        self._pending = {}
+        # (granularity, bucket, scope) -> tokens: not yet flushed, and host-wide as of the last flush
+        self._unflushed = {}
+        self._shared = {}
+        self._callers = set()
+        self._task: Optional[asyncio.Task] = None
+
+        self.recorded = 0
+        self.flushes = 0
+        self.errors = 0
+
+    def _connection(self) -> sqlite3.Connection:
+        # One connection serialised by _db_lock; flushes and reports are infrequent
+        if self._connection_instance is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=5.0, isolation_level=None, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute("PRAGMA busy_timeout=5000")
+            connection.executescript(_SCHEMA)
+            self._connection_instance = connection
+        return self._connection_instance
+
+    def _bounded_caller(self, caller: str) -> str:
+        if caller in self._callers:
+            return caller
+        if len(self._callers) >= self.max_callers:
+            return OTHER_CALLER
+        self._callers.add(caller)
+        return caller
+
+    def record(self, endpoint: str, model: str, prompt_tokens: int, completion_tokens: int, caller: Optional[str] = None):
+        """Count one upstream call; cheap enough for the request path"""
+        UPSTREAM_TOKENS.labels(endpoint=endpoint, model=model, kind="prompt").inc(prompt_tokens)
+        UPSTREAM_TOKENS.labels(endpoint=endpoint, model=model, kind="completion").inc(completion_tokens)
+        if not self.enabled:
+            return
+        now = time.time()
+        total = prompt_tokens + completion_tokens
+        with self._lock:
+            caller = self._bounded_caller(caller if caller is not None else current_caller())
+            for granularity in GRANULARITIES:
+                bucket = bucket_start(granularity, now)
+                counts = self._pending.setdefault((granularity, bucket, endpoint, model, caller), [0, 0, 0])
+                counts[0] += 1
+                counts[1] += prompt_tokens
+                counts[2] += completion_tokens
+                for scope in (ALL_ENDPOINTS, endpoint):
+                    key = (granularity, bucket, scope)
+                    self._unflushed[key] = self._unflushed.get(key, 0) + total
+            self.recorded += 1
+
+    def window_usage(self, granularity: str, scope: str = ALL_ENDPOINTS, now: Optional[float] = None) -> int:
+        """Tokens spent in the current minute or day, overall or by one endpoint"""
+        key = (granularity, bucket_start(granularity, now if now is not None else time.time()), scope)
+        with self._lock:
+            return self._shared.get(key, 0) + self._unflushed.get(key, 0)
+
+    def flush(self):
+        """Write pending counts to the store and refresh the host-wide window totals (blocking)"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            in_transit = dict(self._unflushed)
+        now = time.time()
+        try:
+            with self._db_lock:
+                connection = self._connection()
+                connection.execute("BEGIN IMMEDIATE")
+                try:
+                    connection.executemany(
+                        """
+                        INSERT INTO token_usage VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                        ON CONFLICT (granularity, bucket, endpoint, model, caller) DO UPDATE SET
+                            requests = requests + excluded.requests,
+                            prompt_tokens = prompt_tokens + excluded.prompt_tokens,
+                            completion_tokens = completion_tokens + excluded.completion_tokens
+                        """,
+                        [key + tuple(counts) for key, counts in pending.items()],
+                    )
+                    for granularity, retention in self.retention.items():
+                        connection.execute(
+                            "DELETE FROM token_usage WHERE granularity = ? AND bucket < ?", (granularity, now - retention)
+                        )
+                    connection.execute("COMMIT")
+                except sqlite3.Error:
+                    connection.execute("ROLLBACK")
+                    raise
+                shared = {}
+                for granularity in GRANULARITIES:
+                    bucket = bucket_start(granularity, now)
+                    for endpoint, tokens in connection.execute(
+                        """
+                        SELECT endpoint, SUM(prompt_tokens + completion_tokens) FROM token_usage
+                        WHERE granularity = ? AND bucket = ? GROUP BY endpoint
+                        """,
+                        (granularity, bucket),
+                    ):
+                        shared[(granularity, bucket, endpoint)] = tokens
+                        key = (granularity, bucket, ALL_ENDPOINTS)
+                        shared[key] = shared.get(key, 0) + tokens
+        except sqlite3.Error as e:
+            self.errors += 1
+            logger.warning("Token usage flush failed: %s", e)
+            # Keep the counts for the next attempt
+            with self._lock:
+                for key, counts in pending.items():
+                    merged = self._pending.setdefault(key, [0, 0, 0])
+                    for i, value in enumerate(counts):
+                        merged[i] += value
+            return
+
+        with self._lock:
+            self._shared = shared
+            # What was just written is now part of the shared totals
+            for key, tokens in in_transit.items():
+                left = self._unflushed.get(key, 0) - tokens
+                if left > 0:
+                    self._unflushed[key] = left
+                else:
+                    self._unflushed.pop(key, None)
+            self.flushes += 1
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await asyncio.to_thread(self.flush)
+
+    async def start(self):
+        """Start the periodic flush; called from the app lifespan"""
+        if self.enabled and self._task is None:
+            self._task = asyncio.create_task(self._flush_loop())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self.enabled:
+            await asyncio.to_thread(self.flush)
+
+    def report(self, granularity: str = "day", buckets: int = 1, group_by: Tuple[str, ...] = ("endpoint", "model")) -> dict:
+        """
+        Token spend over the last `buckets` minutes or days, grouped by any of
+        endpoint, model and caller and sorted by total tokens (blocking).
+        """
+        self.flush()
+        since = bucket_start(granularity, time.time()) - (buckets - 1) * GRANULARITIES[granularity]
+        columns = ", ".join(group_by)
+        select = f"{columns}, " if group_by else ""
+        group = f"GROUP BY {columns}" if group_by else ""
+        with self._db_lock:
+            rows = self._connection().execute(
+                f"""
+                SELECT {select}SUM(requests), SUM(prompt_tokens), SUM(completion_tokens) FROM token_usage
+                WHERE granularity = ? AND bucket >= ? {group}
+                ORDER BY SUM(prompt_tokens + completion_tokens) DESC
+                """,
+                (granularity, since),
+            ).fetchall()
+        grand_total = sum(row[-2] + row[-1] for row in rows if row[-1] is not None)
+        results = []
+        for row in rows:
+            requests, prompt_tokens, completion_tokens = row[len(group_by):]
+            if not requests:
+                continue
+            total = prompt_tokens + completion_tokens
+            entry = dict(zip(group_by, row))
+            entry.update(
+                requests=requests,
+                prompt_tokens=prompt_tokens,
+                completion_tokens=completion_tokens,
+                total_tokens=total,
+                tokens_per_request=round(total / requests, 1),
+                share=round(total / grand_total, 4) if grand_total else 0.0,
+            )
+            results.append(entry)
+        return {
+            "granularity": granularity,
+            "since": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(since)),
+            "group_by": list(group_by),
+            "total_tokens": grand_total,
+            "rows": results,
+        }
+
+    def stats(self) -> dict:
+        with self._lock:
+            pending = len(self._pending)
+        return {
+            "enabled": self.enabled,
+            "path": self.path,
+            "recorded": self.recorded,
+            "pending_rows": pending,
+            "flushes": self.flushes,
+            "errors": self.errors,
+            "callers": len(self._callers),
+        }
+
+
+class TokenBudgets:
+    """
+    Token budgets per minute or per UTC day, overall or for one endpoint.
+
+    Before an upstream call every budget that covers the endpoint is checked
+    against the ledger. Past `degrade_at` of a budget the call is degraded: its
+    `max_tokens` is capped and endpoints listed in `shed_when_degraded` are
+    throttled outright. Once a budget is spent, calls are throttled with 429 and a
+    Retry-After pointing at the start of the next window.
+    """
+
+    def __init__(
+        self,
+        ledger: TokenUsageLedger,
+        budgets: dict = TOKEN_BUDGETS,
+        degrade_at: float = TOKEN_BUDGET_DEGRADE_AT,
+        degraded_max_tokens: int = TOKEN_BUDGET_DEGRADED_MAX_TOKENS,
+        shed_when_degraded=TOKEN_BUDGET_SHED_WHEN_DEGRADED,
+    ):
+        for granularity, _ in budgets:
+            if granularity not in GRANULARITIES:
+                raise ValueError(f"Unknown token budget window {granularity!r}, expected one of {list(GRANULARITIES)}")
+        self.ledger = ledger
+        self.budgets = budgets
+        self.degrade_at = degrade_at
+        self.degraded_max_tokens = degraded_max_tokens
+        self.shed_when_degraded = set(shed_when_degraded)
+
+    def _worst(self, endpoint: str, now: float):
+        """(used share, granularity, scope, limit) of the most consumed budget covering `endpoint`"""
+        worst = None
+        for (granularity, scope), limit in self.budgets.items():
+            if scope not in (ALL_ENDPOINTS, endpoint):
+                continue
+            share = self.ledger.window_usage(granularity, scope, now) / limit if limit > 0 else 1.0
+            if worst is None or share > worst[0]:
+                worst = (share, granularity, scope, limit)
+        return worst
+
+    def enforce(self, body: dict, endpoint: str) -> Tuple[dict, bool]:
+        """
+        Return the body to send and whether it was degraded, or raise 429 when the
+        endpoint is over budget.
+        """
+        if not self.budgets:
+            return body, False
+        now = time.time()
+        worst = self._worst(endpoint, now)
+        if worst is None or worst[0] < self.degrade_at:
+            return body, False
+
+        share, granularity, scope, limit = worst
+        label = f"{granularity}:{scope or 'all'}"
+        if share >= 1.0 or endpoint in self.shed_when_degraded:
+            TOKEN_BUDGET_ACTIONS.labels(budget=label, action="throttle").inc()
+            retry_after = max(1, int(bucket_start(granularity, now) + GRANULARITIES[granularity] - now) + 1)
+            raise HTTPException(
+                status_code=429,
+                detail=f"Token budget {label} ({limit} tokens) is used up, please retry later",
+                headers={"Retry-After": str(retry_after), "X-Token-Budget": "throttled"},
+            )
+
+        TOKEN_BUDGET_ACTIONS.labels(budget=label, action="degrade").inc()
+        set_response_header("X-Token-Budget", "degraded")
+        if body.get("max_tokens", self.degraded_max_tokens + 1) > self.degraded_max_tokens:
+            body = {**body, "max_tokens": self.degraded_max_tokens}
+        return body, True
+
+    def stats(self) -> list:
+        now = time.time()
+        states = []
+        for (granularity, scope), limit in self.budgets.items():
+            used = self.ledger.window_usage(granularity, scope, now)
+            share = used / limit if limit > 0 else 1.0
+            states.append({
+                "window": granularity,
+                "endpoint": scope or "all",
+                "limit": limit,
+                "used": used,
+                "share": round(share, 4),
+                "state": "throttled" if share >= 1.0 else "degraded" if share >= self.degrade_at else "ok",
+                "resets_in_s": int(bucket_start(granularity, now) + GRANULARITIES[granularity] - now),
+            })
+        return states
+
+
+# Shared instances used by the gateway
+token_usage = TokenUsageLedger()
+token_budgets = TokenBudgets(token_usage)
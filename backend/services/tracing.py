@@ -0,0 +1,244 @@
+import json
+import logging
+import os
+import threading
+from contextlib import nullcontext
+from typing import Optional
+
+from config import (
+    TRACING_ENABLED,
+    TRACING_SERVICE_NAME,
+    TRACING_SAMPLE_RATIO,
+    TRACING_EXPORTER,
+    TRACING_FILE_PATH,
+    TRACING_OTLP_ENDPOINT,
+)
+
+logger = logging.getLogger(__name__)
+
+# Set by setup(); None keeps every helper below a no-op
+_tracer = None
+_provider = None
+
+# Attribute names (OpenTelemetry semantic conventions where one exists)
+ATTR_ENDPOINT = "smartsdlc.endpoint"
+ATTR_MODEL = "gen_ai.request.model"
+ATTR_INPUT_TOKENS = "gen_ai.usage.input_tokens"
+ATTR_OUTPUT_TOKENS = "gen_ai.usage.output_tokens"
+ATTR_CACHE = "smartsdlc.cache"
+ATTR_PDF_PAGES = "smartsdlc.pdf.page_count"
+
+
+def span_record(span) -> dict:
+    """One finished span as a flat JSON-friendly dict (the format of the file exporter)"""
+    context = span.get_span_context()
+    parent = span.parent
+    return {
+        "trace_id": format(context.trace_id, "032x"),
+        "span_id": format(context.span_id, "016x"),
+        "parent_span_id": format(parent.span_id, "016x") if parent is not None else None,
+        "name": span.name,
+        "kind": span.kind.name,
+        "service": span.resource.attributes.get("service.name"),
+        "start_unix_nano": span.start_time,
+        "end_unix_nano": span.end_time,
+        "duration_ms": round((span.end_time - span.start_time) / 1e6, 3),
+        "status": span.status.status_code.name,
+        "attributes": dict(span.attributes or {}),
+    }
+
+
+def _file_exporter(path: str):
+    from opentelemetry.sdk.trace.export import SpanExporter, SpanExportResult
+
+    class JsonLinesSpanExporter(SpanExporter):
+        """Appends finished spans to a JSON lines file, one span per line"""
+
+        def __init__(self):
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._lock = threading.Lock()
+
+        def export(self, spans):
+            lines = "".join(json.dumps(span_record(span), ensure_ascii=False) + "\n" for span in spans)
+            try:
+                with self._lock, open(path, "a", encoding="utf-8") as f:
+                    f.write(lines)
+            except OSError as e:
+                logger.warning("Could not write spans to %s: %s", path, e)
+                return SpanExportResult.FAILURE
+            return SpanExportResult.SUCCESS
+
+    return JsonLinesSpanExporter()
+
+
+def _exporter(kind: str):
+    if kind == "file":
+        return _file_exporter(TRACING_FILE_PATH)
+    if kind == "otlp":
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+
+        return OTLPSpanExporter(endpoint=TRACING_OTLP_ENDPOINT)
+    if kind == "console":
+        from opentelemetry.sdk.trace.export import ConsoleSpanExporter
+
+        return ConsoleSpanExporter()
+    raise ValueError(f"Unknown TRACING_EXPORTER {kind!r}, expected file, otlp or console")
+
+
+def setup(enabled: bool = TRACING_ENABLED, sample_ratio: float = TRACING_SAMPLE_RATIO, exporter: str = TRACING_EXPORTER):
+    """
+    Install the tracer provider; called from the app lifespan.
+
+    Root spans are sampled with probability `sample_ratio`; a request carrying a
+    W3C `traceparent` keeps the caller's sampling decision. Unsampled requests
+    only pay for a non-recording span object, and spans are exported in batches
+    from a background thread.
+    """
+    global _tracer, _provider
+    if not enabled or _tracer is not None:
+        return
+    try:
+        from opentelemetry.sdk.resources import Resource
+        from opentelemetry.sdk.trace import TracerProvider
+        from opentelemetry.sdk.trace.export import BatchSpanProcessor
+        from opentelemetry.sdk.trace.sampling import ParentBased, TraceIdRatioBased
+
+        span_exporter = _exporter(exporter)
+    except ImportError as e:
+        logger.warning("TRACING_ENABLED is set but %s is not installed; tracing stays off", e.name)
+        return
+
+    _provider = TracerProvider(
+        resource=Resource.create({"service.name": TRACING_SERVICE_NAME}),
+        sampler=ParentBased(TraceIdRatioBased(sample_ratio)),
+    )
+    _provider.add_span_processor(BatchSpanProcessor(span_exporter))
+    _tracer = _provider.get_tracer("smartsdlc")
+    logger.info("Tracing on: %s exporter, sample ratio %s", exporter, sample_ratio)
+
+
+def shutdown():
+    """Flush pending spans and stop the exporter"""
+    global _tracer, _provider
+    if _provider is not None:
+        _provider.shutdown()
+    _tracer = None
+    _provider = None
+
+
+def _unsampled_parent() -> bool:
+    # Children of a request that was not sampled would not be recorded either:
+    # skip creating them so unsampled requests stay close to free
+    from opentelemetry import trace
+
+    current = trace.get_current_span()
+    return current.get_span_context().is_valid and not current.is_recording()
+
+
+def span(name: str, attributes: Optional[dict] = None, client: bool = False):
+    """Context manager running its block in a child span of the current one (a no-op with tracing off)"""
+    if _tracer is None or _unsampled_parent():
+        return nullcontext()
+    from opentelemetry.trace import SpanKind
+
+    return _tracer.start_as_current_span(name, kind=SpanKind.CLIENT if client else SpanKind.INTERNAL, attributes=attributes)
+
+
+def start_span(name: str, attributes: Optional[dict] = None, client: bool = False):
+    """
+    Start a child span of the current one without making it current, for work
+    that outlives the block it starts in (e.g. a streamed reply); the caller
+    ends it. None with tracing off or an unsampled parent.
+    """
+    if _tracer is None or _unsampled_parent():
+        return None
+    from opentelemetry.trace import SpanKind
+
+    return _tracer.start_span(name, kind=SpanKind.CLIENT if client else SpanKind.INTERNAL, attributes=attributes)
+
+
+def end_span(target, attributes: Optional[dict] = None):
+    """Annotate and end a span from start_span()"""
+    if target is None:
+        return
+    if attributes:
+        set_attributes(attributes, target)
+    target.end()
+
+
+def set_attributes(attributes: dict, target=None):
+    """Annotate `target` (default: the current span) if it is being recorded"""
+    if _tracer is None:
+        return
+    from opentelemetry import trace
+
+    target = target if target is not None else trace.get_current_span()
+    if target.is_recording():
+        target.set_attributes({key: value for key, value in attributes.items() if value is not None})
+
+
+def inject(headers: dict, target=None) -> dict:
+    """Add the W3C `traceparent` of `target` (default: the current span) to outgoing headers"""
+    if _tracer is None:
+        return headers
+    from opentelemetry import trace
+    from opentelemetry.propagate import inject as inject_context
+
+    context = trace.set_span_in_context(target) if target is not None else None
+    inject_context(headers, context=context)
+    return headers
+
+
+class TracingMiddleware:
+    """
+    ASGI middleware opening a server span per HTTP request, continuing the
+    trace of an incoming W3C `traceparent` header. The span is named after the
+    route template once routing is done, and sampled traces report their id in
+    `X-Trace-Id`. Must run inside RequestContextMiddleware.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or _tracer is None:
+            await self.app(scope, receive, send)
+            return
+
+        from opentelemetry.propagate import extract
+        from opentelemetry.trace import SpanKind, Status, StatusCode
+
+        # Imported here: request_context reports its stages through this module
+        from services.request_context import set_response_header
+
+        carrier = {key.decode("latin-1").lower(): value.decode("latin-1") for key, value in scope.get("headers", [])}
+        method = scope["method"]
+        status = {"code": None}
+
+        async def send_with_status(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        with _tracer.start_as_current_span(
+            method,
+            context=extract(carrier),
+            kind=SpanKind.SERVER,
+            attributes={"http.request.method": method, "url.path": scope["path"]},
+        ) as server_span:
+            context = server_span.get_span_context()
+            if context.trace_flags.sampled:
+                set_response_header("X-Trace-Id", format(context.trace_id, "032x"))
+            try:
+                await self.app(scope, receive, send_with_status)
+            finally:
+                route = getattr(scope.get("route"), "path", None)
+                if route:
+                    server_span.update_name(f"{method} {route}")
+                    server_span.set_attribute("http.route", route)
+                if status["code"] is not None:
+                    server_span.set_attribute("http.response.status_code", status["code"])
+                    if status["code"] >= 500:
+                        server_span.set_status(Status(StatusCode.ERROR))
@@ -0,0 +1,174 @@
+import asyncio
+import hashlib
+import os
+import tempfile
+from typing import Optional, Union
+
+from fastapi import HTTPException, Request
+from python_multipart.exceptions import FormParserError
+from python_multipart.multipart import MultipartParser, parse_options_header
+
+from config import UPLOAD_MAX_MB, UPLOAD_SPOOL_KB, UPLOAD_TMP_DIR
+
+# Room for the multipart boundaries and part headers around the file itself
+MULTIPART_OVERHEAD = 64 * 1024
+
+# OpenAPI description of a multipart body with one `file` field, for routes reading it with receive_upload()
+FILE_UPLOAD_OPENAPI = {
+    "requestBody": {
+        "required": True,
+        "content": {
+            "multipart/form-data": {
+                "schema": {
+                    "type": "object",
+                    "required": ["file"],
+                    "properties": {"file": {"type": "string", "format": "binary"}},
+                }
+            }
+        },
+    }
+}
+
+
+def too_large(max_bytes: int) -> HTTPException:
+    return HTTPException(status_code=413, detail=f"File too large, the limit is {max_bytes / 2 ** 20:g} MB")
+
+
+class SpooledUpload:
+    """
+    An uploaded file as it arrives: hashed and size-checked chunk by chunk,
+    kept in memory while small and moved to a temp file on disk past
+    `spool_bytes`, so a large document never sits in memory whole.
+    """
+
+    def __init__(
+        self,
+        filename: str,
+        max_bytes: int = int(UPLOAD_MAX_MB * 2 ** 20),
+        spool_bytes: int = UPLOAD_SPOOL_KB * 1024,
+        directory: Optional[str] = UPLOAD_TMP_DIR,
+    ):
+        self.filename = filename
+        self.max_bytes = max_bytes
+        self.spool_bytes = spool_bytes
+        self.directory = directory
+        self.size = 0
+        self.path: Optional[str] = None
+        self._hash = hashlib.sha256()
+        self._buffer = bytearray()
+        self._file = None
+
+    async def write(self, data: bytes):
+        self.size += len(data)
+        if self.size > self.max_bytes:
+            raise too_large(self.max_bytes)
+        self._hash.update(data)
+        if self._file is None:
+            if len(self._buffer) + len(data) <= self.spool_bytes:
+                self._buffer += data
+                return
+            self._file = tempfile.NamedTemporaryFile(prefix="upload-", suffix=".pdf", dir=self.directory, delete=False)
+            self.path = self._file.name
+            data = bytes(self._buffer) + data
+            self._buffer = bytearray()
+        await asyncio.to_thread(self._file.write, data)
+
+    async def finish(self):
+        """Flush the temp file once the whole upload is in"""
+        if self._file is not None:
+            await asyncio.to_thread(self._file.close)
+
+    @property
+    def sha256(self) -> str:
+        return self._hash.hexdigest()
+
+    def source(self) -> Union[bytes, str]:
+        """The content for PyMuPDF: the bytes of a small upload or the path of the temp file"""
+        return self.path if self.path is not None else bytes(self._buffer)
+
+    def close(self):
+        """Delete the temp file, if any"""
+        if self._file is not None:
+            self._file.close()
+        if self.path is not None:
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+            self.path = None
+        self._buffer = bytearray()
+
+
+async def receive_upload(request: Request, field: str = "file", **limits) -> SpooledUpload:
+    """
+    Stream the file in multipart field `field` into a SpooledUpload, refusing
+    it with 413 as soon as it passes the size cap. Other fields are skipped.
+    """
+    content_type, params = parse_options_header(request.headers.get("content-type", ""))
+    if content_type != b"multipart/form-data" or b"boundary" not in params:
+        raise HTTPException(status_code=400, detail=f"Expected a multipart/form-data upload with a '{field}' field")
+    state = {"headers": {}, "name": b"", "value": b"", "upload": None, "target": False, "done": False}
+    pending = []
+
+    def on_part_begin():
+        state["headers"] = {}
+
+    def on_header_field(data, start, end):
+        state["name"] += data[start:end]
+
+    def on_header_value(data, start, end):
+        state["value"] += data[start:end]
+
+    def on_header_end():
+        state["headers"][state["name"].lower()] = state["value"]
+        state["name"], state["value"] = b"", b""
+
+    def on_headers_finished():
+        _, options = parse_options_header(state["headers"].get(b"content-disposition", b""))
+        state["target"] = (
+            state["upload"] is None and options.get(b"name") == field.encode() and b"filename" in options
+        )
+        if state["target"]:
+            state["upload"] = SpooledUpload(options[b"filename"].decode("utf-8", "replace"), **limits)
+
+    def on_part_data(data, start, end):
+        if state["target"]:
+            pending.append(data[start:end])
+
+    def on_part_end():
+        if state["target"]:
+            state["done"] = True
+        state["target"] = False
+
+    parser = MultipartParser(params[b"boundary"], {
+        "on_part_begin": on_part_begin,
+        "on_header_field": on_header_field,
+        "on_header_value": on_header_value,
+        "on_header_end": on_header_end,
+        "on_headers_finished": on_headers_finished,
+        "on_part_data": on_part_data,
+        "on_part_end": on_part_end,
+    })
+    try:
+        declared = request.headers.get("content-length")
+        max_bytes = limits.get("max_bytes", int(UPLOAD_MAX_MB * 2 ** 20))
+        if declared and declared.isdigit() and int(declared) > max_bytes + MULTIPART_OVERHEAD:
+            raise too_large(max_bytes)
+        async for chunk in request.stream():
+            parser.write(chunk)
+            for data in pending:
+                await state["upload"].write(data)
+            pending.clear()
+        parser.finalize()
+        if not state["done"]:
+            raise HTTPException(status_code=400, detail=f"No file in the '{field}' field of the upload")
+        await state["upload"].finish()
+    except FormParserError:
+        if state["upload"] is not None:
+            state["upload"].close()
+        raise HTTPException(status_code=400, detail="Invalid multipart data")
+    except BaseException:
+        if state["upload"] is not None:
+            state["upload"].close()
+        raise
+    return state["upload"]
@@ -0,0 +1,192 @@
+import asyncio
+import json
+import time
+from typing import AsyncIterator, Awaitable, Callable
+
+from fastapi import HTTPException, WebSocket, WebSocketDisconnect
+from starlette.websockets import WebSocketState
+
+from config import (
+    WS_PING_INTERVAL,
+    WS_IDLE_TIMEOUT,
+    WS_SEND_QUEUE_SIZE,
+    WS_SEND_TIMEOUT,
+    WS_MAX_CONVERSATIONS,
+    WS_MAX_MESSAGE_CHARS,
+)
+from services.request_context import RequestContext, use_context
+
+# Opens the upstream chunk stream for one validated "chat" frame
+StreamOpener = Callable[[dict], Awaitable[AsyncIterator[dict]]]
+
+
+class SlowClient(Exception):
+    """The client stopped reading and its outgoing buffer stayed full"""
+
+
+class ChatSocketSession:
+    """
+    One /ws/chat connection: several concurrent conversations streamed over a
+    single WebSocket.
+
+    Outgoing frames go through a bounded queue drained by one sender task. A
+    conversation that cannot enqueue within `WS_SEND_TIMEOUT` means the client is
+    not reading, so the connection is closed instead of buffering without bound;
+    while the queue is merely full, the conversation stops reading from upstream.
+    The server pings every `WS_PING_INTERVAL` seconds and drops clients that stay
+    silent for `WS_IDLE_TIMEOUT`.
+    """
+
+    def __init__(self, websocket: WebSocket, open_stream: StreamOpener):
+        self.websocket = websocket
+        self.open_stream = open_stream
+        self._outgoing: asyncio.Queue = asyncio.Queue(maxsize=WS_SEND_QUEUE_SIZE)
+        self._conversations = {}
+        self._last_seen = time.monotonic()
+        self._closing = asyncio.Event()
+        self._close_code = 1000
+
+    async def run(self):
+        await self.websocket.accept()
+        sender = asyncio.create_task(self._send_loop())
+        heartbeat = asyncio.create_task(self._heartbeat_loop())
+        receiver = asyncio.create_task(self._receive_loop())
+        closing = asyncio.create_task(self._closing.wait())
+        try:
+            await asyncio.wait([sender, heartbeat, receiver, closing], return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            self._closing.set()
+            tasks = [sender, heartbeat, receiver, closing, *self._conversations.values()]
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            if self.websocket.client_state == WebSocketState.CONNECTED:
+                try:
+                    await self.websocket.close(code=self._close_code)
+                except (RuntimeError, WebSocketDisconnect):
+                    # The client went away in the meantime
+                    pass
+
+    async def _send(self, frame: dict):
+        try:
+            await asyncio.wait_for(self._outgoing.put(frame), WS_SEND_TIMEOUT)
+        except asyncio.TimeoutError:
+            # 1013: try again later
+            self._close_code = 1013
+            self._closing.set()
+            raise SlowClient()
+
+    async def _send_error(self, frame: dict):
+        """Send an error frame from an exception handler, where SlowClient must not escape"""
+        try:
+            await self._send(frame)
+        except SlowClient:
+            # _send() has already started the 1013 close, as for any other frame
+            pass
+
+    async def _send_loop(self):
+        while True:
+            frame = await self._outgoing.get()
+            await self.websocket.send_json(frame)
+
+    async def _heartbeat_loop(self):
+        while True:
+            await asyncio.sleep(WS_PING_INTERVAL)
+            if time.monotonic() - self._last_seen > WS_IDLE_TIMEOUT:
+                # 1001: going away
+                self._close_code = 1001
+                self._closing.set()
+                return
+            # A full queue already means a stalled client, which _send deals with
+            if not self._outgoing.full():
+                self._outgoing.put_nowait({"type": "ping"})
+
+    async def _receive_loop(self):
+        try:
+            while True:
+                text = await self.websocket.receive_text()
+                self._last_seen = time.monotonic()
+                try:
+                    message = json.loads(text)
+                except ValueError:
+                    message = None
+                await self._handle(message)
+        except (WebSocketDisconnect, RuntimeError, SlowClient):
+            pass
+
+    async def _handle(self, message):
+        if not isinstance(message, dict):
+            await self._send({"type": "error", "detail": "Frames must be JSON objects"})
+            return
+
+        kind = message.get("type")
+        conversation_id = str(message.get("conversation_id", ""))
+        if kind == "pong":
+            return
+        if kind == "ping":
+            await self._send({"type": "pong"})
+            return
+        if kind == "cancel":
+            task = self._conversations.get(conversation_id)
+            if task is not None:
+                task.cancel()
+            return
+        if kind != "chat":
+            await self._send({"type": "error", "conversation_id": conversation_id, "detail": f"Unknown frame type: {kind}"})
+            return
+
+        text = message.get("message")
+        if not conversation_id or not isinstance(text, str) or not text.strip():
+            await self._send({"type": "error", "conversation_id": conversation_id, "detail": "A chat frame needs a conversation_id and a non-empty message"})
+        elif len(text) > WS_MAX_MESSAGE_CHARS:
+            await self._send({"type": "error", "conversation_id": conversation_id, "detail": f"Message is longer than {WS_MAX_MESSAGE_CHARS} characters"})
+        elif conversation_id in self._conversations:
+            await self._send({"type": "error", "conversation_id": conversation_id, "detail": "This conversation is still answering the previous message"})
+        elif len(self._conversations) >= WS_MAX_CONVERSATIONS:
+            await self._send({"type": "error", "conversation_id": conversation_id, "detail": f"At most {WS_MAX_CONVERSATIONS} concurrent conversations per connection"})
+        else:
+            task = asyncio.create_task(self._converse(conversation_id, message))
+            self._conversations[conversation_id] = task
+            task.add_done_callback(lambda _, conversation_id=conversation_id: self._conversations.pop(conversation_id, None))
+
+    async def _converse(self, conversation_id: str, message: dict):
+        # Collects the stage timings of this conversation's upstream call
+        context = use_context(RequestContext())
+        start_time = time.time()
+        usage = {}
+        finish_reason = None
+        try:
+            chunks = await self.open_stream(message)
+            try:
+                async for chunk in chunks:
+                    if chunk.get("usage"):
+                        usage = chunk["usage"]
+                    for choice in chunk.get("choices", []):
+                        content = (choice.get("delta") or {}).get("content")
+                        if content:
+                            await self._send({"type": "token", "conversation_id": conversation_id, "content": content})
+                        if choice.get("finish_reason"):
+                            finish_reason = choice["finish_reason"]
+            finally:
+                await chunks.aclose()
+            await self._send({
+                "type": "done",
+                "conversation_id": conversation_id,
+                "processing_time": time.time() - start_time,
+                "usage": usage,
+                "finish_reason": finish_reason,
+                "timings": context.timings_ms(),
+            })
+        except asyncio.CancelledError:
+            if not self._closing.is_set() and not self._outgoing.full():
+                self._outgoing.put_nowait({"type": "cancelled", "conversation_id": conversation_id})
+            raise
+        except SlowClient:
+            pass
+        except HTTPException as e:
+            frame = {"type": "error", "conversation_id": conversation_id, "status": e.status_code, "detail": e.detail}
+            if e.headers and "Retry-After" in e.headers:
+                frame["retry_after"] = int(e.headers["Retry-After"])
+            await self._send_error(frame)
+        except Exception as e:
+            await self._send_error({"type": "error", "conversation_id": conversation_id, "detail": str(e)})
@@ -0,0 +1,448 @@
+"""
+Scenario-driven, open-loop load generator for the SmartSDLC backend.
+
+Requests arrive on a schedule (Poisson or constant rate) that does not depend on
+how fast the server answers, so a slow server builds up a backlog instead of
+quietly lowering the offered load. Latency is measured from each request's
+scheduled arrival time, which keeps queueing delay inside the numbers.
+
+    python tools/loadtest.py --scenario mixed --rate 20 --duration 60 --out runs/before.json
+    python tools/loadtest.py --scenario my_scenario.json --server-pid $(pgrep -f "uvicorn main:app")
+    python tools/loadtest.py --compare runs/before.json runs/after.json
+
+A scenario is a built-in name (see SCENARIOS) or a JSON file with the same keys:
+
+    {
+      "rate": 20, "duration": 60, "warmup": 5, "arrival": "poisson",
+      "mix": {"chat": 40, "generate": 15, "fix_bug": 15, "generate_tests": 10,
+              "check_tests": 10, "classify_pdf": 5, "feedback": 5},
+      "sizes": {"default": "medium", "classify_pdf": "small"},
+      "cache_bypass": true
+    }
+
+Pair it with tools/mock_watsonx.py to measure the backend without real upstream
+quota. Note that `feedback` traffic really appends to the feedback store.
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import platform
+import random
+import sys
+import time
+from datetime import datetime, timezone
+
+import httpx
+
+SCENARIOS = {
+    "mixed": {
+        "rate": 10, "duration": 60, "warmup": 5, "arrival": "poisson",
+        "mix": {"chat": 40, "generate": 15, "fix_bug": 15, "generate_tests": 10, "check_tests": 10, "classify_pdf": 5, "feedback": 5},
+        "sizes": {"default": "medium"},
+        "cache_bypass": True,
+    },
+    "chat-heavy": {
+        "rate": 30, "duration": 60, "warmup": 5, "arrival": "poisson",
+        "mix": {"chat": 90, "generate": 5, "feedback": 5},
+        "sizes": {"default": "small"},
+        "cache_bypass": True,
+    },
+    "code-heavy": {
+        "rate": 10, "duration": 60, "warmup": 5, "arrival": "poisson",
+        "mix": {"generate": 25, "fix_bug": 30, "generate_tests": 25, "check_tests": 20},
+        "sizes": {"default": "large"},
+        "cache_bypass": True,
+    },
+    "pdf-heavy": {
+        "rate": 2, "duration": 60, "warmup": 5, "arrival": "poisson",
+        "mix": {"classify_pdf": 80, "chat": 20},
+        "sizes": {"default": "medium", "classify_pdf": "large"},
+        "cache_bypass": True,
+    },
+}
+
+# Payload scale per size class: lines of code, words of prose, PDF pages
+SIZES = {
+    "small": {"code_lines": 10, "words": 15, "pages": 1},
+    "medium": {"code_lines": 60, "words": 80, "pages": 5},
+    "large": {"code_lines": 300, "words": 400, "pages": 30},
+}
+
+_WORDS = (
+    "system user requirement design module interface test deploy release service database cache "
+    "request response latency error validate store configure monitor review document build"
+).split()
+
+
+class Payloads:
+    """Generates request bodies of a given size class; every body is unique so caches see misses"""
+
+    def __init__(self, rng: random.Random):
+        self.rng = rng
+        self._pdfs = {}
+
+    def words(self, count: int) -> str:
+        return " ".join(self.rng.choice(_WORDS) for _ in range(count))
+
+    def code(self, lines: int, buggy: bool = False) -> str:
+        out = [f"# load test {self.rng.getrandbits(48):x}"]
+        for index in range(max(lines // 4, 1)):
+            out.append(f"def step_{index}(items, factor={index + 1}):")
+            out.append("    total = 0")
+            out.append("    for item in items:\n        total += item * factor")
+            out.append("    return total" if not buggy or index % 3 else "    return totl")
+        return "\n".join(out[:lines + 1])
+
+    def tests(self, lines: int) -> str:
+        out = ["import pytest"]
+        for index in range(max(lines // 3, 1)):
+            out.append(f"def test_step_{index}():\n    assert step_{index}([1, 2]) == {3 * (index + 1)}")
+        return "\n".join(out)
+
+    def pdf(self, pages: int) -> bytes:
+        # Building PDFs is slow: keep one document per size, made unique by a comment-like trailer
+        if pages not in self._pdfs:
+            import fitz  # PyMuPDF, already a backend dependency
+
+            document = fitz.open()
+            for _ in range(pages):
+                page = document.new_page()
+                sentences = [f"The {self.words(6)}." for _ in range(30)]
+                page.insert_textbox(fitz.Rect(50, 50, 550, 800), " ".join(sentences), fontsize=9)
+            self._pdfs[pages] = document.tobytes()
+            document.close()
+        return self._pdfs[pages] + f"\n%{self.rng.getrandbits(64):x}\n".encode()
+
+    def build(self, endpoint: str, size: str) -> dict:
+        scale = SIZES[size]
+        nonce = f"{self.rng.getrandbits(48):x}"
+        if endpoint == "chat":
+            return {"json": {"message": f"[{nonce}] {self.words(scale['words'])}?"}}
+        if endpoint == "generate":
+            return {"json": {"prompt": f"[{nonce}] Write a python function that {self.words(scale['words'])}"}}
+        if endpoint == "fix_bug":
+            return {"json": {"code": self.code(scale["code_lines"], buggy=True), "programming_language": "python"}}
+        if endpoint == "generate_tests":
+            return {"json": {"code": self.code(scale["code_lines"]), "programming_language": "python", "test_framework": "pytest"}}
+        if endpoint == "check_tests":
+            return {"json": {
+                "code": self.code(scale["code_lines"]),
+                "test_cases": self.tests(scale["code_lines"]),
+                "programming_language": "python",
+                "test_framework": "pytest",
+            }}
+        if endpoint == "classify_pdf":
+            return {"files": {"file": (f"load-{nonce}.pdf", self.pdf(scale["pages"]), "application/pdf")}}
+        if endpoint == "feedback":
+            return {"json": {"name": f"loadtest-{nonce}", "feedback": self.words(scale["words"]), "rating": self.rng.randint(1, 5)}}
+        raise ValueError(f"Unknown endpoint: {endpoint}")
+
+
+ENDPOINTS = {
+    "chat": "/chat/",
+    "generate": "/generate-code/",
+    "fix_bug": "/fix-bug/",
+    "generate_tests": "/generate-test-cases/",
+    "check_tests": "/check-test-cases/",
+    "classify_pdf": "/classify-pdf-sdlc/",
+    "feedback": "/api/feedback",
+}
+
+
+def percentile(sorted_values: list, pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    rank = (len(sorted_values) - 1) * pct / 100
+    low, high = math.floor(rank), math.ceil(rank)
+    return sorted_values[low] + (sorted_values[high] - sorted_values[low]) * (rank - low)
+
+
+def summarize(latencies: list, elapsed: float) -> dict:
+    values = sorted(latencies)
+    return {
+        "throughput_rps": round(len(values) / elapsed, 3) if elapsed else 0.0,
+        "latency_ms": {
+            "mean": round(sum(values) / len(values) * 1000, 2) if values else 0.0,
+            "p50": round(percentile(values, 50) * 1000, 2),
+            "p95": round(percentile(values, 95) * 1000, 2),
+            "p99": round(percentile(values, 99) * 1000, 2),
+            "max": round(values[-1] * 1000, 2) if values else 0.0,
+        },
+    }
+
+
+class ProcessSampler:
+    """Samples CPU and RSS of the server process (psutil if installed, /proc otherwise)"""
+
+    def __init__(self, pid: int, interval: float = 1.0):
+        self.pid = pid
+        self.interval = interval
+        self.samples = []
+        try:
+            import psutil
+            self._process = psutil.Process(pid)
+        except ImportError:
+            self._process = None
+
+    def _read(self):
+        """(cpu seconds, rss bytes, threads, open fds)"""
+        if self._process is not None:
+            cpu = self._process.cpu_times()
+            return cpu.user + cpu.system, self._process.memory_info().rss, self._process.num_threads(), self._process.num_fds()
+        with open(f"/proc/{self.pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        ticks = os.sysconf("SC_CLK_TCK")
+        cpu = (int(fields[11]) + int(fields[12])) / ticks
+        rss = int(fields[21]) * os.sysconf("SC_PAGE_SIZE")
+        return cpu, rss, int(fields[17]), len(os.listdir(f"/proc/{self.pid}/fd"))
+
+    async def run(self, stop: asyncio.Event):
+        previous = None
+        while not stop.is_set():
+            now = time.perf_counter()
+            try:
+                cpu, rss, threads, fds = self._read()
+            except (OSError, IndexError, ValueError):
+                return
+            if previous is not None:
+                cpu_percent = (cpu - previous[1]) / (now - previous[0]) * 100
+                self.samples.append({"t": now, "cpu_percent": cpu_percent, "rss": rss, "threads": threads, "fds": fds})
+            previous = (now, cpu)
+            try:
+                await asyncio.wait_for(stop.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+
+    def summary(self) -> dict:
+        if not self.samples:
+            return {}
+        cpu = sorted(s["cpu_percent"] for s in self.samples)
+        return {
+            "pid": self.pid,
+            "samples": len(self.samples),
+            "cpu_percent": {"mean": round(sum(cpu) / len(cpu), 1), "p95": round(percentile(cpu, 95), 1), "max": round(cpu[-1], 1)},
+            "rss_mb": {
+                "start": round(self.samples[0]["rss"] / 2 ** 20, 1),
+                "end": round(self.samples[-1]["rss"] / 2 ** 20, 1),
+                "max": round(max(s["rss"] for s in self.samples) / 2 ** 20, 1),
+            },
+            "threads_max": max(s["threads"] for s in self.samples),
+            "fds_max": max(s["fds"] for s in self.samples),
+        }
+
+
+async def snapshot_ops(client: httpx.AsyncClient) -> dict:
+    """Backend-side counters (gateway, pool, cache, coalescing, event loop lag) for the report"""
+    result = {}
+    for name in ("gateway", "http-pool", "cache", "coalescing", "event-loop"):
+        try:
+            response = await client.get(f"/ops/{name}", timeout=10)
+            if response.status_code == 200:
+                result[name] = response.json()
+        except httpx.HTTPError:
+            pass
+    return result
+
+
+async def run_scenario(base_url: str, scenario: dict, seed: int, max_outstanding: int, sampler=None) -> dict:
+    rng = random.Random(seed)
+    payloads = Payloads(rng)
+    mix = {name: weight for name, weight in scenario["mix"].items() if weight > 0}
+    unknown = set(mix) - set(ENDPOINTS)
+    if unknown:
+        raise ValueError(f"Unknown endpoints in mix: {', '.join(sorted(unknown))}")
+    names, weights = list(mix), list(mix.values())
+    sizes = scenario.get("sizes", {})
+    headers = {"X-Cache-Bypass": "1"} if scenario.get("cache_bypass") else {}
+    rate, duration, warmup = float(scenario["rate"]), float(scenario["duration"]), float(scenario.get("warmup", 0))
+
+    # Payloads are generated up front so building them never delays an arrival
+    plan, t = [], 0.0
+    while True:
+        t += rng.expovariate(rate) if scenario.get("arrival", "poisson") == "poisson" else 1 / rate
+        if t >= warmup + duration:
+            break
+        endpoint = rng.choices(names, weights)[0]
+        plan.append((t, endpoint, payloads.build(endpoint, sizes.get(endpoint, sizes.get("default", "medium")))))
+
+    results = []  # (endpoint, scheduled offset, latency, status, error, bytes)
+    outstanding = 0
+    dropped = {}
+    max_lag = 0.0
+    limits = httpx.Limits(max_connections=max_outstanding, max_keepalive_connections=max_outstanding)
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=httpx.Timeout(300, connect=10), limits=limits) as client:
+        ops_before = await snapshot_ops(client)
+
+        async def fire(offset: float, scheduled: float, endpoint: str, payload: dict):
+            nonlocal outstanding
+            try:
+                response = await client.post(ENDPOINTS[endpoint], headers=headers, **payload)
+                status, error, size = response.status_code, None, len(response.content)
+                # Routers report some upstream failures as a 200 with an "error" key
+                if status == 200 and response.headers.get("content-type", "").startswith("application/json"):
+                    body = response.json()
+                    if isinstance(body, dict) and body.get("error"):
+                        error = "error-body"
+            except httpx.HTTPError as e:
+                status, error, size = None, type(e).__name__, 0
+            finally:
+                outstanding -= 1
+            results.append((endpoint, offset, time.perf_counter() - scheduled, status, error, size))
+
+        stop = asyncio.Event()
+        sampler_task = asyncio.create_task(sampler.run(stop)) if sampler else None
+        tasks = []
+        started = time.perf_counter()
+        for offset, endpoint, payload in plan:
+            scheduled = started + offset
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            max_lag = max(max_lag, time.perf_counter() - scheduled)
+            if outstanding >= max_outstanding:
+                # Client-side safety valve: counted, never silently waited on
+                dropped[endpoint] = dropped.get(endpoint, 0) + 1
+                continue
+            outstanding += 1
+            tasks.append(asyncio.create_task(fire(offset, scheduled, endpoint, payload)))
+        await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - started
+        stop.set()
+        if sampler_task:
+            await sampler_task
+
+        ops_after = await snapshot_ops(client)
+
+    measured = [r for r in results if r[1] >= warmup]
+    endpoints = {}
+    for name in names:
+        rows = [r for r in measured if r[0] == name]
+        ok = [r[2] for r in rows if r[3] is not None and r[3] < 400 and r[4] is None]
+        statuses = {}
+        for r in rows:
+            key = str(r[3]) if r[4] is None else (f"{r[3]}:{r[4]}" if r[3] else r[4])
+            statuses[key] = statuses.get(key, 0) + 1
+        endpoints[name] = {
+            "path": ENDPOINTS[name],
+            "requests": len(rows),
+            "ok": len(ok),
+            "error_rate": round(1 - len(ok) / len(rows), 4) if rows else 0.0,
+            "statuses": statuses,
+            "dropped": dropped.get(name, 0),
+            "response_bytes_mean": round(sum(r[5] for r in rows) / len(rows)) if rows else 0,
+            **summarize(ok, duration),
+        }
+    all_ok = [r[2] for r in measured if r[3] is not None and r[3] < 400 and r[4] is None]
+    return {
+        "overall": {
+            "offered_rps": rate,
+            "requests": len(measured),
+            "ok": len(all_ok),
+            "error_rate": round(1 - len(all_ok) / len(measured), 4) if measured else 0.0,
+            "dropped": sum(dropped.values()),
+            "elapsed_s": round(elapsed, 2),
+            "max_schedule_lag_ms": round(max_lag * 1000, 2),
+            **summarize(all_ok, duration),
+        },
+        "endpoints": endpoints,
+        "server": sampler.summary() if sampler else {},
+        "ops": {"before": ops_before, "after": ops_after},
+    }
+
+
+def load_scenario(value: str) -> dict:
+    if value in SCENARIOS:
+        return dict(SCENARIOS[value], name=value)
+    with open(value, encoding="utf-8") as f:
+        scenario = json.load(f)
+    scenario.setdefault("name", os.path.splitext(os.path.basename(value))[0])
+    return scenario
+
+
+def compare(before_path: str, after_path: str):
+    """Print per-endpoint deltas between two saved runs"""
+    with open(before_path, encoding="utf-8") as f:
+        before = json.load(f)
+    with open(after_path, encoding="utf-8") as f:
+        after = json.load(f)
+
+    def row(name, old, new):
+        cells = [f"{name:<16}"]
+        for key in ("p50", "p95", "p99"):
+            o, n = old["latency_ms"][key], new["latency_ms"][key]
+            change = f"{(n - o) / o * 100:+.0f}%" if o else "n/a"
+            cells.append(f"{key} {o:>9.1f} -> {n:>9.1f} ({change:>5})")
+        cells.append(f"rps {old['throughput_rps']:.2f} -> {new['throughput_rps']:.2f}")
+        cells.append(f"err {old['error_rate']:.2%} -> {new['error_rate']:.2%}")
+        print("  ".join(cells))
+
+    row("overall", before["results"]["overall"], after["results"]["overall"])
+    for name, new in after["results"]["endpoints"].items():
+        old = before["results"]["endpoints"].get(name)
+        if old:
+            row(name, old, new)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Open-loop load benchmark for the SmartSDLC backend")
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+    parser.add_argument("--scenario", default="mixed", help=f"one of {', '.join(SCENARIOS)} or a JSON scenario file")
+    parser.add_argument("--rate", type=float, help="override the scenario's arrivals per second")
+    parser.add_argument("--duration", type=float, help="override the measured duration in seconds")
+    parser.add_argument("--warmup", type=float, help="override the warm-up seconds excluded from the results")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--max-outstanding", type=int, default=1000, help="requests in flight before arrivals are dropped")
+    parser.add_argument("--server-pid", type=int, help="backend process to sample for CPU and memory")
+    parser.add_argument("--out", help="write the JSON report here")
+    parser.add_argument("--max-loop-lag-ms", type=float, help="fail if the backend's p99 event loop lag after the run exceeds this")
+    parser.add_argument("--compare", nargs=2, metavar=("BEFORE", "AFTER"), help="compare two saved reports and exit")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    scenario = load_scenario(args.scenario)
+    for key in ("rate", "duration", "warmup"):
+        if getattr(args, key) is not None:
+            scenario[key] = getattr(args, key)
+
+    sampler = ProcessSampler(args.server_pid) if args.server_pid else None
+    results = asyncio.run(run_scenario(args.base_url, scenario, args.seed, args.max_outstanding, sampler))
+    report = {
+        "started_at": datetime.now(timezone.utc).isoformat(),
+        "base_url": args.base_url,
+        "seed": args.seed,
+        "scenario": scenario,
+        "host": {"python": sys.version.split()[0], "platform": platform.platform(), "cpus": os.cpu_count()},
+        "results": results,
+    }
+
+    overall = results["overall"]
+    print(f"{scenario['name']}: {overall['requests']} requests, {overall['throughput_rps']} ok/s, "
+          f"error rate {overall['error_rate']:.2%}, p50/p95/p99 {overall['latency_ms']['p50']}/"
+          f"{overall['latency_ms']['p95']}/{overall['latency_ms']['p99']} ms")
+    for name, stats in results["endpoints"].items():
+        print(f"  {name:<16} n={stats['requests']:<6} err={stats['error_rate']:.2%}  "
+              f"p50={stats['latency_ms']['p50']:>8} p95={stats['latency_ms']['p95']:>8} p99={stats['latency_ms']['p99']:>8} ms")
+
+    if args.out:
+        os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"Report written to {args.out}")
+
+    loop = results["ops"]["after"].get("event-loop")
+    if loop:
+        blocks = loop["blocks"] - results["ops"]["before"].get("event-loop", {}).get("blocks", 0)
+        print(f"event loop lag p50/p99/max {loop['lag_ms']['p50']}/{loop['lag_ms']['p99']}/{loop['lag_ms']['max']} ms, "
+              f"{blocks} blocks over {loop['threshold_ms']:.0f} ms")
+        if args.max_loop_lag_ms is not None and loop["lag_ms"]["p99"] > args.max_loop_lag_ms:
+            sys.exit(f"Event loop p99 lag {loop['lag_ms']['p99']} ms exceeds {args.max_loop_lag_ms} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,367 @@
+"""
+Microbenchmarks for the CPU-bound local paths of the backend and the frontend.
+
+Each case runs a real function from the tree against a generated corpus and
+records its wall time (median and min over adaptive repeats) and its peak Python
+heap (tracemalloc, measured in a separate run so tracing does not skew timing):
+
+- pdf_extract              routers.pdf.extract_text_from_pdf, PDFs of 1-2000 pages
+- pdf_extract_pool         services.pdf_extraction.PDFExtractor, the route's worker pool
+                           (PDF_EXTRACTION_WORKERS, PDF_PAGES_PER_TASK), same PDFs;
+                           compare with pdf_extract for the scaling with cores. Its
+                           peak memory only covers this process, not the workers
+- parse_test_analysis      routers.test.parse_test_analysis, structured / headings-only /
+                           unformatted replies of growing size
+- feedback_load / _save / _submit
+                           routers.feedback load/save, and the load + append + save cycle
+                           of one POST /api/feedback, on stores of up to 10^5 entries
+- parse_classified_sentences
+                           Frontend/pages/Upload_and_Classify.py, classifier outputs of up
+                           to 10^5 lines
+
+    python tools/microbench.py --quick                      # small corpora, ~1 minute
+    python tools/microbench.py --save-baseline tools/microbench_baseline.json
+    python tools/microbench.py --baseline tools/microbench_baseline.json --threshold 0.25
+
+With a baseline the run exits with status 1 when a case's fastest run got slower (or used more
+memory) than the baseline by more than the threshold. Times are normalised by a
+fixed calibration loop so baselines survive moderate hardware differences.
+Generated corpora are cached in --data-dir. Memory held by native code
+(e.g. MuPDF's own buffers) is not visible to tracemalloc.
+"""
+import argparse
+import ast
+import asyncio
+import gc
+import json
+import os
+import platform
+import random
+import re
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BACKEND = os.path.join(ROOT, "backend")
+CLASSIFY_PAGE = os.path.join(ROOT, "Frontend", "pages", "Upload_and_Classify.py")
+
+PROFILES = {
+    "quick": {
+        "pdf_pages": [1, 50, 200],
+        "analysis_lines": [100, 2000, 20000],
+        "feedback_entries": [100, 1000, 10000],
+        "classified_lines": [100, 2000, 20000],
+    },
+    "full": {
+        "pdf_pages": [1, 100, 500, 2000],
+        "analysis_lines": [100, 2000, 20000, 100000],
+        "feedback_entries": [100, 1000, 10000, 100000],
+        "classified_lines": [100, 2000, 20000, 100000],
+    },
+}
+
+_WORDS = (
+    "the system shall validate every request before storing it in the database and the design "
+    "uses a layered architecture where each module exposes an interface that tests exercise "
+    "through mocks while deployment happens through a pipeline with automated release checks"
+).split()
+_PHASES = ["Requirements", "Design", "Development", "Testing", "Deployment", "General", "Other"]
+
+
+def sentence(rng: random.Random, words: int = 14) -> str:
+    return " ".join(rng.choice(_WORDS) for _ in range(words)).capitalize() + "."
+
+
+# ---------------------------------------------------------------- corpora
+
+class Corpora:
+    """Builds the benchmark inputs deterministically, caching the expensive ones on disk"""
+
+    def __init__(self, data_dir: str, seed: int = 7):
+        self.data_dir = data_dir
+        self.seed = seed
+        os.makedirs(data_dir, exist_ok=True)
+
+    def pdf(self, pages: int) -> bytes:
+        path = os.path.join(self.data_dir, f"corpus-{pages}p.pdf")
+        if not os.path.exists(path):
+            import fitz
+
+            rng = random.Random(self.seed + pages)
+            document = fitz.open()
+            for _ in range(pages):
+                page = document.new_page()
+                text = " ".join(sentence(rng) for _ in range(25))
+                page.insert_textbox(fitz.Rect(40, 40, 560, 800), text, fontsize=9)
+            document.save(path, garbage=3, deflate=True)
+            document.close()
+        with open(path, "rb") as f:
+            return f.read()
+
+    def analysis_reply(self, lines: int, shape: str) -> str:
+        """A check-test-cases model reply: "structured", "headings" or "unformatted\""""
+        rng = random.Random(self.seed + lines)
+        third = max(lines // 3, 1)
+
+        def body():
+            return "\n".join(
+                f"    assert step({rng.randint(0, 99)}) == {rng.randint(0, 99)}  # {sentence(rng, 6)}" if rng.random() < 0.5 else sentence(rng, 10)
+                for _ in range(third)
+            )
+
+        if shape == "structured":
+            return f"**TEST ANALYSIS:**\n{body()}\n\n**IMPROVED TESTS:**\n{body()}\n\n**COVERAGE SUGGESTIONS:**\n{body()}"
+        if shape == "headings":
+            return f"Current test analysis\n{body()}\nImproved tests\n{body()}\nCoverage suggestions\n{body()}"
+        # No markers at all: paragraphs only
+        return "\n\n".join(body() for _ in range(3)).replace("analysis", "review").replace("test", "check")
+
+    def feedback(self, entries: int) -> list:
+        rng = random.Random(self.seed + entries)
+        start = datetime(2025, 1, 1)
+        return [
+            {
+                "id": f"{rng.getrandbits(128):032x}",
+                "name": f"user {index}",
+                "feedback": sentence(rng, 20),
+                "rating": rng.randint(1, 5),
+                "timestamp": (start + timedelta(minutes=index)).isoformat(),
+            }
+            for index in range(entries)
+        ]
+
+    def classified(self, lines: int) -> str:
+        rng = random.Random(self.seed + lines)
+        out = []
+        for index in range(lines):
+            if rng.random() < 0.01:
+                out.append(sentence(rng, 8))  # commentary the parser cannot match
+            else:
+                prefix = f"{index + 1}. " if rng.random() < 0.5 else ""
+                out.append(f"{prefix}Sentence: {sentence(rng)} | Phase: {rng.choice(_PHASES)}")
+        return "\n".join(out)
+
+
+# ---------------------------------------------------------------- code under test
+
+def import_backend():
+    """Import the backend modules the way uvicorn does (backend/ on sys.path)"""
+    if BACKEND not in sys.path:
+        sys.path.insert(0, BACKEND)
+    from routers import feedback, pdf, test
+    from services import pdf_extraction
+
+    return pdf, pdf_extraction, test, feedback
+
+
+class _QuietStreamlit:
+    """Stands in for `st` so the page's parser can run outside Streamlit"""
+
+    def __init__(self):
+        self.messages = 0
+
+    def warning(self, *args, **kwargs):
+        self.messages += 1
+
+    error = warning
+
+
+def load_page_function(path: str, name: str):
+    """Compile one function out of a Streamlit page without running the page"""
+    with open(path, encoding="utf-8") as f:
+        tree = ast.parse(f.read(), filename=path)
+    node = next(n for n in tree.body if isinstance(n, ast.FunctionDef) and n.name == name)
+    namespace = {"re": re, "json": json, "st": _QuietStreamlit()}
+    exec(compile(ast.Module(body=[node], type_ignores=[]), path, "exec"), namespace)
+    return namespace[name]
+
+
+# ---------------------------------------------------------------- measurement
+
+def calibrate() -> float:
+    """Seconds for a fixed pure-Python workload, used to normalise timings across machines"""
+    def workload():
+        total = 0
+        parts = []
+        for index in range(200000):
+            total += index * index % 7
+            if index % 50 == 0:
+                parts.append(str(total))
+        return "".join(parts)
+
+    return min(_timed(workload) for _ in range(5))
+
+
+def _timed(fn) -> float:
+    started = time.perf_counter()
+    fn()
+    return time.perf_counter() - started
+
+
+def measure(fn, setup=None, min_time: float = 1.0, max_repeats: int = 50) -> dict:
+    def run():
+        if setup is not None:
+            setup()
+        return _timed(fn)
+
+    gc.collect()
+    first = run()
+    repeats = max(1, min(max_repeats, int(min_time / first) if first > 0 else max_repeats))
+    times = [first] + [run() for _ in range(repeats - 1)]
+
+    if setup is not None:
+        setup()
+    gc.collect()
+    tracemalloc.start()
+    try:
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        "repeats": len(times),
+        "median_s": statistics.median(times),
+        "min_s": min(times),
+        "peak_bytes": peak,
+    }
+
+
+def build_cases(profile: dict, corpora: Corpora, work_dir: str):
+    """Yield (name, fn, setup) for every case of the profile"""
+    pdf, pdf_extraction, test, feedback = import_backend()
+    parse_classified = load_page_function(CLASSIFY_PAGE, "parse_classified_sentences")
+
+    for pages in profile["pdf_pages"]:
+        data = corpora.pdf(pages)
+        yield f"pdf_extract/pages={pages}", (lambda data=data: pdf.extract_text_from_pdf(data)), None
+
+    extractor = pdf_extraction.PDFExtractor()
+    loop = asyncio.new_event_loop()
+    try:
+        # Start the workers up front so process spawning is not timed
+        loop.run_until_complete(extractor.extract(corpora.pdf(1)))
+        for pages in profile["pdf_pages"]:
+            data = corpora.pdf(pages)
+            yield (
+                f"pdf_extract_pool/pages={pages}",
+                (lambda data=data: loop.run_until_complete(extractor.extract(data))),
+                None,
+            )
+    finally:
+        extractor.close()
+        loop.close()
+
+    for lines in profile["analysis_lines"]:
+        for shape in ("structured", "headings", "unformatted"):
+            reply = corpora.analysis_reply(lines, shape)
+            yield f"parse_test_analysis/{shape}/lines={lines}", (lambda reply=reply: test.parse_test_analysis(reply)), None
+
+    for entries in profile["feedback_entries"]:
+        store = os.path.join(work_dir, f"feedback-{entries}.json")
+        records = corpora.feedback(entries)
+        with open(store, "w", encoding="utf-8") as f:
+            json.dump(records, f, indent=2, ensure_ascii=False)
+        with open(store, "rb") as f:
+            pristine = f.read()
+
+        def reset(store=store, pristine=pristine):
+            feedback.FEEDBACK_FILE = store
+            with open(store, "wb") as f:
+                f.write(pristine)
+
+        def submit():
+            items = feedback.load_feedback_data()
+            items.append({"id": "bench", "name": "bench", "feedback": "benchmark entry", "rating": 5, "timestamp": datetime.now().isoformat()})
+            feedback.save_feedback_data(items)
+
+        yield f"feedback_load/entries={entries}", feedback.load_feedback_data, reset
+        yield f"feedback_save/entries={entries}", (lambda records=records: feedback.save_feedback_data(records)), reset
+        yield f"feedback_submit/entries={entries}", submit, reset
+
+    for lines in profile["classified_lines"]:
+        text = corpora.classified(lines)
+        yield f"parse_classified_sentences/lines={lines}", (lambda text=text: parse_classified(text)), None
+
+
+# ---------------------------------------------------------------- baseline comparison
+
+def compare(results: dict, baseline: dict, threshold: float, memory_threshold: float) -> list:
+    """Cases that regressed beyond the thresholds, as printable lines"""
+    scale = results["calibration_s"] / baseline["calibration_s"] if baseline.get("calibration_s") else 1.0
+    regressions = []
+    for name, current in results["cases"].items():
+        previous = baseline["cases"].get(name)
+        if previous is None:
+            continue
+        # The fastest run is the least disturbed by other load on the machine
+        expected = previous["min_s"] * scale
+        if current["min_s"] > expected * (1 + threshold):
+            regressions.append(f"{name}: {current['min_s'] * 1000:.2f} ms vs baseline {expected * 1000:.2f} ms (min, normalised)")
+        if previous["peak_bytes"] and current["peak_bytes"] > previous["peak_bytes"] * (1 + memory_threshold):
+            regressions.append(f"{name}: peak {current['peak_bytes'] / 2 ** 20:.1f} MiB vs baseline {previous['peak_bytes'] / 2 ** 20:.1f} MiB")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Microbenchmarks for local CPU hot paths")
+    parser.add_argument("--quick", action="store_true", help="smaller corpora")
+    parser.add_argument("--filter", help="only run cases whose name contains this text")
+    parser.add_argument("--data-dir", default=os.path.join(ROOT, "bench_data"), help="cache for generated corpora")
+    parser.add_argument("--min-time", type=float, default=1.0, help="seconds to spend timing each case")
+    parser.add_argument("--out", help="write the results as JSON")
+    parser.add_argument("--baseline", help="compare against this results file and fail on regressions")
+    parser.add_argument("--save-baseline", help="write the results as the new baseline")
+    parser.add_argument("--threshold", type=float, default=0.25, help="allowed slowdown, 0.25 = 25%%")
+    parser.add_argument("--memory-threshold", type=float, default=0.25, help="allowed growth of peak memory")
+    args = parser.parse_args()
+
+    profile_name = "quick" if args.quick else "full"
+    corpora = Corpora(args.data_dir)
+    results = {
+        "profile": profile_name,
+        "created_at": datetime.now().isoformat(),
+        "host": {"python": sys.version.split()[0], "platform": platform.platform(), "cpus": os.cpu_count()},
+        "calibration_s": calibrate(),
+        "cases": {},
+    }
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        # Importing the feedback router creates ./feedback_data: keep it out of the tree
+        cwd = os.getcwd()
+        os.chdir(work_dir)
+        try:
+            for name, fn, setup in build_cases(PROFILES[profile_name], corpora, work_dir):
+                if args.filter and args.filter not in name:
+                    continue
+                stats = measure(fn, setup, min_time=args.min_time)
+                results["cases"][name] = stats
+                print(f"{name:<48} {stats['median_s'] * 1000:>11.3f} ms  (min {stats['min_s'] * 1000:.3f}, n={stats['repeats']})"
+                      f"  peak {stats['peak_bytes'] / 2 ** 20:>8.2f} MiB", flush=True)
+        finally:
+            os.chdir(cwd)
+
+    for path in (args.out, args.save_baseline):
+        if path:
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(results, f, indent=2)
+            print(f"Results written to {path}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold, args.memory_threshold)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) against {args.baseline}:")
+            for line in regressions:
+                print(f"  {line}")
+            sys.exit(1)
+        print(f"\nNo regressions against {args.baseline}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,357 @@
+"""
+Local stand-in for IBM Cloud IAM and the watsonx.ai chat API.
+
+Implements the three upstream endpoints the backend calls:
+
+- POST /identity/token                     IAM apikey -> bearer token
+- POST /ml/v1/text/chat?version=...        chat completion
+- POST /ml/v1/text/chat_stream?version=... the same as server-sent events
+
+Response bodies, usage fields and error payloads are shaped like the real
+service, so the backend runs unmodified against it. Latency, generation speed,
+error injection and token lifetime are configurable from the command line (or
+MOCK_* environment variables) and at runtime through /mock/config.
+
+Run it and point the backend at it:
+
+    python tools/mock_watsonx.py --port 8081 --latency lognormal:0.4,0.5 --tokens-per-second 60
+    UPSTREAM_MOCK_URL=http://127.0.0.1:8081 uvicorn main:app      # from backend/
+
+Latency and token-count distributions are written as `kind:params`:
+`fixed:0.2`, `uniform:0.1,0.6`, `normal:0.3,0.05`, `lognormal:<median>,<sigma>`
+or `exp:<mean>`. Values are seconds (latency) or tokens (completion length).
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import re
+import secrets
+import time
+import uuid
+from dataclasses import asdict, dataclass, fields
+from datetime import datetime, timezone
+
+import uvicorn
+from fastapi import FastAPI, Form, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+
+def sample(spec: str, rng: random.Random) -> float:
+    """Draw one non-negative value from a `kind:params` distribution spec"""
+    kind, _, params = spec.partition(":")
+    args = [float(value) for value in params.split(",") if value.strip()]
+    kind = kind.strip().lower()
+    if kind == "fixed":
+        value = args[0]
+    elif kind == "uniform":
+        value = rng.uniform(args[0], args[1])
+    elif kind == "normal":
+        value = rng.gauss(args[0], args[1])
+    elif kind == "lognormal":
+        value = args[0] * math.exp(rng.gauss(0, args[1]))
+    elif kind == "exp":
+        value = rng.expovariate(1 / args[0]) if args[0] > 0 else 0.0
+    else:
+        raise ValueError(f"Unknown distribution: {spec}")
+    return max(value, 0.0)
+
+
+@dataclass
+class MockConfig:
+    # Time to first token (queueing + prompt processing upstream)
+    latency: str = os.getenv("MOCK_LATENCY", "lognormal:0.3,0.4")
+    # Generation speed once the first token is out
+    tokens_per_second: float = float(os.getenv("MOCK_TOKENS_PER_SECOND", "50"))
+    # Completion length, capped by the request's max_tokens
+    completion_tokens: str = os.getenv("MOCK_COMPLETION_TOKENS", "uniform:40,300")
+    # Fraction of chat calls answered with 429 / a 5xx status
+    error_429_rate: float = float(os.getenv("MOCK_ERROR_429_RATE", "0"))
+    error_5xx_rate: float = float(os.getenv("MOCK_ERROR_5XX_RATE", "0"))
+    # Fraction of streams cut off midway
+    stream_abort_rate: float = float(os.getenv("MOCK_STREAM_ABORT_RATE", "0"))
+    # Concurrent chat calls per model before 429 (0 = unlimited), like a real quota
+    max_concurrency: int = int(os.getenv("MOCK_MAX_CONCURRENCY", "0"))
+    # Lifetime of issued bearer tokens, and latency of the IAM endpoint
+    token_ttl: float = float(os.getenv("MOCK_TOKEN_TTL", "3600"))
+    iam_latency: str = os.getenv("MOCK_IAM_LATENCY", "fixed:0.05")
+    # Reject chat calls without a valid, unexpired token issued by this server
+    check_tokens: bool = os.getenv("MOCK_CHECK_TOKENS", "true").lower() in ("1", "true", "yes")
+
+
+class MockState:
+    def __init__(self, config: MockConfig, seed=None):
+        self.config = config
+        self.rng = random.Random(seed)
+        self.tokens = {}  # access token -> expiration (epoch seconds)
+        self.in_flight = {}
+        self.max_in_flight = 0
+        self.requests = {}
+        self.statuses = {}
+        self.tokens_issued = 0
+        self.usage = {"prompt_tokens": 0, "completion_tokens": 0}
+
+    def count(self, endpoint: str, status: int):
+        self.requests[endpoint] = self.requests.get(endpoint, 0) + 1
+        key = f"{endpoint}:{status}"
+        self.statuses[key] = self.statuses.get(key, 0) + 1
+
+    def stats(self) -> dict:
+        return {
+            "requests": self.requests,
+            "statuses": self.statuses,
+            "in_flight": self.in_flight,
+            "max_in_flight": self.max_in_flight,
+            "tokens_issued": self.tokens_issued,
+            "valid_tokens": sum(1 for expiration in self.tokens.values() if expiration > time.time()),
+            "usage": self.usage,
+        }
+
+
+def estimate_tokens(text: str) -> int:
+    return max(1, math.ceil(len(text) / 4))
+
+
+def error_response(status: int, code: str, message: str) -> JSONResponse:
+    """Error payload in the watsonx.ai format"""
+    return JSONResponse(
+        status_code=status,
+        content={
+            "errors": [{"code": code, "message": message}],
+            "trace": uuid.uuid4().hex,
+            "status_code": status,
+        },
+    )
+
+
+_FILLER = (
+    "the service validates each request before it is queued and the result is returned to the caller "
+    "while the design keeps components small testable and independent so that deployment stays predictable"
+).split()
+
+
+def make_reply(messages: list, completion_tokens: int, rng: random.Random) -> str:
+    """Plausible reply text of roughly `completion_tokens` tokens"""
+    system = " ".join(str(m.get("content", "")) for m in messages if m.get("role") == "system")
+    user = str(messages[-1].get("content", "")) if messages else ""
+    if "| Phase:" in system:
+        # The PDF classifier prompt: answer in the format its parser expects
+        phases = ["Requirements", "Design", "Development", "Testing", "Deployment", "General"]
+        sentences = [s.strip() for s in re.split(r"(?<=[.!?])\s+", user) if len(s.strip()) > 3][1:]
+        lines, budget = [], completion_tokens * 4
+        for sentence in sentences:
+            line = f"Sentence: {sentence} | Phase: {rng.choice(phases)}"
+            if budget - len(line) < 0 and lines:
+                break
+            lines.append(line)
+            budget -= len(line)
+        if lines:
+            return "\n".join(lines)
+    # ~1.3 tokens per filler word
+    words = [rng.choice(_FILLER) for _ in range(max(1, int(completion_tokens / 1.3)))]
+    return " ".join(words).capitalize() + "."
+
+
+def create_app(config: MockConfig, seed=None) -> FastAPI:
+    state = MockState(config, seed)
+    app = FastAPI(title="Mock watsonx.ai + IAM")
+    app.state.mock = state
+
+    @app.post("/identity/token")
+    async def identity_token(grant_type: str = Form(None), apikey: str = Form(None)):
+        await asyncio.sleep(sample(state.config.iam_latency, state.rng))
+        if grant_type != "urn:ibm:params:oauth:grant-type:apikey" or not apikey:
+            state.count("iam", 400)
+            return JSONResponse(
+                status_code=400,
+                content={"errorCode": "BXNIM0415E", "errorMessage": "Provided API key could not be found."},
+            )
+        now = int(time.time())
+        token = "mock-" + secrets.token_urlsafe(24)
+        state.tokens[token] = now + state.config.token_ttl
+        # Forget long-expired tokens
+        for stale in [t for t, expiration in state.tokens.items() if expiration < now - 3600]:
+            del state.tokens[stale]
+        state.tokens_issued += 1
+        state.count("iam", 200)
+        return {
+            "access_token": token,
+            "refresh_token": "not_supported",
+            "token_type": "Bearer",
+            "expires_in": int(state.config.token_ttl),
+            "expiration": int(now + state.config.token_ttl),
+            "scope": "ibm openid",
+        }
+
+    async def admit(request: Request, endpoint: str):
+        """Common checks of both chat endpoints; returns (body, error response)"""
+        if state.config.check_tokens:
+            auth = request.headers.get("authorization", "")
+            token = auth[len("Bearer "):] if auth.startswith("Bearer ") else ""
+            if state.tokens.get(token, 0) <= time.time():
+                state.count(endpoint, 401)
+                return None, error_response(401, "authentication_token_expired", "Failed to authenticate the request due to an expired token")
+        try:
+            body = await request.json()
+            model_id = body["model_id"]
+            messages = body["messages"]
+        except (ValueError, KeyError, TypeError):
+            state.count(endpoint, 400)
+            return None, error_response(400, "json_validation_error", "Invalid request body")
+
+        roll = state.rng.random()
+        limit = state.config.max_concurrency
+        if roll < state.config.error_429_rate or (limit and state.in_flight.get(model_id, 0) >= limit):
+            state.count(endpoint, 429)
+            return None, error_response(429, "too_many_requests", "The number of requests exceeds the rate limit")
+        if roll < state.config.error_429_rate + state.config.error_5xx_rate:
+            status = state.rng.choice([500, 502, 503])
+            state.count(endpoint, status)
+            return None, error_response(status, "internal_server_error", "Injected upstream failure")
+        if not isinstance(messages, list):
+            state.count(endpoint, 400)
+            return None, error_response(400, "json_validation_error", "messages must be a list")
+        return body, None
+
+    def plan(body: dict):
+        """(prompt tokens, completion tokens, time to first token) for one call"""
+        prompt_tokens = sum(estimate_tokens(str(m.get("content", ""))) for m in body["messages"])
+        completion_tokens = int(sample(state.config.completion_tokens, state.rng)) or 1
+        completion_tokens = min(completion_tokens, int(body.get("max_tokens") or completion_tokens))
+        return prompt_tokens, completion_tokens, sample(state.config.latency, state.rng)
+
+    def enter(model_id: str):
+        state.in_flight[model_id] = state.in_flight.get(model_id, 0) + 1
+        state.max_in_flight = max(state.max_in_flight, sum(state.in_flight.values()))
+
+    def leave(model_id: str):
+        state.in_flight[model_id] -= 1
+
+    def usage(prompt_tokens: int, completion_tokens: int) -> dict:
+        state.usage["prompt_tokens"] += prompt_tokens
+        state.usage["completion_tokens"] += completion_tokens
+        return {
+            "completion_tokens": completion_tokens,
+            "prompt_tokens": prompt_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        }
+
+    def envelope(model_id: str) -> dict:
+        return {
+            "id": f"chat-{uuid.uuid4().hex}",
+            "model_id": model_id,
+            "model": model_id,
+            "created": int(time.time()),
+            "model_version": "3.2.0",
+            "created_at": datetime.now(timezone.utc).isoformat(timespec="milliseconds").replace("+00:00", "Z"),
+        }
+
+    @app.post("/ml/v1/text/chat")
+    async def chat(request: Request):
+        body, error = await admit(request, "chat")
+        if error is not None:
+            return error
+        model_id = body["model_id"]
+        prompt_tokens, completion_tokens, first_token = plan(body)
+        enter(model_id)
+        try:
+            await asyncio.sleep(first_token + completion_tokens / max(state.config.tokens_per_second, 1e-6))
+        finally:
+            leave(model_id)
+        content = make_reply(body["messages"], completion_tokens, state.rng)
+        state.count("chat", 200)
+        return {
+            **envelope(model_id),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": usage(prompt_tokens, completion_tokens),
+        }
+
+    @app.post("/ml/v1/text/chat_stream")
+    async def chat_stream(request: Request):
+        body, error = await admit(request, "chat_stream")
+        if error is not None:
+            return error
+        model_id = body["model_id"]
+        prompt_tokens, completion_tokens, first_token = plan(body)
+        content = make_reply(body["messages"], completion_tokens, state.rng)
+        pieces = re.findall(r"\S+\s*|\s+", content)
+        abort_at = int(len(pieces) * state.rng.random()) if state.rng.random() < state.config.stream_abort_rate else None
+        interval = completion_tokens / max(state.config.tokens_per_second, 1e-6) / max(len(pieces), 1)
+        head = envelope(model_id)
+
+        async def events():
+            enter(model_id)
+            try:
+                await asyncio.sleep(first_token)
+                for index, piece in enumerate(pieces):
+                    if index == abort_at:
+                        state.count("chat_stream", "aborted")
+                        # Drop the connection mid-stream
+                        raise ConnectionResetError("Injected stream abort")
+                    first = {"role": "assistant", "content": piece} if index == 0 else {"content": piece}
+                    chunk = {**head, "choices": [{"index": 0, "finish_reason": None, "delta": first}]}
+                    yield f"id: {index + 1}\nevent: message\ndata: {json.dumps(chunk)}\n\n"
+                    await asyncio.sleep(interval)
+                last = {
+                    **head,
+                    "choices": [{"index": 0, "finish_reason": "stop", "delta": {"content": ""}}],
+                    "usage": usage(prompt_tokens, completion_tokens),
+                }
+                yield f"id: {len(pieces) + 1}\nevent: message\ndata: {json.dumps(last)}\n\n"
+                state.count("chat_stream", 200)
+            finally:
+                leave(model_id)
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    @app.get("/mock/config")
+    async def get_config():
+        return asdict(state.config)
+
+    @app.patch("/mock/config")
+    async def update_config(changes: dict):
+        """Change any MockConfig field while the server runs, e.g. {"error_429_rate": 0.2}"""
+        known = {f.name: f.type for f in fields(MockConfig)}
+        unknown = sorted(set(changes) - set(known))
+        if unknown:
+            return JSONResponse(status_code=400, content={"detail": f"Unknown settings: {', '.join(unknown)}"})
+        for name, value in changes.items():
+            setattr(state.config, name, value)
+        return asdict(state.config)
+
+    @app.post("/mock/expire-tokens")
+    async def expire_tokens():
+        """Invalidate every issued token, forcing the next calls through the 401 path"""
+        expired = len(state.tokens)
+        state.tokens.clear()
+        return {"expired": expired}
+
+    @app.get("/mock/stats")
+    async def get_stats():
+        return state.stats()
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mock watsonx.ai + IAM server for offline load and latency testing")
+    parser.add_argument("--host", default=os.getenv("MOCK_HOST", "127.0.0.1"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("MOCK_PORT", "8081")))
+    parser.add_argument("--seed", type=int, default=os.getenv("MOCK_SEED"), help="seed the random draws for repeatable runs")
+    defaults = MockConfig()
+    for f in fields(MockConfig):
+        flag = "--" + f.name.replace("_", "-")
+        if f.type is bool:
+            parser.add_argument(flag, type=lambda v: v.lower() in ("1", "true", "yes"), default=getattr(defaults, f.name))
+        else:
+            parser.add_argument(flag, type=f.type, default=getattr(defaults, f.name))
+    args = parser.parse_args()
+
+    config = MockConfig(**{f.name: getattr(args, f.name) for f in fields(MockConfig)})
+    uvicorn.run(create_app(config, args.seed), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
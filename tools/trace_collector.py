@@ -0,0 +1,180 @@
+"""
+Local stand-in for an OpenTelemetry Collector, and a viewer for the traces it
+(or the backend's file exporter) writes.
+
+Receives OTLP/HTTP trace exports (protobuf or JSON) on POST /v1/traces and
+appends every span as one JSON line, in the same format as the backend's
+TRACING_EXPORTER=file output:
+
+    python tools/trace_collector.py --port 4318 --out traces/collected.jsonl
+    TRACING_ENABLED=true TRACING_EXPORTER=otlp uvicorn main:app              # from backend/
+    TRACING_ENABLED=true streamlit run Home.py                               # from Frontend/
+
+Print the most recent traces as span trees, with the attributes that matter
+for latency work (model, tokens, cache outcome, PDF pages):
+
+    python tools/trace_collector.py --show traces/collected.jsonl --limit 5
+
+Decoding OTLP needs the `opentelemetry-proto` package (installed with
+opentelemetry-exporter-otlp-proto-http); --show needs nothing.
+"""
+import argparse
+import json
+import os
+import threading
+from collections import defaultdict
+
+# Shown next to each span in --show
+HIGHLIGHT_ATTRIBUTES = (
+    "http.route",
+    "http.response.status_code",
+    "smartsdlc.endpoint",
+    "gen_ai.request.model",
+    "gen_ai.usage.input_tokens",
+    "gen_ai.usage.output_tokens",
+    "smartsdlc.cache",
+    "smartsdlc.pdf.page_count",
+)
+
+
+def _any_value(value):
+    kind = value.WhichOneof("value")
+    if kind is None:
+        return None
+    if kind == "array_value":
+        return [_any_value(v) for v in value.array_value.values]
+    if kind == "kvlist_value":
+        return {kv.key: _any_value(kv.value) for kv in value.kvlist_value.values}
+    if kind == "bytes_value":
+        return value.bytes_value.hex()
+    return getattr(value, kind)
+
+
+def otlp_records(request) -> list:
+    """Flatten an ExportTraceServiceRequest into span records"""
+    from opentelemetry.proto.trace.v1.trace_pb2 import Span, Status
+
+    records = []
+    for resource_spans in request.resource_spans:
+        resource = {kv.key: _any_value(kv.value) for kv in resource_spans.resource.attributes}
+        for scope_spans in resource_spans.scope_spans:
+            for span in scope_spans.spans:
+                records.append({
+                    "trace_id": span.trace_id.hex(),
+                    "span_id": span.span_id.hex(),
+                    "parent_span_id": span.parent_span_id.hex() or None,
+                    "name": span.name,
+                    "kind": Span.SpanKind.Name(span.kind).replace("SPAN_KIND_", ""),
+                    "service": resource.get("service.name"),
+                    "start_unix_nano": span.start_time_unix_nano,
+                    "end_unix_nano": span.end_time_unix_nano,
+                    "duration_ms": round((span.end_time_unix_nano - span.start_time_unix_nano) / 1e6, 3),
+                    "status": Status.StatusCode.Name(span.status.code).replace("STATUS_CODE_", ""),
+                    "attributes": {kv.key: _any_value(kv.value) for kv in span.attributes},
+                })
+    return records
+
+
+def create_app(out_path: str):
+    from fastapi import FastAPI, Request, Response
+    from google.protobuf import json_format
+    from opentelemetry.proto.collector.trace.v1.trace_service_pb2 import (
+        ExportTraceServiceRequest,
+        ExportTraceServiceResponse,
+    )
+
+    app = FastAPI(title="Trace collector stand-in")
+    lock = threading.Lock()
+    stats = {"exports": 0, "spans": 0}
+    directory = os.path.dirname(out_path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    @app.post("/v1/traces")
+    async def export_traces(request: Request):
+        payload = await request.body()
+        export = ExportTraceServiceRequest()
+        is_json = request.headers.get("content-type", "").startswith("application/json")
+        if is_json:
+            json_format.Parse(payload, export)
+        else:
+            export.ParseFromString(payload)
+        records = otlp_records(export)
+        with lock, open(out_path, "a", encoding="utf-8") as f:
+            for record in records:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            stats["exports"] += 1
+            stats["spans"] += len(records)
+        if is_json:
+            return {}
+        return Response(ExportTraceServiceResponse().SerializeToString(), media_type="application/x-protobuf")
+
+    @app.get("/stats")
+    async def collector_stats():
+        return {**stats, "out": out_path}
+
+    return app
+
+
+def load_traces(path: str) -> dict:
+    traces = defaultdict(list)
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                traces[record["trace_id"]].append(record)
+    return traces
+
+
+def show(path: str, limit: int):
+    traces = load_traces(path)
+    latest = sorted(traces.values(), key=lambda spans: min(s["start_unix_nano"] for s in spans))[-limit:]
+    for spans in latest:
+        ids = {span["span_id"] for span in spans}
+        children = defaultdict(list)
+        # Spans whose parent was not exported (e.g. an untraced frontend) are shown as roots
+        roots = []
+        for span in sorted(spans, key=lambda s: s["start_unix_nano"]):
+            if span["parent_span_id"] in ids:
+                children[span["parent_span_id"]].append(span)
+            else:
+                roots.append(span)
+        trace_start = min(s["start_unix_nano"] for s in spans)
+        print(f"trace {spans[0]['trace_id']} ({len(spans)} spans)")
+
+        def walk(span, depth):
+            offset = (span["start_unix_nano"] - trace_start) / 1e6
+            attrs = " ".join(
+                f"{key.rsplit('.', 1)[-1] if key.startswith('gen_ai.usage') else key}={span['attributes'][key]}"
+                for key in HIGHLIGHT_ATTRIBUTES if key in span["attributes"]
+            )
+            status = " ERROR" if span["status"] == "ERROR" else ""
+            print(f"  {'  ' * depth}{span['name']:<{max(40 - 2 * depth, 10)}} +{offset:9.1f} ms {span['duration_ms']:9.1f} ms  [{span['service']}]{status} {attrs}")
+            for child in children[span["span_id"]]:
+                walk(child, depth + 1)
+
+        for root in roots:
+            walk(root, 0)
+        print()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="OTLP/HTTP trace collector stand-in and trace viewer")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=4318)
+    parser.add_argument("--out", default=os.path.join("traces", "collected.jsonl"), help="JSON lines file the spans are appended to")
+    parser.add_argument("--show", metavar="FILE", help="print the traces in FILE as span trees instead of collecting")
+    parser.add_argument("--limit", type=int, default=10, help="with --show: number of most recent traces")
+    args = parser.parse_args()
+
+    if args.show:
+        show(args.show, args.limit)
+        return
+
+    import uvicorn
+
+    uvicorn.run(create_app(args.out), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()